@@ -1,5 +1,19 @@
+from .http_client import HTTPClient, get_http_client
+from .metrics import MetricsRecorder, get_metrics
+from .instance_output import InstancePrefixedStream, prefix_instance_output
+from .phase_scheduler import PhaseScheduler
+from .server_waiter import ServerWaiter, get_server_waiter
 from .vm_manager import VMManager
+from .ssh_pool import SSHConnectionPool, get_ssh_pool
 from .ssh_manager import SSHManager
+from .readiness import ReadinessProber
+from .jenkins_readiness import JenkinsReadinessWaiter
+from .image_cache import JenkinsImageCache, get_image_cache
+from .config_sync import ConfigRepoSync
+from .repo_cache import RepoMirrorCache, get_repo_cache
+from .jcasc_config import JCasCConfig
+from .image_builder import ImageBuilder
+from .dns_propagation import DNSPropagationChecker
 from .dns_manager import DNSManager
 from .jenkins_installer import JenkinsInstaller
 from .jenkins_job_manager import JenkinsJobManager
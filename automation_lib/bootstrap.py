@@ -0,0 +1,72 @@
+import hashlib
+
+
+DOCKER_INSTALL_COMMANDS = [
+    "sudo apt-get update -y",
+    "sudo apt-get install -y ca-certificates curl gnupg lsb-release",
+    "sudo mkdir -p /etc/apt/keyrings",
+    "curl -fsSL https://download.docker.com/linux/ubuntu/gpg | sudo gpg --dearmor -o /etc/apt/keyrings/docker.gpg",
+    'echo "deb [arch=$(dpkg --print-architecture) signed-by=/etc/apt/keyrings/docker.gpg] '
+    'https://download.docker.com/linux/ubuntu $(lsb_release -cs) stable" | '
+    'sudo tee /etc/apt/sources.list.d/docker.list > /dev/null',
+    "sudo apt-get update -y",
+    "sudo apt-get install -y docker-ce docker-ce-cli containerd.io",
+    # Everything runs as root, over SSH as well as under cloud-init (where $USER is not set)
+    "sudo usermod -aG docker root",
+    "sudo chmod 666 /var/run/docker.sock"
+]
+
+AGENT_INSTALL_COMMANDS = [
+    # Installiere Java 17
+    "sudo apt-get update -y",
+    "sudo apt-get install -y openjdk-17-jre-headless",
+    # Installiere Docker
+    "sudo apt-get install -y apt-transport-https ca-certificates curl gnupg lsb-release",
+    "curl -fsSL https://download.docker.com/linux/ubuntu/gpg | sudo gpg --dearmor -o /usr/share/keyrings/docker-archive-keyring.gpg",
+    'echo "deb [arch=$(dpkg --print-architecture) signed-by=/usr/share/keyrings/docker-archive-keyring.gpg] '
+    'https://download.docker.com/linux/ubuntu $(lsb_release -cs) stable" | '
+    'sudo tee /etc/apt/sources.list.d/docker.list > /dev/null',
+    "sudo apt-get update -y",
+    "sudo apt-get install -y docker-ce docker-ce-cli containerd.io",
+    # Füge den Benutzer zur Docker-Gruppe hinzu
+    "sudo usermod -aG docker root",
+    # Starte und aktiviere den Docker-Dienst
+    "sudo systemctl start docker",
+    "sudo systemctl enable docker",
+    # Erstelle das .ssh-Verzeichnis und setze Berechtigungen (HOME ist unter cloud-init nicht gesetzt)
+    "mkdir -p /root/.ssh",
+    "chmod 700 /root/.ssh"
+]
+
+BOOTSTRAP_COMMANDS = {
+    "controller": DOCKER_INSTALL_COMMANDS,
+    "agent": AGENT_INSTALL_COMMANDS,
+}
+
+# Baked into golden images only: pre-pull the Jenkins base image of the config repos' Dockerfiles
+IMAGE_EXTRA_COMMANDS = {
+    "controller": ["docker pull jenkins/jenkins:lts"],
+    "agent": [],
+}
+
+
+def render_user_data(role, for_image=False):
+    """Render the cloud-init user data that bootstraps a controller or agent VM."""
+    if role not in BOOTSTRAP_COMMANDS:
+        raise ValueError(f"No bootstrap commands for role {role}")
+    # A failing command makes the script fail, which cloud-init reports via `cloud-init status`
+    lines = [
+        "#!/bin/bash",
+        "set -eo pipefail",
+        "export DEBIAN_FRONTEND=noninteractive",
+    ]
+    lines += BOOTSTRAP_COMMANDS[role]
+    if for_image:
+        lines += IMAGE_EXTRA_COMMANDS[role]
+    return "\n".join(lines) + "\n"
+
+
+def recipe_hash(role, base_image):
+    """Content hash of a golden image recipe; a changed hash means the snapshot must be rebuilt."""
+    recipe = f"{base_image}\n{render_user_data(role, for_image=True)}"
+    return hashlib.sha256(recipe.encode()).hexdigest()[:16]
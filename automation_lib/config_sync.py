@@ -0,0 +1,142 @@
+import gzip
+import hashlib
+import io
+import json
+import os
+import shlex
+import tarfile
+import time
+
+
+class ConfigRepoSync:
+    """Syncs a local directory to a controller by content hash.
+
+    A manifest of relative path -> SHA-256 is kept on the remote host next
+    to the synced directory. Only files whose hash differs are sent, as one
+    tar.gz streamed into `tar -xzf -` on the remote side; files that are no
+    longer present locally are deleted there.
+    """
+
+    SKIP_DIRS = {".git"}
+    REMOVED_LIST = ".sync_removed"
+    NEW_MANIFEST = ".sync_manifest.json"
+
+    def __init__(self, ssh_manager, remote_dir="/var/jenkins_home/jenkins_configs", manifest_file=None, compresslevel=6):
+        self.ssh_manager = ssh_manager
+        self.remote_dir = remote_dir.rstrip('/')
+        # Outside of remote_dir, so it does not end up in the docker build context
+        self.manifest_file = manifest_file or f"{self.remote_dir}.manifest.json"
+        self.compresslevel = compresslevel
+
+
+    def local_manifest(self, local_path):
+        manifest = {}
+        for root, dirs, files in os.walk(local_path):
+            dirs[:] = [d for d in dirs if d not in self.SKIP_DIRS]
+            for name in files:
+                file_path = os.path.join(root, name)
+                if os.path.islink(file_path) or not os.path.isfile(file_path):
+                    continue
+                digest = hashlib.sha256()
+                with open(file_path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(1048576), b""):
+                        digest.update(chunk)
+                manifest[os.path.relpath(file_path, local_path)] = {
+                    "sha256": digest.hexdigest(),
+                    "size": os.path.getsize(file_path)
+                }
+        return manifest
+
+
+    def remote_manifest(self):
+        # An unreadable or missing manifest means everything is sent
+        remote_dir = shlex.quote(self.remote_dir)
+        manifest_file = shlex.quote(self.manifest_file)
+        output = io.BytesIO()
+        received = self.ssh_manager.pipe_from_command(
+            f"if [ -d {remote_dir} ] && [ -f {manifest_file} ]; then sudo cat {manifest_file}; fi", output)
+        if not received:
+            return {}
+        try:
+            return json.loads(output.getvalue().decode())
+        except ValueError:
+            self.ssh_manager.log(f"Ignoring invalid remote manifest {self.manifest_file}")
+            return {}
+
+
+    def add_bytes(self, archive, name, data):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = int(time.time())
+        info.mode = 0o644
+        archive.addfile(info, io.BytesIO(data))
+
+
+    def write_archive(self, writer, local_path, changed, removed, manifest):
+        with gzip.GzipFile(fileobj=writer, mode='wb', compresslevel=self.compresslevel) as compressed:
+            with tarfile.open(fileobj=compressed, mode='w|') as archive:
+                for name in changed:
+                    info = archive.gettarinfo(os.path.join(local_path, name), arcname=name)
+                    info.uid = info.gid = 0
+                    info.uname = info.gname = "root"
+                    with open(os.path.join(local_path, name), 'rb') as f:
+                        archive.addfile(info, f)
+                self.add_bytes(archive, self.REMOVED_LIST, b"".join(name.encode() + b"\0" for name in removed))
+                self.add_bytes(archive, self.NEW_MANIFEST, json.dumps(manifest, indent=1, sort_keys=True).encode())
+
+
+    def remote_command(self):
+        remote_dir = shlex.quote(self.remote_dir)
+        script = "\n".join([
+            "set -e",
+            f"mkdir -p {remote_dir}",
+            f"tar -xzf - -C {remote_dir}",
+            f"cd {remote_dir}",
+            f"xargs -0 -r rm -f -- < {self.REMOVED_LIST}",
+            f"rm -f {self.REMOVED_LIST}",
+            "find . -mindepth 1 -type d -empty -delete",
+            # Written last, so an interrupted sync is redone on the next run
+            f"mv {self.NEW_MANIFEST} {shlex.quote(self.manifest_file)}",
+        ])
+        return f"sudo sh -c {shlex.quote(script)}"
+
+
+    def sync(self, local_path):
+        # Returns a dict with success, the file counts and bytes sent/skipped (uncompressed) and on the wire
+        start_time = time.time()
+        manifest = self.local_manifest(local_path)
+        remote = self.remote_manifest()
+        changed = sorted(
+            name for name, entry in manifest.items()
+            if remote.get(name, {}).get("sha256") != entry["sha256"]
+        )
+        removed = sorted(name for name in remote if name not in manifest)
+        result = {
+            "success": False,
+            "files_sent": len(changed),
+            "files_skipped": len(manifest) - len(changed),
+            "files_removed": len(removed),
+            "bytes_sent": sum(manifest[name]["size"] for name in changed),
+            "bytes_skipped": sum(entry["size"] for name, entry in manifest.items() if name not in changed),
+            "wire_bytes": 0
+        }
+        if not changed and not removed and remote:
+            result["success"] = True
+            self.ssh_manager.log(f"Config repo on {self.remote_dir} is up to date ({len(manifest)} files)")
+            return result
+
+        wire_bytes = self.ssh_manager.write_to_command(
+            self.remote_command(),
+            lambda writer: self.write_archive(writer, local_path, changed, removed, manifest)
+        )
+        if wire_bytes is None:
+            self.ssh_manager.log(f"Config repo sync to {self.remote_dir} failed")
+            return result
+        result["success"] = True
+        result["wire_bytes"] = wire_bytes
+        self.ssh_manager.log(
+            f"Config repo synced in {time.time() - start_time:.1f}s: {result['files_sent']} file(s) sent "
+            f"({result['bytes_sent']} bytes, {wire_bytes} compressed), {result['files_skipped']} unchanged "
+            f"({result['bytes_skipped']} bytes skipped), {result['files_removed']} removed"
+        )
+        return result
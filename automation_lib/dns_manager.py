@@ -1,29 +1,66 @@
-import requests
-import time
-import dns.resolver
+import os
+import threading
+from automation_lib.http_client import get_http_client
+from automation_lib.dns_propagation import DNSPropagationChecker
+from automation_lib.metrics import get_metrics
+
+
+DNS_API_URL = os.getenv('HETZNER_DNS_API_URL', "https://dns.hetzner.com/api/v1")
 
 
 class DNSManager:
-    def __init__(self, dns_api_token, zone_name):
+    def __init__(self, dns_api_token, zone_name, http_client=None, public_resolvers=None, nameservers=None):
         self.dns_api_token = dns_api_token
         self.zone_name = zone_name
+        self.http = http_client or get_http_client()
+        if public_resolvers is None:
+            # Comma separated list of resolvers that must also see the record, e.g. "1.1.1.1,8.8.8.8"
+            public_resolvers = [r.strip() for r in os.getenv('DNS_CHECK_RESOLVERS', '').split(',') if r.strip()]
+        if nameservers is None:
+            # Nameservers to ask instead of the zone's NS records, e.g. a local test server
+            nameservers = [r.strip() for r in os.getenv('DNS_CHECK_NAMESERVERS', '').split(',') if r.strip()] or None
+        self.propagation_checker = DNSPropagationChecker(zone_name, public_resolvers=public_resolvers, nameservers=nameservers,
+                                                         port=int(os.getenv('DNS_CHECK_PORT', '53')))
+        # Domain -> seconds until the record was visible on all checked nameservers
+        self.propagation_times = {}
+        # Zone IDs are cached for the lifetime of the manager
+        self.zone_ids = {}
+        # Record name -> list of records of self.zone_name, filled by refresh_record_index
+        self.record_index = None
+        self.lock = threading.Lock()
+        # Serializes the first refresh when concurrent upserts share the index
+        self.refresh_lock = threading.Lock()
+        # Records queued by create_dns_record_batched that were not sent yet
+        self.batch = None
+        self.batch_lock = threading.Lock()
+
 
+    def headers(self, json_body=False):
+        headers = {
+            "Auth-API-Token": self.dns_api_token
+        }
+        if json_body:
+            headers["Content-Type"] = "application/json"
+        return headers
 
 
+    def record_name(self, domain):
+        suffix = f".{self.zone_name}"
+        if domain.endswith(suffix):
+            return domain[:-len(suffix)]
+        return domain.split('.')[0]
+
 
 
     def create_dns_record(self, domain, ip_address):
-        url = "https://dns.hetzner.com/api/v1/records"
-        subdomain = domain.split('.')[0]
+        subdomain = self.record_name(domain)
         print(f"Creating DNS record for {domain} with {subdomain} ")
-        headers = {
-            "Auth-API-Token": self.dns_api_token,
-            "Content-Type": "application/json"
-        }
 
         zone_id = self.get_zone_id(self.zone_name)
         print(f"Zone ID: {zone_id}")
-
+        if not zone_id:
+            print("Failed to create DNS record: zone not found")
+            return False
 
         data = {
             "value": ip_address,
@@ -33,86 +70,295 @@ class DNSManager:
             "zone_id": zone_id
         }
 
-        response = requests.post(url, headers=headers, json=data)
-        if response.status_code in [200, 201]:
-            print("DNS record created successfully")
+        # Update an existing A record instead of creating a duplicate
+        existing = self.find_records(subdomain, record_type="A")
+        if existing and existing[0]["value"] == ip_address:
+            print("DNS record already up to date")
+            success = True
+        elif existing:
+            record_id = existing[0]["id"]
+            response = self.http.put(f"{DNS_API_URL}/records/{record_id}", headers=self.headers(json_body=True), json=data)
+            success = self.handle_record_response(response, "updated")
         else:
-            print("Failed to create DNS record", response.status_code)
-            print(response.json())
-            
+            response = self.http.post(f"{DNS_API_URL}/records", headers=self.headers(json_body=True), json=data)
+            success = self.handle_record_response(response, "created")
+
         if self.wait_for_dns_propagation(domain, ip_address):
             print("DNS propagation completed.")
         else:
             print("DNS propagation not successful.")
+        return success
+
+
+    def handle_record_response(self, response, action):
+        if response.status_code in [200, 201]:
+            print(f"DNS record {action} successfully")
+            record = response.json().get("record")
+            if record:
+                self.index_record(record)
+            return True
+        print(f"Failed to {action[:-1]} DNS record", response.status_code)
+        print(response.json())
+        return False
+
+
+
+
+
 
-            
-            
-            
-            
-            
     def get_zone_id(self, zone_name):
-        url = "https://dns.hetzner.com/api/v1/zones"
-        headers = {
-            "Auth-API-Token": self.dns_api_token
-        }
-        response = requests.get(url, headers=headers)
+        if zone_name in self.zone_ids:
+            return self.zone_ids[zone_name]
+        # Let the API filter by name instead of downloading every zone
+        response = self.http.get(f"{DNS_API_URL}/zones", headers=self.headers(), params={"name": zone_name})
+        if response.status_code != 200:
+            print("Failed to retrieve DNS zones", response.status_code)
+            return None
         zones = response.json().get("zones", [])
         for zone in zones:
             if zone["name"] == zone_name:
+                self.zone_ids[zone_name] = zone["id"]
                 return zone["id"]
         print("Zone not found for zone name:", zone_name)
-        return None        
-            
-            
-            
-            
-            
-            
-    def delete_dns_record(self, domain):
-        url = "https://dns.hetzner.com/api/v1/records"
-        headers = {
-            "Auth-API-Token": self.dns_api_token
-        }
+        return None
+
+
+
+    def get_records(self, zone_id, per_page=100):
+        # The records endpoint only filters by zone; walk all pages of that zone
+        records = []
+        page = 1
+        while True:
+            response = self.http.get(
+                f"{DNS_API_URL}/records",
+                headers=self.headers(),
+                params={"zone_id": zone_id, "page": page, "per_page": per_page}
+            )
+            if response.status_code != 200:
+                print("Failed to retrieve DNS records", response.status_code)
+                print(response.json())
+                return None
+            body = response.json()
+            page_records = body.get("records", [])
+            records.extend(page_records)
+            pagination = (body.get("meta") or {}).get("pagination")
+            if pagination:
+                if page >= pagination.get("last_page", page):
+                    break
+            elif len(page_records) < per_page:
+                break
+            page += 1
+        return records
 
+
+    def refresh_record_index(self):
+        zone_id = self.get_zone_id(self.zone_name)
+        if not zone_id:
+            return False
+        records = self.get_records(zone_id)
+        if records is None:
+            return False
+        index = {}
+        for record in records:
+            index.setdefault(record["name"], []).append(record)
+        with self.lock:
+            self.record_index = index
+        print(f"Indexed {len(records)} DNS records of zone {self.zone_name}")
+        return True
+
+
+    def index_record(self, record):
+        with self.lock:
+            if self.record_index is None:
+                return
+            records = [r for r in self.record_index.get(record["name"], []) if r["id"] != record["id"]]
+            records.append(record)
+            self.record_index[record["name"]] = records
+
+
+    def unindex_record(self, record):
+        with self.lock:
+            if self.record_index is None:
+                return
+            records = [r for r in self.record_index.get(record["name"], []) if r["id"] != record["id"]]
+            if records:
+                self.record_index[record["name"]] = records
+            else:
+                self.record_index.pop(record["name"], None)
+
+
+    def find_records(self, name, record_type=None, refresh=False):
+        if refresh or self.record_index is None:
+            self.refresh_record_index()
+        with self.lock:
+            records = list((self.record_index or {}).get(name, []))
+        if record_type:
+            records = [r for r in records if r["type"] == record_type]
+        return records
+
+
+
+
+
+
+    def delete_dns_record(self, domain):
         zone_id = self.get_zone_id(self.zone_name)
         if not zone_id:
             print("Zone ID not found.")
-            return
-
-        response = requests.get(url, headers=headers)
-        if response.status_code == 200:
-            records = response.json().get("records", [])
-            for record in records:
-                if record["zone_id"] == zone_id and record["name"] == domain.split('.')[0]:
-                    record_id = record["id"]
-                    delete_url = f"{url}/{record_id}"
-                    delete_response = requests.delete(delete_url, headers=headers)
-                    if delete_response.status_code == 200:
-                        print("DNS record deleted successfully")
-                    else:
-                        print("Failed to delete DNS record", delete_response.status_code)
-                        print(delete_response.json())
-                        return
+            return False
+
+        records = self.find_records(self.record_name(domain), refresh=True)
+        for record in records:
+            delete_response = self.http.delete(f"{DNS_API_URL}/records/{record['id']}", headers=self.headers())
+            if delete_response.status_code == 200:
+                print("DNS record deleted successfully")
+                self.unindex_record(record)
+            else:
+                print("Failed to delete DNS record", delete_response.status_code)
+                print(delete_response.json())
+                return False
+        return True
+
+
+
+
+    def create_dns_records(self, records, wait=True, refresh=True):
+        # records: list of (domain, ip_address) pairs, upserted with the bulk endpoints.
+        # With refresh=False the record index is only fetched if there is none yet, so
+        # consecutive batches of create_dns_record_batched share a single listing of the zone
+        zone_id = self.get_zone_id(self.zone_name)
+        if not zone_id:
+            print("Failed to create DNS records: zone not found")
+            return False
+        if refresh:
+            self.refresh_record_index()
         else:
-            print("Failed to retrieve DNS records", response.status_code)
-            print(response.json())    
+            with self.refresh_lock:
+                if self.record_index is None:
+                    self.refresh_record_index()
 
+        to_create = []
+        to_update = []
+        for domain, ip_address in records:
+            name = self.record_name(domain)
+            data = {
+                "value": ip_address,
+                "ttl": 300,
+                "type": "A",
+                "name": name,
+                "zone_id": zone_id
+            }
+            existing = self.find_records(name, record_type="A")
+            if not existing:
+                to_create.append(data)
+            elif existing[0]["value"] != ip_address:
+                data["id"] = existing[0]["id"]
+                to_update.append(data)
+        print(f"DNS bulk upsert: {len(to_create)} to create, {len(to_update)} to update, "
+              f"{len(records) - len(to_create) - len(to_update)} unchanged")
 
+        success = True
+        with get_metrics().span("dns_upsert", records=len(records)) as span:
+            if to_create:
+                response = self.http.post(f"{DNS_API_URL}/records/bulk", headers=self.headers(json_body=True), json={"records": to_create})
+                success = self.handle_bulk_response(response, "created", "invalid_records") and success
+            if to_update:
+                response = self.http.put(f"{DNS_API_URL}/records/bulk", headers=self.headers(json_body=True), json={"records": to_update})
+                success = self.handle_bulk_response(response, "updated", "failed_records") and success
+            span["status"] = "ok" if success else "error"
 
+        if wait:
+            times = self.wait_for_dns_propagation_many(dict(records))
+            for domain, elapsed in times.items():
+                if elapsed is None:
+                    print(f"DNS propagation not successful for {domain}.")
+                    success = False
+        return success
 
-    def wait_for_dns_propagation(self, domain, expected_ip, timeout=300):
-            start_time = time.time()
-            resolver = dns.resolver.Resolver()
-            while time.time() - start_time < timeout:
-                try:
-                    answers = resolver.resolve(domain, 'A')
-                    for rdata in answers:
-                        if rdata.to_text() == expected_ip:
-                            print(f"DNS entry for {domain} successfully propagated.")
-                            return True
-                except Exception:
-                    pass
-                print(f"Waiting for DNS propagation for {domain}...")
-                time.sleep(10)
-            print(f"Timeout while waiting for DNS propagation for {domain}.")
+
+    def create_dns_record_batched(self, domain, ip_address, window=None, timeout=300):
+        # Queues the record with the records other threads queue within window seconds, sends them
+        # in one bulk upsert and then waits for the propagation of this record only. The instances
+        # of a fleet can create their records independently and still share one request.
+        if window is None:
+            window = float(os.getenv('DNS_BATCH_WINDOW', '1'))
+        with self.batch_lock:
+            batch = self.batch
+            if batch is None:
+                batch = self.batch = {"records": [], "done": threading.Event(), "success": False}
+                timer = threading.Timer(window, self.flush_batch, (batch,))
+                timer.daemon = True
+                timer.start()
+            batch["records"].append((domain, ip_address))
+        batch["done"].wait()
+        if not batch["success"]:
+            return False
+        if not self.wait_for_dns_propagation(domain, ip_address, timeout=timeout):
+            print(f"DNS propagation not successful for {domain}.")
+            return False
+        return True
+
+
+    def flush_batch(self, batch):
+        with self.batch_lock:
+            if self.batch is batch:
+                self.batch = None
+        try:
+            batch["success"] = self.create_dns_records(batch["records"], wait=False, refresh=False)
+        except Exception as e:
+            print(f"Failed to create DNS records: {e}")
+        finally:
+            batch["done"].set()
+
+
+    def handle_bulk_response(self, response, action, failed_key):
+        if response.status_code not in [200, 201]:
+            print(f"Failed to bulk {action[:-1]} DNS records", response.status_code)
+            print(response.json())
+            return False
+        body = response.json()
+        for record in body.get("records", []):
+            self.index_record(record)
+        failed = body.get(failed_key) or []
+        if failed:
+            print(f"{len(failed)} DNS record(s) could not be {action}: {failed}")
             return False
+        print(f"{len(body.get('records', []))} DNS record(s) {action} successfully")
+        return True
+
+
+    def delete_dns_records(self, domains):
+        # The DNS API has no bulk delete; resolve all records from one index refresh, then delete each
+        zone_id = self.get_zone_id(self.zone_name)
+        if not zone_id:
+            print("Zone ID not found.")
+            return False
+        if not self.refresh_record_index():
+            return False
+
+        success = True
+        for domain in domains:
+            for record in self.find_records(self.record_name(domain)):
+                delete_response = self.http.delete(f"{DNS_API_URL}/records/{record['id']}", headers=self.headers())
+                if delete_response.status_code == 200:
+                    print(f"DNS record {record['name']} deleted successfully")
+                    self.unindex_record(record)
+                else:
+                    print(f"Failed to delete DNS record {record['name']}", delete_response.status_code)
+                    success = False
+        return success
+
+
+
+
+    def wait_for_dns_propagation(self, domain, expected_ip, timeout=300):
+        return self.wait_for_dns_propagation_many({domain: expected_ip}, timeout=timeout)[domain] is not None
+
+
+    def wait_for_dns_propagation_many(self, records, timeout=300):
+        # records: dict domain -> expected IP, all domains are watched concurrently
+        times = self.propagation_checker.wait_for_domains(records, timeout=timeout)
+        self.propagation_times.update(times)
+        for domain, elapsed in times.items():
+            get_metrics().record("dns_propagation", elapsed, domain=domain)
+        return times
@@ -0,0 +1,97 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+import dns.message
+import dns.query
+import dns.rdatatype
+import dns.resolver
+
+
+class DNSPropagationChecker:
+    """Waits for A records by asking the zone's authoritative nameservers directly.
+
+    Recursive resolvers can hold on to a cached negative answer for minutes,
+    the authoritative servers answer as soon as the record is published.
+    Optionally a set of public resolvers has to agree as well.
+    """
+
+    def __init__(self, zone_name, public_resolvers=None, initial_interval=0.5, max_interval=5, backoff=1.5, query_timeout=3, nameservers=None, port=53):
+        self.zone_name = zone_name
+        self.public_resolvers = list(public_resolvers or [])
+        self.port = port
+        self.initial_interval = initial_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.query_timeout = query_timeout
+        # Given nameservers skip the NS lookup
+        self.nameservers = list(nameservers) if nameservers else None
+
+
+    def authoritative_nameservers(self):
+        if self.nameservers is None:
+            resolver = dns.resolver.Resolver()
+            nameservers = []
+            try:
+                for ns in resolver.resolve(self.zone_name, 'NS'):
+                    for address in resolver.resolve(ns.target.to_text(), 'A'):
+                        nameservers.append(address.to_text())
+            except Exception as e:
+                print(f"Could not resolve authoritative nameservers for {self.zone_name}: {e}")
+            if not nameservers:
+                # Fall back to the system resolvers
+                nameservers = list(resolver.nameservers)
+                print(f"Using system resolvers {nameservers} for DNS propagation checks")
+            else:
+                print(f"Authoritative nameservers for {self.zone_name}: {nameservers}")
+            self.nameservers = nameservers
+        return self.nameservers
+
+
+    def query(self, nameserver, domain):
+        # A single UDP query, no resolver cache involved
+        request = dns.message.make_query(domain, dns.rdatatype.A)
+        response = dns.query.udp(request, nameserver, timeout=self.query_timeout, port=self.port)
+        return {
+            rdata.to_text()
+            for rrset in response.answer if rrset.rdtype == dns.rdatatype.A
+            for rdata in rrset
+        }
+
+
+    def is_propagated(self, domain, expected_ip):
+        for nameserver in self.authoritative_nameservers() + self.public_resolvers:
+            try:
+                if expected_ip not in self.query(nameserver, domain):
+                    return False
+            except Exception:
+                return False
+        return True
+
+
+    def wait_for_domain(self, domain, expected_ip, timeout=300):
+        # Returns the seconds until the record was visible everywhere, or None on timeout
+        start_time = time.time()
+        interval = self.initial_interval
+        while True:
+            if self.is_propagated(domain, expected_ip):
+                elapsed = time.time() - start_time
+                print(f"DNS entry for {domain} successfully propagated after {elapsed:.1f}s.")
+                return elapsed
+            remaining = timeout - (time.time() - start_time)
+            if remaining <= 0:
+                print(f"Timeout while waiting for DNS propagation for {domain}.")
+                return None
+            time.sleep(min(interval, remaining))
+            interval = min(self.max_interval, interval * self.backoff)
+
+
+    def wait_for_domains(self, records, timeout=300, max_workers=16):
+        # records: dict domain -> expected IP; returns dict domain -> seconds or None
+        if not records:
+            return {}
+        self.authoritative_nameservers()
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(records)))) as executor:
+            futures = {
+                domain: executor.submit(self.wait_for_domain, domain, expected_ip, timeout)
+                for domain, expected_ip in records.items()
+            }
+            return {domain: future.result() for domain, future in futures.items()}
@@ -1,27 +1,20 @@
 import os
 import sys
 import time
-import socket
+from concurrent.futures import ThreadPoolExecutor
 import jenkins
 import yaml
-from automation_lib import SSHManager, JenkinsInstaller, JenkinsJobManager, NginxInstaller, VMManager, JenkinsAgentInstaller
+from automation_lib.metrics import get_metrics
+from automation_lib import SSHManager, JenkinsInstaller, JenkinsJobManager, NginxInstaller, VMManager, JenkinsAgentInstaller, ReadinessProber, JenkinsReadinessWaiter, PhaseScheduler
 
 
 
 
 
-def is_ssh_port_open(ip, port=22, timeout=5):
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-        sock.settimeout(timeout)
-        result = sock.connect_ex((ip, port))
-        return result == 0
-
-
-
 
 class EnvironmentManager:
 
-    def __init__(self, vm_manager, key_file, jenkins_user, jenkins_pass, job_name, os_type, server_type, ssh_key):
+    def __init__(self, vm_manager, key_file, jenkins_user, jenkins_pass, job_name, os_type, server_type, ssh_key, agent_parallelism=None, cloud_init_bootstrap=None):
         self.vm_manager = vm_manager
         self.key_file = key_file
         self.jenkins_user = jenkins_user
@@ -38,6 +31,15 @@ class EnvironmentManager:
         self.ssh_key = ssh_key
         self.agent_ips = []
         self.agents = []
+        self.agent_parallelism = agent_parallelism or int(os.getenv('AGENT_PARALLELISM', '5'))
+        self.prober = ReadinessProber(key_file)
+        if cloud_init_bootstrap is None:
+            # BOOTSTRAP_MODE=ssh pushes the install commands over SSH after boot instead
+            cloud_init_bootstrap = os.getenv('BOOTSTRAP_MODE', 'cloud-init') == 'cloud-init'
+        self.cloud_init_bootstrap = cloud_init_bootstrap
+        self.jenkins_waiter = JenkinsReadinessWaiter(jenkins_user, jenkins_pass, timeout=int(os.getenv('JENKINS_READY_TIMEOUT', '900')))
+        # Seconds from the container start until the admin user could log in
+        self.jenkins_ready_time = None
         
         
     def wait_until_ready(self, vm_type, index=None, timeout=600):
@@ -48,39 +50,123 @@ class EnvironmentManager:
         else:
             print("Invalid vm_type")
             return False
+        return self.wait_for_vm(vm_type, index=index, timeout=timeout)
+
 
-        if self.vm_ip is None:
+    def wait_for_vm(self, vm_type, index=None, timeout=600, check_running=True):
+        # Does not touch self.vm_ip, so several VMs can be awaited from different threads
+        deadline = time.time() + timeout
+        vm_ip = self.vm_manager.get_vm_ip(vm_type, index=index)
+        if vm_ip is None:
             print(f"Could not retrieve IP for {vm_type} VM.")
             return False
 
-        print(f"VM IP address: {self.vm_ip}")
-        if self.vm_manager.wait_for_vm_running(vm_type, index=index, timeout=timeout):
-            while not is_ssh_port_open(self.vm_ip):
-                print(f"SSH port not open on {self.vm_ip}. Waiting...")
-                time.sleep(10)
-            print("VM is fully ready and reachable via SSH.")
-            return True
-        else:
-            print("VM is not ready or failed to become reachable.")
+        print(f"VM IP address: {vm_ip}")
+        if check_running and not self.vm_manager.wait_for_vm_running(vm_type, index=index, timeout=timeout):
+            print(f"VM {vm_ip} is not running.")
+            return False
+        if self.prober.probe(vm_ip, deadline=deadline) is None:
+            print(f"VM {vm_ip} is not ready or failed to become reachable.")
+            return False
+        print(f"VM {vm_ip} is fully ready and reachable via SSH.")
+        return True
+
+
+    def wait_for_vms(self, vms, timeout=600):
+        # One label-selector poll until all servers are running, then the readiness probes
+        # of all hosts in parallel under one deadline
+        deadline = time.time() + timeout
+        running = self.vm_manager.wait_for_vms_running(vms, timeout=timeout)
+        not_running = [vm["server"]["name"] for vm in vms if running.get(vm["server"]["id"]) is None]
+        if not_running:
+            print(f"VMs not running: {not_running}")
+            return False
+
+        hosts = [vm["server"]["public_net"]["ipv4"]["ip"] for vm in vms]
+        ready = self.prober.probe_many(hosts, timeout=max(1, deadline - time.time()))
+        not_ready = [host for host, elapsed in ready.items() if elapsed is None]
+        if not_ready:
+            print(f"VMs not ready: {not_ready}")
             return False
+        return True
 
 
+    def wait_for_controller(self, timeout=600):
+        if not self.wait_for_vms([self.vm_manager.controller_vm], timeout=timeout):
+            return False
+        self.controller_ip = self.vm_ip = self.vm_manager.get_vm_ip("controller")
+        self.ssh_manager = SSHManager(self.controller_ip, self.key_file)
+        self.installer.ssh_manager = self.ssh_manager
+        print(f"Controller VM {self.controller_ip} is fully ready and reachable via SSH.")
+        return True
+
+
+    def wait_for_agents(self, timeout=600):
+        if not self.wait_for_vms(self.vm_manager.agent_vms, timeout=timeout):
+            return False
+        if self.vm_manager.agent_vms:
+            print(f"{len(self.vm_manager.agent_vms)} agent VM(s) are fully ready and reachable via SSH.")
+        return True
+
+
+
+    def add_jenkins_phases(self, scheduler, config_repo_url, controller_phase=None, prefix="", group=None):
+        """Add the phases of the Jenkins setup to scheduler; returns the name of the last one.
+
+        controller_phase is the phase that creates the controller VM; without it
+        the VM has to exist already. prefix and group keep the phases of fleet
+        instances apart when several share one scheduler.
+        """
+        self.installer = JenkinsInstaller(None, self.jenkins_user, self.jenkins_pass, config_repo_url,
+                                          docker_preinstalled=self.cloud_init_bootstrap)
+        controller = [controller_phase] if controller_phase else []
+
+        def add(name, func, requires=(), after=()):
+            return scheduler.add(f"{prefix}{name}", func, requires=[f"{prefix}{r}" if r not in controller else r for r in requires],
+                                 after=[f"{prefix}{a}" for a in after], group=group)
+
+        # The repo is cloned while the controller boots; agents are requested once the JCasC files are read
+        add("clone_repo", self.installer.clone_config_repo_local)
+        add("create_agents", lambda: self.create_agents(self.os_type, self.server_type, self.ssh_key), ["clone_repo"] + controller)
+        add("controller_ready", self.wait_for_controller, controller)
+        add("agents_ready", self.wait_for_agents, ["create_agents"])
+        add("agent_setup", self.setup_agents, ["agents_ready"])
+        # The agent IPs are known when the servers are created, they do not have to be up yet
+        add("configure_repo", lambda: self.installer.update_agent_ips_in_yaml(self.agents, self.agent_ips), ["create_agents"])
+        add("upload_config", self.installer.upload_config_repo, ["configure_repo", "controller_ready"])
+        # The local checkout is removed after the upload, and also when the upload was skipped
+        add("cleanup_repo", self.installer.cleanup_local_repo, after=["clone_repo", "upload_config"])
+        add("docker_install", self.installer.ensure_docker, ["controller_ready"])
+        add("image_build", self.installer.build_jenkins_docker_image, ["upload_config", "docker_install"])
+        # Jenkins launches its agents on start, so they have to be set up by then
+        add("jenkins_start", self.installer.start_jenkins, ["image_build", "agent_setup"])
+        return add("jenkins_ready", self.wait_for_jenkins, ["jenkins_start"])
+
+
+    def add_nginx_phases(self, scheduler, domain, dns_phase=None, prefix="", group=None):
+        """Add Nginx and the SSL certificate after the phases of add_jenkins_phases with the same prefix.
+
+        The certificate is requested once dns_phase, which creates the domain's record, has finished.
+        """
+        def add(name, func, requires):
+            return scheduler.add(f"{prefix}{name}", func, requires=requires, group=group)
+
+        # apt on the controller is free again once Docker is installed
+        add("nginx_install", lambda: NginxInstaller(self.ssh_manager, domain).install_nginx(), [f"{prefix}docker_install"])
+        add("certificate", lambda: NginxInstaller(self.ssh_manager, domain).obtain_ssl_certificate(), [f"{prefix}nginx_install", dns_phase])
+        return add("nginx_config", lambda: NginxInstaller(self.ssh_manager, domain).configure_nginx(), [f"{prefix}certificate"])
+
 
     def setup_jenkins(self, config_repo_url):
-        
-        self.controller_ip = self.vm_manager.get_vm_ip("controller")
-        self.ssh_manager = SSHManager(self.controller_ip, self.key_file)  
-        self.installer = JenkinsInstaller(self.ssh_manager, self.jenkins_user, self.jenkins_pass, config_repo_url)
-        
-        self.installer.clone_config_repo_local()
-        self.create_agents(self.os_type, self.server_type, self.ssh_key)
-        self.setup_agents()
-        self.installer.update_agent_ips_in_yaml(self.agents, self.agent_ips)
-        self.installer.upload_config_repo()  
-        self.installer.install_jenkins()
-        self.installer.cleanup_local_repo()
-        print("Waiting for Jenkins to initialize...")
-        time.sleep(40)
+        # The controller VM must exist already; the other phases run as soon as their inputs are there
+        scheduler = PhaseScheduler()
+        self.add_jenkins_phases(scheduler, config_repo_url)
+        succeeded = scheduler.run()
+        print(scheduler.format_critical_path())
+        if not succeeded:
+            # The failed phases were reported when they failed
+            print("Jenkins setup failed")
+            sys.exit(1)
 
 
         
@@ -95,45 +181,54 @@ class EnvironmentManager:
     
     def create_agents(self, os_type, server_type, ssh_key):
         self.num_agents = self.get_num_agents()
+        # Request all agent servers up front; they boot in parallel on Hetzner's side.
+        # agent_vms keeps creation order, so index i still maps to self.agents[i].
+        # Names carry the controller's server ID so agents of parallel fleet instances don't collide
+        controller_id = self.vm_manager.controller_vm["server"]["id"]
         for i in range(self.num_agents):
-            vm_name = f"agent-{i+1}-{int(time.time())}"
-            agent_vm_info = self.vm_manager.create_vm("agent", os_type, server_type, ssh_key, vm_name=vm_name)
+            vm_name = f"agent-{i+1}-{controller_id}-{int(time.time())}"
+            agent_vm_info = self.vm_manager.create_vm("agent", os_type, server_type, ssh_key, vm_name=vm_name,
+                                                      bootstrap=self.cloud_init_bootstrap)
             if agent_vm_info is None:
                 print(f"Agent VM {vm_name} could not be created")
-                sys.exit(1)
-            # Wait until agent vm is ready
-            if not self.wait_until_ready("agent", index=i):    
-                print(f"Agent VM {vm_name} not ready")
-                sys.exit(1)
-            agent_ip = self.vm_manager.get_vm_ip("agent", index=i)    
+                return False
+
+        for i in range(self.num_agents):
+            agent_ip = self.vm_manager.get_vm_ip("agent", index=i)
             if not agent_ip:
                 print(f"Failed to retrieve Agent {i+1} IP adress ")
-                sys.exit(1)
-            self.agent_ips.append(agent_ip)    
+                return False
+            self.agent_ips.append(agent_ip)
         return self.agent_ips
         
         
         
+    def wait_for_jenkins(self, timeout=None):
+        # Returns True once the JCasC admin user is authenticated; returns at once if Jenkins is already up
+        self.controller_ip = self.vm_manager.get_vm_ip("controller")
+        self.jenkins_url = f"http://{self.controller_ip}:8080"
+        ready_time = self.jenkins_waiter.wait(self.jenkins_url, ssh_manager=self.ssh_manager, timeout=timeout)
+        if self.jenkins_ready_time is None:
+            # Once Jenkins was ready, later waits return at once and say nothing about the startup
+            self.jenkins_ready_time = ready_time
+            get_metrics().record("jenkins_ready", ready_time, host=self.controller_ip, role="controller")
+        return ready_time is not None
+
+
     def test_jenkins(self):
         self.controller_ip = self.vm_manager.get_vm_ip("controller")
         if not self.vm_ip:
             self.vm_ip = self.vm_manager.get_vm_ip("controller")
         if self.vm_ip:
-            self.jenkins_url = f"http://{self.controller_ip}:8080"
-            max_retries = 10
-            wait_seconds = 10
-            for attempt in range(1, max_retries + 1):
-                try: 
-                    self.jenkins_job_manager = JenkinsJobManager(self.jenkins_url, self.jenkins_user, self.jenkins_pass)
-                    return True
-                except Exception as e:
-                    print(f"Attempt {attempt}: Failed to connect to Jenkins: {e}")
-                    if attempt < max_retries:
-                        print(f"Waiting {wait_seconds} seconds before retrying...")
-                        time.sleep(wait_seconds)
-                    else:
-                        print("Max retries reached. Jenkins is not running.")
-                        return False
+            if not self.wait_for_jenkins():
+                print("Jenkins is not running.")
+                return False
+            try:
+                self.jenkins_job_manager = JenkinsJobManager(self.jenkins_url, self.jenkins_user, self.jenkins_pass)
+                return True
+            except Exception as e:
+                print(f"Failed to connect to Jenkins: {e}")
+                return False
         else:
             print("No VM IP address found")
             return False
@@ -154,64 +249,87 @@ class EnvironmentManager:
             return True
         
             
-    def trigger_and_monitor_job(self):
+    def trigger_and_monitor_job(self, jobs=None, timeout=900):
+        # Runs the given jobs (names or glob patterns, default JOB_NAME) in parallel; True if all succeeded
         if not self.jenkins_job_manager:
             print("Jenkins job manager not initialized")
             return False
-        
+        jobs = jobs or [self.job_name]
         try:
-            self.jenkins_job_manager.trigger_job(self.job_name)
+            results = self.jenkins_job_manager.run_jobs(jobs, timeout=timeout)
         except Exception as e:
-            print("Failed to trigger job {e}")
-            sys.exit(1)
-            
-        result = self.jenkins_job_manager.wait_for_build_to_finish(self.job_name)
-        
-        if result == 'SUCCESS':
-            print("Job completed successfully")
-            return True
-        elif result == 'FAILURE':
-            print("Job failed")
-            sys.exit(1)
-        else:
-            print(f"Job ended with status: {result}")
-            sys.exit(1)        
+            print(f"Failed to run jobs {jobs}: {e}")
+            return False
+        if not results:
+            print(f"No jobs to run for {jobs}")
+            return False
+        return all(entry["result"] == "SUCCESS" for entry in results.values())
             
             
                             
     def setup_agents(self):
         agent_count = len(self.vm_manager.agent_vms)
-        for index in range(agent_count):
-            agent_ip = self.vm_manager.get_vm_ip("agent", index=index)
-            if not agent_ip:
-                print(f"Could not retrieve IP for agent {index}")
-                continue
-            print(f"Setting up agent {index} at IP {agent_ip}")
-            ssh_manager = SSHManager(agent_ip, self.key_file)
-            agent_installer = JenkinsAgentInstaller(ssh_manager)
-            agent_installer.install_dependencies()
+        if agent_count == 0:
+            return True
+        if self.cloud_init_bootstrap:
+            # cloud-init installed the dependencies; the readiness probe already waited for it
+            print("Agents were bootstrapped by cloud-init")
+            return True
+        max_workers = max(1, min(self.agent_parallelism, agent_count))
+        print(f"Setting up {agent_count} agent(s) with up to {max_workers} in parallel")
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(get_metrics().bind(self.setup_agent), range(agent_count)))
+        failed = [index for index, success in enumerate(results) if not success]
+        if failed:
+            print(f"Agent setup failed for agent(s) {failed}")
+            return False
+        return True
+
+
+    def setup_agent(self, index):
+        agent_ip = self.vm_manager.get_vm_ip("agent", index=index)
+        if not agent_ip:
+            print(f"Could not retrieve IP for agent {index}")
+            return False
+        print(f"Setting up agent {index} at IP {agent_ip}")
+        # Own connection per host; output is buffered and printed as one block when the host is done
+        ssh_manager = SSHManager(agent_ip, self.key_file, collect_output=True)
+        try:
+            with get_metrics().span("agent_setup", host=agent_ip, role="agent") as span:
+                agent_installer = JenkinsAgentInstaller(ssh_manager)
+                success = agent_installer.install_dependencies()
+                span["status"] = "ok" if success else "error"
+        except Exception as e:
+            ssh_manager.log(f"Agent setup raised an exception: {e}")
+            success = False
+        finally:
+            ssh_manager.close()
+            ssh_manager.flush_output(prefix=f"[agent {index} {agent_ip}] ")
+        print(f"Agent {index} at IP {agent_ip} {'set up successfully' if success else 'failed'}")
+        return success
             
             
 
     def cleanup(self, delete_vm=True):
         if self.ssh_manager:
-            self.ssh_manager.close()
+            self.ssh_manager.disconnect()
 
         if delete_vm:
             self.vm_manager.delete_vms()
 
-        if os.path.exists('controller_vm_info.json'):
-            os.remove('controller_vm_info.json')
+        if os.path.exists(self.vm_manager.controller_info_file):
+            os.remove(self.vm_manager.controller_info_file)
             
         
-        if os.path.exists('agent_vm_info.json'):
-            os.remove('agent_vm_info.json')
+        if os.path.exists(self.vm_manager.agent_info_file):
+            os.remove(self.vm_manager.agent_info_file)
 
 
     def setup_nginx(self, domain):
         if not self.ssh_manager:
             self.ssh_manager = SSHManager(self.vm_ip, self.key_file)
         nginx_installer = NginxInstaller(self.ssh_manager, domain)
-        nginx_installer.install_nginx()
+        if not nginx_installer.install_nginx():
+            return False
         nginx_installer.obtain_ssl_certificate()
-        nginx_installer.configure_nginx()
\ No newline at end of file
+        return nginx_installer.configure_nginx()
\ No newline at end of file
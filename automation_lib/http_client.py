@@ -0,0 +1,176 @@
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from automation_lib.shared import process_wide
+
+
+class HTTPClient:
+    """Pooled keep-alive session for the Hetzner Cloud and DNS APIs.
+
+    Retries 429/5xx responses with backoff, throttles from the
+    RateLimit-* headers and keeps request/latency counters.
+    """
+
+    RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+    IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+    def __init__(self, max_retries=5, backoff_factor=0.5, max_backoff=30, pool_size=20, timeout=30, min_remaining=10):
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.min_remaining = min_remaining
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.lock = threading.Lock()
+        # host -> {"remaining": int, "reset": unix timestamp}
+        self.rate_limits = {}
+        self.stats = {
+            "requests": 0,
+            "retries": 0,
+            "errors": 0,
+            "throttled_seconds": 0.0,
+            "total_latency": 0.0,
+            "max_latency": 0.0,
+            "status_codes": {},
+            "hosts": {},
+        }
+
+    def request(self, method, url, **kwargs):
+        method = method.upper()
+        kwargs.setdefault("timeout", self.timeout)
+        host = urlparse(url).netloc
+        attempt = 0
+        while True:
+            self.throttle(host)
+            start_time = time.time()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self.record(host, None, time.time() - start_time)
+                if method in self.IDEMPOTENT_METHODS and attempt < self.max_retries:
+                    delay = self.backoff(attempt)
+                    print(f"{method} {url} failed ({e}), retrying in {delay:.1f}s")
+                    self.sleep(delay)
+                    attempt += 1
+                    continue
+                raise
+            self.record(host, response.status_code, time.time() - start_time)
+            self.update_rate_limit(host, response)
+
+            # POSTs are only retried on 429, where the request was rejected before being processed
+            retryable = response.status_code == 429 or method in self.IDEMPOTENT_METHODS
+            if response.status_code in self.RETRY_STATUS_CODES and retryable and attempt < self.max_retries:
+                delay = self.retry_delay(response, attempt)
+                print(f"{method} {url} returned {response.status_code}, retrying in {delay:.1f}s")
+                self.sleep(delay)
+                attempt += 1
+                continue
+            return response
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request("PUT", url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request("DELETE", url, **kwargs)
+
+    def backoff(self, attempt):
+        delay = min(self.max_backoff, self.backoff_factor * (2 ** attempt))
+        return delay * random.uniform(0.5, 1.0)
+
+    def retry_delay(self, response, attempt):
+        retry_after = response.headers.get("Retry-After")
+        if retry_after:
+            try:
+                return min(self.max_backoff, float(retry_after))
+            except ValueError:
+                pass
+        delay = self.backoff(attempt)
+        if response.status_code == 429:
+            # Hetzner refills one request per second
+            delay = max(delay, 1.0)
+        return delay
+
+    def update_rate_limit(self, host, response):
+        remaining = response.headers.get("RateLimit-Remaining")
+        reset = response.headers.get("RateLimit-Reset")
+        if remaining is None or reset is None:
+            return
+        try:
+            with self.lock:
+                self.rate_limits[host] = {"remaining": int(remaining), "reset": float(reset)}
+        except ValueError:
+            pass
+
+    def throttle(self, host):
+        # Spread the remaining budget over the time until the limit resets
+        with self.lock:
+            limit = self.rate_limits.get(host)
+            if limit is None:
+                return
+            now = time.time()
+            if limit["reset"] <= now:
+                del self.rate_limits[host]
+                return
+            remaining = limit["remaining"]
+            # Count this request against the budget so concurrent threads don't all see the same value
+            limit["remaining"] = max(0, remaining - 1)
+        if remaining > self.min_remaining:
+            return
+        delay = min(self.max_backoff, (limit["reset"] - now) / max(remaining, 1))
+        if delay > 0:
+            print(f"Rate limit nearly exhausted for {host} ({remaining} left), waiting {delay:.1f}s")
+            self.sleep(delay)
+            with self.lock:
+                self.stats["throttled_seconds"] += delay
+
+    def sleep(self, delay):
+        time.sleep(delay)
+
+    def record(self, host, status_code, latency):
+        with self.lock:
+            stats = self.stats
+            stats["requests"] += 1
+            stats["total_latency"] += latency
+            stats["max_latency"] = max(stats["max_latency"], latency)
+            if status_code is None:
+                stats["errors"] += 1
+            else:
+                stats["status_codes"][status_code] = stats["status_codes"].get(status_code, 0) + 1
+                if status_code in self.RETRY_STATUS_CODES:
+                    stats["retries"] += 1
+            host_stats = stats["hosts"].setdefault(host, {"requests": 0, "total_latency": 0.0})
+            host_stats["requests"] += 1
+            host_stats["total_latency"] += latency
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats["status_codes"] = dict(self.stats["status_codes"])
+            stats["hosts"] = {host: dict(values) for host, values in self.stats["hosts"].items()}
+        stats["avg_latency"] = stats["total_latency"] / stats["requests"] if stats["requests"] else 0.0
+        return stats
+
+    def format_stats(self):
+        stats = self.get_stats()
+        return (f"HTTP API: {stats['requests']} requests, {stats['retries']} retried responses, "
+                f"{stats['errors']} connection errors, avg latency {stats['avg_latency'] * 1000:.0f}ms, "
+                f"max latency {stats['max_latency'] * 1000:.0f}ms, throttled {stats['throttled_seconds']:.1f}s")
+
+    def close(self):
+        self.session.close()
+
+
+get_http_client = process_wide(HTTPClient)
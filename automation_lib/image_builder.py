@@ -0,0 +1,96 @@
+import os
+import json
+import time
+from automation_lib.vm_manager import VMManager
+from automation_lib.ssh_manager import SSHManager
+from automation_lib.readiness import ReadinessProber
+from automation_lib.bootstrap import render_user_data, recipe_hash
+
+
+class ImageBuilder:
+    """Builds golden snapshots for controller and agent VMs.
+
+    A VM is created from the stock image with the role's bootstrap recipe,
+    snapshotted once cloud-init finished and deleted again. The snapshot is
+    labelled with the role and the recipe hash, which is how
+    VMManager.create_vm finds it.
+    """
+
+    def __init__(self, api_token, key_file, server_type, ssh_key, os_type="ubuntu-22.04", record_file="golden_images.json"):
+        self.api_token = api_token
+        self.key_file = key_file
+        self.server_type = server_type
+        self.ssh_key = ssh_key
+        self.os_type = os_type
+        self.record_file = record_file
+
+
+    def build(self, role, force=False, prune=True):
+        recipe = recipe_hash(role, self.os_type)
+        vm_manager = VMManager(self.api_token, state_dir=f"golden_image_{role}", use_golden_images=False)
+        existing = vm_manager.find_snapshot(role, recipe)
+        if existing and not force:
+            print(f"Golden {role} image {existing} is up to date (recipe {recipe})")
+            self.record(role, existing, recipe)
+            return existing
+
+        print(f"Building golden {role} image for recipe {recipe}")
+        start_time = time.time()
+        vm_info = vm_manager.create_vm(
+            role, self.os_type, self.server_type, self.ssh_key,
+            vm_name=f"golden-{role}-{int(start_time)}",
+            user_data=render_user_data(role, for_image=True)
+        )
+        if vm_info is None:
+            return None
+        server_id = vm_info["server"]["id"]
+        try:
+            if vm_manager.wait_for_vms_running([vm_info]).get(server_id) is None:
+                return None
+            ip_address = vm_info["server"]["public_net"]["ipv4"]["ip"]
+            if ReadinessProber(self.key_file, timeout=1800).probe(ip_address) is None:
+                print(f"Bootstrap of the golden {role} VM did not finish")
+                return None
+
+            # Let cloud-init run again on servers created from the snapshot
+            ssh_manager = SSHManager(ip_address, self.key_file)
+            if not ssh_manager.execute_command("cloud-init clean --logs && sync"):
+                return None
+            ssh_manager.disconnect()
+            if not vm_manager.shutdown_vm(server_id):
+                return None
+
+            labels = {
+                "managed-by": "jenkins-automation",
+                "golden-role": role,
+                "recipe-hash": recipe
+            }
+            image_id = vm_manager.create_snapshot(server_id, f"jenkins-automation {role} {recipe}", labels)
+            if image_id is None:
+                return None
+            print(f"Golden {role} image {image_id} built in {time.time() - start_time:.0f}s")
+        finally:
+            vm_manager.delete_vms()
+
+        self.record(role, image_id, recipe)
+        if prune:
+            # Snapshots of older recipes are never used again
+            for image in vm_manager.list_snapshots(role):
+                if image["id"] != image_id and image.get("labels", {}).get("recipe-hash") != recipe:
+                    vm_manager.delete_image(image["id"])
+        return image_id
+
+
+    def record(self, role, image_id, recipe):
+        records = {}
+        if os.path.exists(self.record_file):
+            with open(self.record_file, 'r') as f:
+                records = json.load(f)
+        records[role] = {
+            "image_id": image_id,
+            "recipe_hash": recipe,
+            "base_image": self.os_type,
+            "recorded_at": int(time.time())
+        }
+        with open(self.record_file, 'w') as f:
+            json.dump(records, f, indent=2)
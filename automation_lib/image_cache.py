@@ -0,0 +1,138 @@
+import hashlib
+import os
+import time
+from automation_lib.shared import KeyedLocks, process_wide
+
+
+class JenkinsImageCache(KeyedLocks):
+    """Shares one docker build of the Jenkins image between controllers.
+
+    The image is keyed by a hash of the config repo's build context. The
+    first controller for a key builds it and its `docker save` output is
+    kept gzip-compressed in a local cache; every other controller gets the
+    cached image streamed into `docker load` over its SSH connection and
+    builds with `--cache-from`, which reuses all layers whose inputs did not
+    change (the agent IPs in the JCasC files differ per instance, so only
+    the layers from their COPY onwards are rebuilt).
+    """
+
+    IMAGE_NAME = "jenkins-image"
+    BUILD_CONTEXT = "/var/jenkins_home/jenkins_configs"
+    SKIP_DIRS = {".git"}
+
+    def __init__(self, cache_dir=None, max_entries=3):
+        if cache_dir is None:
+            cache_dir = os.getenv('JENKINS_IMAGE_CACHE_DIR', os.path.expanduser("~/.cache/jenkins_automation/images"))
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        # Keys whose image could not be cached; controllers build those on their own
+        self.uncacheable = set()
+        super().__init__({"builds": 0, "cached_builds": 0, "saved_bytes": 0, "loaded_bytes": 0})
+
+
+    def context_hash(self, path):
+        # Hash of every file in the build context; must be taken before instance specific edits
+        digest = hashlib.sha256()
+        for root, dirs, files in os.walk(path):
+            dirs[:] = sorted(d for d in dirs if d not in self.SKIP_DIRS)
+            for name in sorted(files):
+                file_path = os.path.join(root, name)
+                digest.update(os.path.relpath(file_path, path).encode() + b"\0")
+                with open(file_path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(1048576), b""):
+                        digest.update(chunk)
+                digest.update(b"\0")
+        return digest.hexdigest()[:16]
+
+
+    def cache_path(self, key):
+        return os.path.join(self.cache_dir, f"{self.IMAGE_NAME}-{key}.tar.gz")
+
+
+    def build_command(self, cache_from=False):
+        # Inline cache metadata lets BuildKit use the loaded image as a cache source
+        command = f"sudo docker build --build-arg BUILDKIT_INLINE_CACHE=1 -t {self.IMAGE_NAME}"
+        if cache_from:
+            command += f" --cache-from {self.IMAGE_NAME}"
+        return f"{command} {self.BUILD_CONTEXT}"
+
+
+    def build(self, ssh_manager, key):
+        # Builds the Jenkins image on the controller; returns True on success
+        path = self.cache_path(key)
+        if key in self.uncacheable:
+            return ssh_manager.execute_command(self.build_command())
+        with self.key_lock(key):
+            if key in self.uncacheable:
+                return ssh_manager.execute_command(self.build_command())
+            if not os.path.exists(path):
+                # First controller for this key: full build, then keep the image for the others
+                start_time = time.time()
+                if not ssh_manager.execute_command(self.build_command()):
+                    return False
+                self.record("builds")
+                ssh_manager.log(f"Jenkins image {key} built in {time.time() - start_time:.0f}s")
+                self.save(ssh_manager, key)
+                return True
+        if self.load(ssh_manager, key):
+            start_time = time.time()
+            if ssh_manager.execute_command(self.build_command(cache_from=True)):
+                self.record("cached_builds")
+                ssh_manager.log(f"Jenkins image {key} built from cache in {time.time() - start_time:.0f}s")
+                return True
+        ssh_manager.log("Build from the cached image failed, building from scratch")
+        return ssh_manager.execute_command(self.build_command())
+
+
+    def save(self, ssh_manager, key):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self.cache_path(key)
+        partial_path = f"{path}.partial"
+        start_time = time.time()
+        with open(partial_path, 'wb') as f:
+            size = ssh_manager.pipe_from_command(f"sudo docker save {self.IMAGE_NAME} | gzip -1", f)
+        if size is None:
+            os.remove(partial_path)
+            self.uncacheable.add(key)
+            ssh_manager.log(f"Could not cache Jenkins image {key}")
+            return False
+        os.replace(partial_path, path)
+        self.record("saved_bytes", size)
+        ssh_manager.log(f"Cached Jenkins image {key} ({size / 1048576:.0f} MiB) in {time.time() - start_time:.0f}s")
+        self.prune()
+        return True
+
+
+    def load(self, ssh_manager, key):
+        path = self.cache_path(key)
+        start_time = time.time()
+        try:
+            with open(path, 'rb') as f:
+                size = ssh_manager.pipe_to_command("gunzip | sudo docker load", f)
+        except OSError as e:
+            ssh_manager.log(f"Could not read cached Jenkins image {key}: {e}")
+            return False
+        if size is None:
+            return False
+        self.record("loaded_bytes", size)
+        ssh_manager.log(f"Loaded cached Jenkins image {key} ({size / 1048576:.0f} MiB) in {time.time() - start_time:.0f}s")
+        return True
+
+
+    def prune(self):
+        # Keeps the most recently written images
+        entries = [
+            os.path.join(self.cache_dir, name) for name in os.listdir(self.cache_dir)
+            if name.startswith(f"{self.IMAGE_NAME}-") and name.endswith(".tar.gz")
+        ]
+        entries.sort(key=os.path.getmtime, reverse=True)
+        for path in entries[self.max_entries:]:
+            os.remove(path)
+
+
+    def format_stats(self):
+        return (f"Jenkins image: {self.stats['builds']} full build(s), {self.stats['cached_builds']} from cache, "
+                f"{self.stats['saved_bytes'] / 1048576:.1f} MiB cached, {self.stats['loaded_bytes'] / 1048576:.1f} MiB distributed")
+
+
+get_image_cache = process_wide(JenkinsImageCache)
@@ -0,0 +1,51 @@
+import sys
+import threading
+from automation_lib.metrics import get_metrics
+
+
+class InstancePrefixedStream:
+    """Wraps a text stream and labels each line with the writing thread's instance.
+
+    The instance is taken from the thread's metrics context, which the phase
+    scheduler and the agent workers bind, so everything a phase of instance 3
+    prints comes out as "[3] ...". Each thread's output is buffered until its
+    line is complete, which keeps the text and newline written separately by
+    print() of concurrent instances from running into each other. Threads
+    without an instance write through unchanged.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+
+    def write(self, text):
+        instance = get_metrics().current_attributes().get("instance")
+        if instance is None:
+            with self.lock:
+                return self.stream.write(text)
+        lines = (getattr(self.local, "pending", "") + text).split("\n")
+        self.local.pending = lines.pop()
+        if lines:
+            with self.lock:
+                self.stream.write("".join(f"[{instance}] {line}\n" for line in lines))
+        return len(text)
+
+
+    def flush(self):
+        pending = getattr(self.local, "pending", "")
+        if pending:
+            self.local.pending = ""
+            self.write(pending + "\n")
+        self.stream.flush()
+
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+def prefix_instance_output():
+    """Label the lines written to stdout by the phases of an instance with its number."""
+    if not isinstance(sys.stdout, InstancePrefixedStream):
+        sys.stdout = InstancePrefixedStream(sys.stdout)
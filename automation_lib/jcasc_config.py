@@ -0,0 +1,169 @@
+import hashlib
+import json
+import os
+import threading
+import yaml
+from automation_lib.shared import process_wide
+
+
+# libyaml bindings are an order of magnitude faster; PyYAML without them falls back to pure Python
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+YAML_DUMPER = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
+
+def find_ssh_agents(data):
+    # Returns [(node_index, node)] of the permanent SSH agents in a parsed JCasC document
+    agents = []
+    if data and isinstance(data, dict) and 'jenkins' in data and 'nodes' in (data['jenkins'] or {}):
+        for index, node in enumerate(data['jenkins']['nodes'] or []):
+            if 'permanent' in node:
+                launcher = node['permanent'].get('launcher', {})
+                if 'ssh' in launcher:
+                    agents.append((index, node))
+    return agents
+
+
+class AgentIndexCache:
+    """Agents per JCasC file, keyed by the file's content hash and kept across runs.
+
+    Files whose hash is known do not have to be parsed to count the agents.
+    """
+
+    def __init__(self, path=None, max_entries=1000):
+        if path is None:
+            path = os.getenv('JCASC_INDEX_CACHE', os.path.expanduser("~/.cache/jenkins_automation/jcasc_agents.json"))
+        self.path = path
+        self.max_entries = max_entries
+        self.entries = None
+        self.dirty = False
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0}
+
+
+    def load(self):
+        if self.entries is None:
+            try:
+                with open(self.path, 'r') as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError):
+                self.entries = {}
+
+
+    def get(self, digest):
+        with self.lock:
+            self.load()
+            entry = self.entries.get(digest)
+            self.stats["hits" if entry is not None else "misses"] += 1
+            return entry
+
+
+    def put(self, digest, agents):
+        # agents: [(node_index, node)]; documents that cannot be stored as JSON are not cached
+        try:
+            entry = json.loads(json.dumps([[index, node] for index, node in agents]))
+        except (TypeError, ValueError):
+            return
+        with self.lock:
+            self.load()
+            self.entries.pop(digest, None)
+            self.entries[digest] = entry
+            while len(self.entries) > self.max_entries:
+                del self.entries[next(iter(self.entries))]
+            self.dirty = True
+
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                partial_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}"
+                with open(partial_path, 'w') as f:
+                    json.dump(self.entries, f)
+                os.replace(partial_path, self.path)
+                self.dirty = False
+            except OSError as e:
+                print(f"Could not write the JCasC agent index {self.path}: {e}")
+
+
+class JCasCConfig:
+    """The JCasC YAML files of a config repo checkout.
+
+    Each file is read once; it is only parsed if its agents are not in the
+    index cache or when it has to be patched, and then parsed once. Parsed
+    documents stay in memory until they are written back.
+    """
+
+    SKIP_DIRS = {".git", ".hg", ".svn", "node_modules", "vendor", ".venv", "venv", "__pycache__"}
+    EXTENSIONS = (".yaml", ".yml")
+
+    def __init__(self, repo_path, index_cache=None):
+        self.repo_path = repo_path
+        self.index_cache = index_cache if index_cache is not None else get_agent_index_cache()
+        # path -> {"digest", "raw", "data"}; data is None until the file is parsed
+        self.files = {}
+
+
+    def find_files(self):
+        yaml_files = []
+        for root, dirs, files in os.walk(self.repo_path):
+            dirs[:] = sorted(d for d in dirs if d not in self.SKIP_DIRS)
+            yaml_files += [os.path.join(root, name) for name in sorted(files) if name.endswith(self.EXTENSIONS)]
+        return yaml_files
+
+
+    def document(self, yaml_file):
+        entry = self.files[yaml_file]
+        if entry["data"] is None:
+            entry["data"] = yaml.load(entry["raw"], Loader=YAML_LOADER)
+        return entry["data"]
+
+
+    def agents(self):
+        # Same shape as the former parse_jenkins_yaml_files: yaml_file, node_index and node_data per agent
+        agents = []
+        for yaml_file in self.find_files():
+            with open(yaml_file, 'rb') as f:
+                raw = f.read()
+            digest = hashlib.sha256(raw).hexdigest()
+            self.files[yaml_file] = {"digest": digest, "raw": raw, "data": None}
+            found = self.index_cache.get(digest)
+            if found is None:
+                found = find_ssh_agents(self.document(yaml_file))
+                self.index_cache.put(digest, found)
+            for index, node in found:
+                agents.append({'yaml_file': yaml_file, 'node_index': index, 'node_data': node})
+        self.index_cache.save()
+        return agents
+
+
+    def update_agent_ips(self, agents, agent_ips):
+        # Patches the SSH host of each agent and writes every touched file once
+        touched = []
+        for agent, agent_ip in zip(agents, agent_ips):
+            yaml_file = agent['yaml_file']
+            node_index = agent['node_index']
+            if yaml_file not in self.files:
+                with open(yaml_file, 'rb') as f:
+                    self.files[yaml_file] = {"digest": None, "raw": f.read(), "data": None}
+            data = self.document(yaml_file)
+            if yaml_file not in touched:
+                touched.append(yaml_file)
+            if data and 'jenkins' in data and 'nodes' in data['jenkins']:
+                node_data = data['jenkins']['nodes'][node_index]
+                if 'permanent' in node_data:
+                    node_data['permanent']['launcher']['ssh']['host'] = agent_ip
+                    node_data['permanent']['launcher']['ssh']['credentialsId'] = 'ssh-private-key' # Temporary workaround until credentials vault is implemented
+                else:
+                    print(f"No 'permanent' node found for agent at index {node_index} in {yaml_file}")
+            else:
+                print(f"No nodes found in 'jenkins' section in {yaml_file}")
+
+        for yaml_file in touched:
+            with open(yaml_file, 'w') as f:
+                yaml.dump(self.files[yaml_file]["data"], f, Dumper=YAML_DUMPER)
+            print(f"YAML file {yaml_file} has been updated with agent IP addresses.")
+
+
+get_agent_index_cache = process_wide(AgentIndexCache)
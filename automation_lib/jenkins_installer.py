@@ -1,15 +1,19 @@
 import os
-import sys
 import shlex
 import tempfile
 import shutil
 import subprocess
-import yaml
+from automation_lib.bootstrap import DOCKER_INSTALL_COMMANDS
+from automation_lib.image_cache import get_image_cache
+from automation_lib.config_sync import ConfigRepoSync
+from automation_lib.repo_cache import get_repo_cache
+from automation_lib.jcasc_config import JCasCConfig
+from automation_lib.metrics import get_metrics
 
 
 class JenkinsInstaller:
 
-    def __init__(self, ssh_manager, jenkins_user, jenkins_pass, config_repo_url):
+    def __init__(self, ssh_manager, jenkins_user, jenkins_pass, config_repo_url, docker_preinstalled=False, image_cache=None, repo_cache=None):
         self.ssh_manager = ssh_manager
         self.jenkins_user = jenkins_user
         self.jenkins_pass = jenkins_pass
@@ -18,42 +22,57 @@ class JenkinsInstaller:
         self.dns_api_token = os.getenv('H_DNS_API_TOKEN')
         self.ssh_private_key = os.getenv('H_SSH_PRIVATE_KEY')
         self.local_repo_path = None
+        self.jcasc_config = None
+        # Set when cloud-init already installed Docker on the controller
+        self.docker_preinstalled = docker_preinstalled
+        if image_cache is None and os.getenv('JENKINS_IMAGE_CACHE', '1') != '0':
+            image_cache = get_image_cache()
+        # Shares the docker build between controllers; JENKINS_IMAGE_CACHE=0 builds on every controller
+        self.image_cache = image_cache
+        self.image_key = None
+        if repo_cache is None and os.getenv('CONFIG_REPO_CACHE', '1') != '0':
+            repo_cache = get_repo_cache()
+        # Local mirror of the config repo; CONFIG_REPO_CACHE=0 clones from the remote every time
+        self.repo_cache = repo_cache
         
 
     def install_docker(self):
-        commands = [
-            "sudo apt-get update -y",
-            "sudo apt-get install -y ca-certificates curl gnupg lsb-release",
-            "sudo mkdir -p /etc/apt/keyrings",
-            "curl -fsSL https://download.docker.com/linux/ubuntu/gpg | sudo gpg --dearmor -o /etc/apt/keyrings/docker.gpg",
-            'echo "deb [arch=$(dpkg --print-architecture) signed-by=/etc/apt/keyrings/docker.gpg] '
-            'https://download.docker.com/linux/ubuntu $(lsb_release -cs) stable" | '
-            'sudo tee /etc/apt/sources.list.d/docker.list > /dev/null',
-            "sudo apt-get update -y",
-            "sudo apt-get install -y docker-ce docker-ce-cli containerd.io",
-            "sudo usermod -aG docker $USER",
-            "sudo chmod 666 /var/run/docker.sock"
-        ]
-        for cmd in commands:
-            self.ssh_manager.execute_command(cmd)
+        with get_metrics().span("docker_install", host=self.ssh_manager.ip_address) as span:
+            result = self.ssh_manager.execute_script(DOCKER_INSTALL_COMMANDS, name="Docker installation")
+            span["status"] = "ok" if result["success"] else "error"
+        return result["success"]
             
     def clone_config_repo_local(self):
         self.local_repo_path = tempfile.mkdtemp()
         try:
-            clone_cmd = (f"git clone {self.config_repo_url} {self.local_repo_path}")
-            subprocess.run(clone_cmd, shell=True, check=True)
-            print(f"Config repo cloned to {self.local_repo_path}")
-        except subprocess.CalledProcessError as e:
+            with get_metrics().span("config_clone"):
+                if self.repo_cache is not None:
+                    self.repo_cache.clone(self.config_repo_url, self.local_repo_path)
+                else:
+                    clone_cmd = (f"git clone {self.config_repo_url} {self.local_repo_path}")
+                    subprocess.run(clone_cmd, shell=True, check=True)
+                    print(f"Config repo cloned to {self.local_repo_path}")
+            if self.image_cache is not None:
+                # Taken before the agent IPs are written into the YAML files
+                self.image_key = self.image_cache.context_hash(self.local_repo_path)
+        except (subprocess.CalledProcessError, ValueError) as e:
             print(f"Error cloning config repo: {e}")
-            sys.exit(1)
+            return False
+        return True
             
     def cleanup_local_repo(self):
         if self.local_repo_path and os.path.exists(self.local_repo_path):
             shutil.rmtree(self.local_repo_path)
 
     def build_jenkins_docker_image(self):
-        self.ssh_manager.execute_command(
-            "sudo docker build -t jenkins-image /var/jenkins_home/jenkins_configs")
+        with get_metrics().span("image_build", host=self.ssh_manager.ip_address, image_key=self.image_key) as span:
+            if self.image_cache is not None and self.image_key is not None:
+                success = self.image_cache.build(self.ssh_manager, self.image_key)
+            else:
+                success = self.ssh_manager.execute_command(
+                    "sudo docker build -t jenkins-image /var/jenkins_home/jenkins_configs")
+            span["status"] = "ok" if success else "error"
+        return success
         
     def read_key_file(self, key_file):
         with open(key_file, 'r') as file:
@@ -61,94 +80,25 @@ class JenkinsInstaller:
         return key_content
     
     def parse_jenkins_yaml_files(self):
-        agents = []
-        yaml_files = []
-        # Collect all YAML files in the specified repository path
-        for root, dirs, files in os.walk(self.local_repo_path):
-            for file in files:
-                if file.endswith('.yaml') or file.endswith('.yml'):
-                    yaml_file = os.path.join(root, file)
-                    yaml_files.append(yaml_file)
-        # For each YAML file found, parse its content and create a dictionary for each agent node
-        # containing the YAML file path, node index, and node data
-        for yaml_file in yaml_files:
-            with open(yaml_file, 'r') as f:
-                data = yaml.safe_load(f)
-            if data and 'jenkins' in data and 'nodes' in data['jenkins']:
-                nodes = data['jenkins']['nodes']
-                for index, node in enumerate(nodes):
-                    if 'permanent' in node:
-                        launcher = node['permanent'].get('launcher', {})
-                        if 'ssh' in launcher:
-                            agents.append({
-                                'yaml_file': yaml_file,
-                                'node_index': index,
-                                'node_data': node
-                            })
-        return agents
-    
-    
-    
-    
-    
+        # Each YAML file is read once; the parsed documents are kept for update_agent_ips_in_yaml
+        self.jcasc_config = JCasCConfig(self.local_repo_path)
+        return self.jcasc_config.agents()
+
     def update_agent_ips_in_yaml(self, agents, agent_ips):
         if len(agents) != len(agent_ips):
             print("Number of agents and IP addresses do not match.")
-            sys.exit(1)
-            
-        # Prepare a mapping from yaml_file to data
-        yaml_data_map = {}
+            return False
+        if self.jcasc_config is None:
+            self.jcasc_config = JCasCConfig(self.local_repo_path)
+        self.jcasc_config.update_agent_ips(agents, agent_ips)
 
-        # Load all YAML files into yaml_data_map
-        for agent in agents:
-            yaml_file = agent['yaml_file']
-            if yaml_file not in yaml_data_map:
-                with open(yaml_file, 'r') as f:
-                    yaml_data_map[yaml_file] = yaml.safe_load(f)
-            
-        # For each agent update the host IP in the data
-        for i, agent in enumerate(agents):
-            yaml_file =  agent['yaml_file']
-            node_index = agent['node_index']
-            # Update IP address in the data
-            data = yaml_data_map[yaml_file]
-            if 'jenkins' in data and 'nodes' in data['jenkins']:
-                data_nodes = data['jenkins']['nodes']
-                node_data = data_nodes[node_index]
-                if 'permanent' in node_data:
-                    node_data['permanent']['launcher']['ssh']['host'] = agent_ips[i]
-                    node_data['permanent']['launcher']['ssh']['credentialsId'] = 'ssh-private-key' # Temporary workaround until credentials vault is implemented
-                    
-                else:
-                    print(f"No 'permanent' node found for agent at index {node_index} in {yaml_file}")
-            else:
-                print(f"No nodes found in 'jenkins' section in {yaml_file}")
-                
-        # Write back the modified data to the YAML files
-        for yaml_file, data in yaml_data_map.items():
-            with open(yaml_file, 'w') as f:
-                yaml.safe_dump(data, f)
-            print(f"YAML file {yaml_file} has been updated with agent IP addresses.")
-        
-        
-        
-        
-        
-        
-        
     def upload_config_repo(self):
-        archive_name = os.path.basename(self.local_repo_path.rstrip('/'))
-        archive_path = shutil.make_archive(archive_name, 'gztar', self.local_repo_path)
-        self.ssh_manager.upload_file(archive_path, f"/tmp/{archive_name}.tar.gz")
-        commands = [
-            f"sudo rm -rf /var/jenkins_home/jenkins_configs",
-            f"sudo mkdir -p /var/jenkins_home/jenkins_configs",
-            f"sudo tar -xzvf /tmp/{archive_name}.tar.gz -C /var/jenkins_home/jenkins_configs --strip-components=1",
-            f"sudo chown -R $USER:$USER /var/jenkins_home/jenkins_configs"
-        ]
-        for cmd in commands:
-            self.ssh_manager.execute_command(cmd)
-        os.remove(archive_path)
+        # Only files that changed since the last upload to this controller are sent
+        with get_metrics().span("config_sync", host=self.ssh_manager.ip_address) as span:
+            result = ConfigRepoSync(self.ssh_manager).sync(self.local_repo_path)
+            span["status"] = "ok" if result["success"] else "error"
+            span.update({key: result[key] for key in ("files_sent", "bytes_sent", "bytes_skipped")})
+        return result["success"]
 
 
 
@@ -157,7 +107,7 @@ class JenkinsInstaller:
         api_token_escaped = shlex.quote(self.api_token)
         dns_api_token_escaped = shlex.quote(self.dns_api_token)
         ssh_key_escaped = shlex.quote(self.ssh_key_content)
-        self.ssh_manager.execute_command(
+        return self.ssh_manager.execute_command(
             f"sudo docker run -d --name jenkins "
             f"-p 8080:8080 -p 50000:50000 "
             f"-v jenkins_home:/var/jenkins_home "
@@ -171,8 +121,23 @@ class JenkinsInstaller:
             "jenkins-image"
         )
 
-    def install_jenkins(self):
-        self.install_docker()
-        self.build_jenkins_docker_image()
-        self.ssh_key_content = self.read_key_file(self.ssh_private_key)
-        self.run_jenkins_container()
\ No newline at end of file
+    def ensure_docker(self):
+        # Returns True once Docker is installed on the controller
+        if self.docker_preinstalled:
+            return True
+        if not self.install_docker():
+            print("Docker installation failed")
+            return False
+        return True
+
+    def start_jenkins(self):
+        # Returns True once the Jenkins container was started
+        try:
+            self.ssh_key_content = self.read_key_file(self.ssh_private_key)
+        except (OSError, TypeError) as e:
+            print(f"Failed to read the SSH key for Jenkins: {e}")
+            return False
+        if not self.run_jenkins_container():
+            print("Failed to start the Jenkins container")
+            return False
+        return True
@@ -1,9 +1,67 @@
+import fnmatch
 import jenkins
+import json
+import requests
 import sys
 import time
 import os
+from collections import deque
+from urllib.parse import quote
 
 
+# Only the fields the tracking needs; get_job_info/get_build_info return the whole build history and more
+QUEUE_ITEM_TREE = "queue/item/%(number)d/api/json?tree=cancelled,why,executable[number]"
+BUILD_STATUS_TREE = "%(job_path)s%(number)d/api/json?tree=building,result,duration,estimatedDuration,timestamp"
+CONSOLE_TEXT = "%(job_path)s%(number)d/logText/progressiveText?start=%(start)d"
+JOB_NAMES_TREE = "api/json?tree=jobs[name]"
+# Recent builds of all jobs of a folder (or the top level) in one request; builds are matched to our
+# triggers by queueId
+JOBS_BUILDS_TREE = "api/json?tree=jobs[name,builds[number,queueId,building,result,duration]{0,%(builds)d}]"
+
+
+def job_path(job_name):
+    # "team/smoke" -> "job/team/job/smoke/", relative to the Jenkins URL
+    return "".join(f"job/{quote(part, safe='')}/" for part in job_name.split("/"))
+
+
+class ConsoleLogStream:
+    """Follows the console log of one build through logText/progressiveText.
+
+    Every poll fetches only the bytes after the offset Jenkins returned in
+    X-Text-Size; X-More-Data tells whether the build is still writing. Only
+    the last tail_lines lines are kept.
+    """
+
+    def __init__(self, server, job_name, number, tail_lines=200, max_line_length=65536):
+        self.server = server
+        self.job_name = job_name
+        self.number = number
+        self.max_line_length = max_line_length
+        self.offset = 0
+        self.more_data = True
+        self.failed = False
+        self.partial = b""
+        self.tail = deque(maxlen=tail_lines)
+
+    def poll(self):
+        # Returns the complete lines written since the last poll
+        url = self.server.server + CONSOLE_TEXT % {"job_path": job_path(self.job_name), "number": self.number, "start": self.offset}
+        response = self.server.jenkins_request(requests.Request('GET', url))
+        self.offset = int(response.headers.get("X-Text-Size", self.offset + len(response.content)))
+        self.more_data = response.headers.get("X-More-Data", "").lower() == "true"
+        # Split on bytes, so a character cut at the offset is decoded once it is complete
+        chunks = (self.partial + response.content).split(b"\n")
+        self.partial = chunks.pop()
+        if self.partial and (not self.more_data or len(self.partial) > self.max_line_length):
+            chunks.append(self.partial)
+            self.partial = b""
+        lines = [chunk.decode(errors="replace").rstrip("\r") for chunk in chunks]
+        self.tail.extend(lines)
+        return lines
+
+    def tail_text(self):
+        return "\n".join(self.tail)
+
 
 class JenkinsJobManager:
     def __init__(self, jenkins_url, user, password):
@@ -12,6 +70,9 @@ class JenkinsJobManager:
             username=user,
             password=password
         )
+        self.initial_interval = 0.5
+        self.max_interval = 10
+        self.backoff = 1.5
         try:
             user_info = self.server.get_whoami()
             print(f"Erfolgreich mit Jenkins verbunden als {user_info['fullName']}")
@@ -22,49 +83,181 @@ class JenkinsJobManager:
             
             
     def trigger_job(self, job_name):
+        # Returns the queue item ID, which identifies exactly this build
         try:
-            self.server.build_job(job_name)
-            print(f"Triggered job {job_name}")
-            return True
+            queue_id = self.server.build_job(job_name)
+            print(f"Triggered job {job_name} (queue item {queue_id})")
+            return queue_id
         except jenkins.JenkinsException as e:
             print(f"Failed to trigger job {job_name}: {e}")
             raise
 
-    
-    def wait_for_build_to_finish(self, job_name, timeout=300, interval=2):
+
+    def get_json(self, path):
+        # GET of a (tree-filtered) API path relative to the Jenkins URL
+        response = self.server.jenkins_open(requests.Request('GET', self.server.server + path))
+        return json.loads(response)
+
+
+    def get_build_number(self, queue_id):
+        # Returns the build number once the queue item got an executor, None while it waits,
+        # or False if the item was cancelled
+        item = self.get_json(QUEUE_ITEM_TREE % {"number": queue_id})
+        if item.get("cancelled"):
+            return False
+        executable = item.get("executable")
+        return executable["number"] if executable else None
+
+
+    def get_build_status(self, job_name, number):
+        return self.get_json(BUILD_STATUS_TREE % {"job_path": job_path(job_name), "number": number})
+
+
+    def poll_console(self, console, prefix="", echo=True):
+        # Prints the new console lines; returns their number. Without a console the status is polled instead.
+        if console.failed:
+            return 0
+        try:
+            lines = console.poll()
+        except (jenkins.JenkinsException, requests.RequestException, ValueError) as e:
+            print(f"Console log of {console.job_name} #{console.number} not available: {e}")
+            console.failed = True
+            console.more_data = False
+            return 0
+        if echo:
+            for line in lines:
+                print(f"{prefix}{line}")
+        return len(lines)
+
+
+    def next_interval(self, interval, build_status=None):
+        # Backs off while waiting; close to the expected end of the build the interval shrinks again.
+        # The build's own start timestamp counts, not the time it spent in the queue
+        interval = min(self.max_interval, interval * self.backoff)
+        build_status = build_status or {}
+        estimated = build_status.get("estimatedDuration") or -1
+        if estimated > 0 and build_status.get("timestamp"):
+            remaining = (estimated - (time.time() * 1000 - build_status["timestamp"])) / 1000
+            interval = min(interval, max(self.initial_interval, remaining / 2))
+        return interval
+
+
+    def expand_jobs(self, patterns):
+        # Job names and glob patterns (e.g. "smoke-*") -> job names, in order and without duplicates
+        names = None
+        jobs = []
+        for pattern in patterns:
+            if any(c in pattern for c in "*?["):
+                if names is None:
+                    names = [job["name"] for job in self.get_json(JOB_NAMES_TREE).get("jobs", [])]
+                matches = fnmatch.filter(names, pattern)
+                if not matches:
+                    print(f"No jobs match {pattern}")
+                jobs += matches
+            else:
+                jobs.append(pattern)
+        return list(dict.fromkeys(jobs))
+
+
+    def run_jobs(self, patterns, timeout=900, builds=10, tail_lines=30):
+        # Triggers all jobs at once and tracks them with one batched query per interval.
+        # Returns dict job -> {"queue_id", "number", "result", "duration"}. The console logs are
+        # followed incrementally; a single job is echoed live, otherwise the tails of failed jobs are printed.
         start_time = time.time()
-        
-        # Warte darauf, dass der Job eine Build-Nummer erhält
-        while time.time() - start_time < timeout:
-            last_build_info = self.server.get_job_info(job_name)['lastBuild']
-            if last_build_info is not None:
-                self.build_number = last_build_info['number']
-                break
-            time.sleep(interval)
-        else:
-            print("Timeout beim Abrufen der Build-Nummer")
-            return False        
-
-        # Überwache den Build-Status
-        while time.time() - start_time < timeout:
-            last_build_info = self.server.get_job_info(job_name)['lastBuild']
-            if last_build_info is not None:
-                status = self.server.get_build_info(job_name, self.build_number)['result']
-                if status == None:
-                    print("Build still in progress. Waiting...")
-                elif status == 'SUCCESS':
-                    print("Build successful")
-                    return 'SUCCESS'
-                elif status == 'FAILURE':
-                    print("Build failed")
-                    return 'FAILURE'
-                else:
-                    print(f"Build ended with status: {status}")
-                    return status
-            time.sleep(interval)  
-
-        print("Timeout waiting for build to finish")
-        return False      
-    
-    
+        results = {}
+        for job_name in self.expand_jobs(patterns):
+            entry = {"queue_id": None, "number": None, "result": None, "duration": None, "console": None}
+            try:
+                entry["queue_id"] = self.trigger_job(job_name)
+            except jenkins.JenkinsException:
+                entry["result"] = "NOT_TRIGGERED"
+            results[job_name] = entry
+
+        interval = self.initial_interval
+        pending = {name for name, entry in results.items() if entry["result"] is None}
+        while pending and time.time() - start_time < timeout:
+            time.sleep(min(interval, max(0, timeout - (time.time() - start_time))))
+            interval = min(self.max_interval, interval * self.backoff)
+            # One query per folder with pending jobs, e.g. team/smoke is listed by job/team/api/json
+            folders = {}
+            for name in pending:
+                folder, _, short_name = name.rpartition("/")
+                folders.setdefault(folder, {})[short_name] = name
+            for folder, names in folders.items():
+                try:
+                    jobs = self.get_json((job_path(folder) if folder else "") + JOBS_BUILDS_TREE % {"builds": builds}).get("jobs", [])
+                    for job in jobs:
+                        name = names.get(job["name"])
+                        if name is None:
+                            continue
+                        entry = results[name]
+                        job_builds = job.get("builds") or []
+                        build = next((build for build in job_builds if build.get("queueId") == entry["queue_id"]), None)
+                        if build is None and (entry["number"] is not None or len(job_builds) >= builds):
+                            # More builds started after ours than the window holds
+                            build = self.get_queued_build(name, entry)
+                        if build is not None:
+                            self.track_build(name, entry, build, echo=len(results) == 1)
+                        if entry["result"] is not None:
+                            pending.discard(name)
+                            print(f"{name} #{entry['number']}: {entry['result']} after {time.time() - start_time:.1f}s")
+                except (jenkins.JenkinsException, requests.RequestException, ValueError) as e:
+                    # Retried with the next interval; the results so far are kept
+                    print(f"Build status of {folder or 'top-level'} jobs not available: {e}")
+        for name in pending:
+            results[name]["result"] = "TIMEOUT"
+            results[name]["duration"] = time.time() - start_time
+
+        for name, entry in results.items():
+            console = entry["console"]
+            if console is None:
+                continue
+            # Catch up on the end of the log; the build may have finished between the two requests.
+            # Timed-out builds may still be writing, their log is left where it is
+            while (entry["result"] != "TIMEOUT" and console.more_data and not console.failed
+                   and time.time() - start_time < timeout):
+                if not self.poll_console(console, prefix=f"[{name} #{entry['number']}] ", echo=len(results) == 1):
+                    break
+                time.sleep(self.initial_interval)
+            if entry["result"] != "SUCCESS" and len(results) > 1 and console.tail:
+                print(f"\n--- {name} #{entry['number']}: last {tail_lines} console lines ---")
+                for line in list(console.tail)[-tail_lines:]:
+                    print(line)
+
+        self.print_results(results, time.time() - start_time)
+        return results
+
+
+    def get_queued_build(self, job_name, entry):
+        # Status of the build of entry's queue item, for builds outside the batched query's window
+        if entry["number"] is None:
+            number = self.get_build_number(entry["queue_id"])
+            if number is False:
+                entry["result"] = "CANCELLED"
+                return None
+            if number is None:
+                return None
+            entry["number"] = number
+        return dict(self.get_build_status(job_name, entry["number"]), number=entry["number"])
+
+
+    def track_build(self, job_name, entry, build, echo=False):
+        # Follows the console of the build and records its result once it finished
+        entry["number"] = build["number"]
+        if entry["console"] is None:
+            entry["console"] = ConsoleLogStream(self.server, job_name, build["number"])
+        self.poll_console(entry["console"], prefix=f"[{job_name} #{build['number']}] ", echo=echo)
+        if not build.get("building") and build.get("result"):
+            entry["result"] = build["result"]
+            entry["duration"] = build.get("duration", 0) / 1000
+
 
+    def print_results(self, results, elapsed):
+        width = max([len(name) for name in results] + [3])
+        print(f"\n{'Job'.ljust(width)}  {'Result':<13} {'Build':>6} {'Duration':>9}")
+        for name, entry in results.items():
+            number = f"#{entry['number']}" if entry["number"] is not None else "-"
+            duration = f"{entry['duration']:.1f}s" if entry["duration"] is not None else "-"
+            print(f"{name.ljust(width)}  {entry['result']:<13} {number:>6} {duration:>9}")
+        passed = sum(1 for entry in results.values() if entry["result"] == "SUCCESS")
+        print(f"{passed}/{len(results)} jobs passed in {elapsed:.1f}s")
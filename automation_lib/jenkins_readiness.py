@@ -0,0 +1,104 @@
+import socket
+import time
+from urllib.parse import urlparse
+
+import requests
+
+
+class JenkinsReadinessWaiter:
+    """Waits until a freshly started Jenkins controller accepts the admin login.
+
+    Jenkins goes through three states after `docker run`: the container is
+    up but nothing answers on the HTTP port, Jenkins serves 503 while it
+    starts and applies the JCasC configuration, and finally the configured
+    admin user is authenticated by `whoAmI`. Polls start in the sub-second
+    range and back off, bounded by an overall deadline.
+    """
+
+    def __init__(self, user, password, timeout=900, initial_interval=0.5, max_interval=10, backoff=1.5, request_timeout=5):
+        self.user = user
+        self.password = password
+        self.timeout = timeout
+        self.initial_interval = initial_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.request_timeout = request_timeout
+        self.session = requests.Session()
+        # url -> seconds until Jenkins was ready
+        self.ready_times = {}
+        # url -> {stage: seconds since the wait started}
+        self.stage_times = {}
+
+
+    def container_up(self, url, ssh_manager=None):
+        # With SSH access ask Docker, otherwise the published port accepting connections has to do
+        if ssh_manager is not None:
+            return ssh_manager.check_command("sudo docker inspect -f '{{.State.Running}}' jenkins | grep -q true", timeout=30) == 0
+        parsed = urlparse(url)
+        try:
+            with socket.create_connection((parsed.hostname, parsed.port or 80), timeout=self.request_timeout):
+                return True
+        except OSError:
+            return False
+
+
+    def check(self, url):
+        # Returns "down", "starting", "unauthenticated" or "ready"
+        try:
+            response = self.session.get(f"{url}/whoAmI/api/json", auth=(self.user, self.password), timeout=self.request_timeout)
+        except requests.RequestException:
+            return "down"
+        if response.status_code == 200:
+            try:
+                info = response.json()
+            except ValueError:
+                return "starting"
+            if info.get("authenticated") and info.get("name") not in (None, "anonymous"):
+                return "ready"
+            return "unauthenticated"
+        if response.status_code in (401, 403):
+            # Jenkins is serving, but the admin user from the JCasC files does not exist yet
+            return "unauthenticated"
+        return "starting"
+
+
+    def wait(self, url, ssh_manager=None, timeout=None):
+        # Returns the seconds until Jenkins was ready, or None if the deadline passed
+        start_time = time.time()
+        deadline = start_time + (timeout or self.timeout)
+        interval = self.initial_interval
+        stages = self.stage_times.setdefault(url, {})
+        stage = None
+        container_seen = False
+        while True:
+            state = self.check(url)
+            if state == "down" and (container_seen or self.container_up(url, ssh_manager)):
+                container_seen = True
+                state = "container"
+            if state != stage:
+                stage = state
+                if state != "down":
+                    stages.setdefault(state, time.time() - start_time)
+                print(f"[{url}] Jenkins {self.describe(state)} after {time.time() - start_time:.1f}s")
+            if state == "ready":
+                elapsed = time.time() - start_time
+                self.ready_times[url] = elapsed
+                return elapsed
+            if time.time() >= deadline:
+                print(f"[{url}] Jenkins not ready before the deadline (last state: {self.describe(stage)})")
+                if ssh_manager is not None:
+                    ssh_manager.execute_command("sudo docker logs --tail 50 jenkins")
+                return None
+            time.sleep(min(interval, max(0, deadline - time.time())))
+            interval = min(self.max_interval, interval * self.backoff)
+
+
+    @staticmethod
+    def describe(state):
+        return {
+            "down": "not reachable",
+            "container": "container up, HTTP port not answering yet",
+            "starting": "is starting (HTTP 503)",
+            "unauthenticated": "is serving, waiting for the JCasC admin user",
+            "ready": "is ready, whoAmI authenticated",
+        }.get(state, state)
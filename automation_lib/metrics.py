@@ -0,0 +1,201 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from automation_lib.shared import process_wide
+
+
+class MetricsRecorder:
+    """Collects timing spans of the provisioning phases.
+
+    A span has a name, start, duration, status and attributes such as the
+    instance, host and server type. Attributes set with context() apply to
+    every span recorded by the same thread. Spans are written as a JSON
+    report and as a Prometheus textfile aggregated per phase, server type
+    and status.
+    """
+
+    PROMETHEUS_METRIC = "jenkins_provisioning_phase_duration_seconds"
+    # Low-cardinality labels only; instance and host stay in the JSON report
+    PROMETHEUS_LABELS = ("phase", "role", "server_type", "status")
+
+    def __init__(self):
+        self.spans = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+
+    def current_attributes(self, attributes=None):
+        merged = dict(getattr(self.local, "attributes", {}))
+        merged.update({key: value for key, value in (attributes or {}).items() if value is not None})
+        return merged
+
+
+    @contextmanager
+    def context(self, **attributes):
+        # Attributes for all spans of this thread, e.g. instance and server_type
+        previous = getattr(self.local, "attributes", {})
+        self.local.attributes = self.current_attributes(attributes)
+        try:
+            yield
+        finally:
+            self.local.attributes = previous
+
+
+    def set_context(self, **attributes):
+        # Like context(), for attributes that apply to the rest of the thread's life
+        self.local.attributes = self.current_attributes(attributes)
+
+
+    def bind(self, func):
+        # Wraps func so it records with this thread's context when run by a worker thread
+        attributes = self.current_attributes()
+
+        def bound(*args, **kwargs):
+            with self.context(**attributes):
+                return func(*args, **kwargs)
+        return bound
+
+
+    @contextmanager
+    def span(self, name, **attributes):
+        # Times the block; set span["status"] = "error" for failures that do not raise,
+        # other keys set on span are recorded as attributes
+        span = {"status": "ok"}
+        start_time = time.time()
+        try:
+            yield span
+        except BaseException:
+            span["status"] = "error"
+            raise
+        finally:
+            status = span.pop("status")
+            self.record(name, time.time() - start_time, start=start_time, status=status, **{**attributes, **span})
+
+
+    def record(self, name, duration, start=None, status="ok", **attributes):
+        # For durations measured elsewhere, e.g. the time until a VM was running
+        if duration is None:
+            status = "timeout" if status == "ok" else status
+        entry = {
+            "name": name,
+            "start": start if start is not None else time.time() - (duration or 0),
+            "duration": duration,
+            "status": status,
+            "attributes": self.current_attributes(attributes),
+        }
+        with self.lock:
+            self.spans.append(entry)
+        return entry
+
+
+    def summary(self):
+        # phase -> {"count", "errors", "total", "max"}
+        phases = {}
+        with self.lock:
+            spans = list(self.spans)
+        for span in spans:
+            phase = phases.setdefault(span["name"], {"count": 0, "errors": 0, "total": 0.0, "max": 0.0})
+            phase["count"] += 1
+            if span["status"] != "ok":
+                phase["errors"] += 1
+            if span["duration"] is not None:
+                phase["total"] += span["duration"]
+                phase["max"] = max(phase["max"], span["duration"])
+        return phases
+
+
+    def format_summary(self):
+        lines = ["Phase timings:"]
+        for name, phase in self.summary().items():
+            average = phase["total"] / phase["count"] if phase["count"] else 0
+            line = f"  {name:<20} {phase['count']:>3}x  avg {average:7.1f}s  max {phase['max']:7.1f}s"
+            if phase["errors"]:
+                line += f"  ({phase['errors']} failed)"
+            lines.append(line)
+        return "\n".join(lines)
+
+
+    def write_json(self, path):
+        with self.lock:
+            report = {"generated_at": time.time(), "spans": list(self.spans)}
+        report["summary"] = self.summary()
+        self.write_atomic(path, json.dumps(report, indent=2, default=str))
+
+
+    def write_prometheus(self, path, labels=None):
+        # Textfile collector format; sum/count/max per label set so latency can be trended per server type.
+        # labels are added to every series, e.g. the command when several scripts write textfiles.
+        constant = "".join(f',{name}="{self.escape_label(value)}"' for name, value in (labels or {}).items())
+        series = {}
+        with self.lock:
+            spans = list(self.spans)
+        for span in spans:
+            span_labels = {"phase": span["name"], "status": span["status"]}
+            span_labels.update({key: span["attributes"].get(key) for key in self.PROMETHEUS_LABELS if key in span["attributes"]})
+            key = tuple((name, str(span_labels[name])) for name in self.PROMETHEUS_LABELS if span_labels.get(name) is not None)
+            entry = series.setdefault(key, {"sum": 0.0, "count": 0, "max": 0.0})
+            entry["count"] += 1
+            if span["duration"] is not None:
+                entry["sum"] += span["duration"]
+                entry["max"] = max(entry["max"], span["duration"])
+
+        metric = self.PROMETHEUS_METRIC
+        lines = [
+            f"# HELP {metric} Duration of Jenkins environment provisioning phases.",
+            f"# TYPE {metric} summary",
+        ]
+        for key, entry in sorted(series.items()):
+            series_labels = ",".join(f'{name}="{self.escape_label(value)}"' for name, value in key) + constant
+            lines.append(f"{metric}_sum{{{series_labels}}} {entry['sum']:.3f}")
+            lines.append(f"{metric}_count{{{series_labels}}} {entry['count']}")
+        lines += [
+            f"# HELP {metric}_max Longest duration of a provisioning phase in the last run.",
+            f"# TYPE {metric}_max gauge",
+        ]
+        for key, entry in sorted(series.items()):
+            series_labels = ",".join(f'{name}="{self.escape_label(value)}"' for name, value in key) + constant
+            lines.append(f"{metric}_max{{{series_labels}}} {entry['max']:.3f}")
+        lines += [
+            "# HELP jenkins_provisioning_last_run_timestamp_seconds Time the metrics were written.",
+            "# TYPE jenkins_provisioning_last_run_timestamp_seconds gauge",
+            f"jenkins_provisioning_last_run_timestamp_seconds{{{constant.lstrip(',')}}} {time.time():.0f}",
+        ]
+        self.write_atomic(path, "\n".join(lines) + "\n")
+
+
+    @staticmethod
+    def escape_label(value):
+        return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+    @staticmethod
+    def write_atomic(path, content):
+        # The textfile collector must never read a half written file
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        partial_path = f"{path}.{os.getpid()}.tmp"
+        with open(partial_path, 'w') as f:
+            f.write(content)
+        os.replace(partial_path, path)
+
+
+    def export(self, name="provisioning_metrics", labels=None):
+        # Writes <name>.json and <name>.prom unless METRICS_JSON_FILE / METRICS_PROM_FILE say otherwise;
+        # an empty value disables that output
+        json_path = os.getenv('METRICS_JSON_FILE', f"{name}.json")
+        prometheus_path = os.getenv('METRICS_PROM_FILE', f"{name}.prom")
+        print(self.format_summary())
+        try:
+            if json_path:
+                self.write_json(json_path)
+                print(f"Metrics report written to {json_path}")
+            if prometheus_path:
+                self.write_prometheus(prometheus_path, labels=labels)
+                print(f"Prometheus metrics written to {prometheus_path}")
+        except OSError as e:
+            print(f"Could not write metrics: {e}")
+
+
+get_metrics = process_wide(MetricsRecorder)
@@ -1,5 +1,5 @@
-import sys
 import os
+from automation_lib.metrics import get_metrics
 
 class NginxInstaller:
 
@@ -9,9 +9,11 @@ class NginxInstaller:
         self.ssl_email = os.getenv('SSL_EMAIL')
 
     def install_nginx(self):
-        if not self.ssh_manager.execute_command("DEBIAN_FRONTEND=noninteractive apt-get install nginx -y"):
-            print("Failed to install Nginx")
-            sys.exit(1)
+        with get_metrics().span("nginx_install", host=self.ssh_manager.ip_address, domain=self.domain):
+            installed = self.ssh_manager.execute_command("DEBIAN_FRONTEND=noninteractive apt-get install nginx -y")
+            if not installed:
+                print("Failed to install Nginx")
+                return False
         print("Nginx installed successfully")
         return True
 
@@ -45,38 +47,37 @@ class NginxInstaller:
         }}
         """
 
-        if not self.ssh_manager.execute_command(f"echo '{nginx_conf}' > /etc/nginx/sites-available/jenkins.conf"):
-            print("Failed to create Nginx configuration file")
+        commands = [
+            f"echo '{nginx_conf}' > /etc/nginx/sites-available/jenkins.conf",
+            "rm -f /etc/nginx/sites-enabled/default",
+            "ln -sf /etc/nginx/sites-available/jenkins.conf /etc/nginx/sites-enabled/jenkins.conf",
+            "nginx -t",
+            "systemctl restart nginx"
+        ]
+        print("Writing and testing Nginx configuration...")
+        result = self.ssh_manager.execute_script(commands, name="Nginx configuration")
+        if not result["success"]:
+            if result["failed_step"] == commands.index("nginx -t"):
+                print("Nginx configuration test failed.")
+                return False
+            print("Failed to configure Nginx")
             return False
-        print("Nginx configuration file created successfully")
-
-        self.ssh_manager.execute_command("rm /etc/nginx/sites-enabled/default")
-
-        self.ssh_manager.execute_command(
-            "ln -s /etc/nginx/sites-available/jenkins.conf /etc/nginx/sites-enabled/jenkins.conf")
-
-        print("Testing Nginx configuration...")
-        if not self.ssh_manager.execute_command("nginx -t"):
-            print("Nginx configuration test failed.")
-            sys.exit(1)
-        print("Nginx configuration test passed.")
-
-        print("Restarting Nginx...")
-        self.ssh_manager.execute_command("systemctl restart nginx")
+        print("Nginx configuration test passed and Nginx restarted.")
+        return True
         
         
 
     def obtain_ssl_certificate(self):
-        # Certbot installieren
-        self.ssh_manager.execute_command(
-            "DEBIAN_FRONTEND=noninteractive apt-get install certbot python3-certbot-nginx -y")
-        # SSL-Zertifikat beantragen
         print(f"Get certificate for {self.domain}")
-        result = self.ssh_manager.execute_command(
-            f"certbot --nginx -d {self.domain} --non-interactive --agree-tos -m {self.ssl_email}")
-        if not result:
+        commands = [
+            # Certbot installieren
+            "DEBIAN_FRONTEND=noninteractive apt-get install certbot python3-certbot-nginx -y",
+            # SSL-Zertifikat beantragen
+            f"certbot --nginx -d {self.domain} --non-interactive --agree-tos -m {self.ssl_email}"
+        ]
+        with get_metrics().span("cert_issuance", host=self.ssh_manager.ip_address, domain=self.domain) as span:
+            result = self.ssh_manager.execute_script(commands, name="SSL certificate")
+            span["status"] = "ok" if result["success"] else "error"
+        if not result["success"]:
             print("Failed to obtain SSL certificate")
-
-
-
-    
+        return result["success"]
@@ -0,0 +1,198 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from automation_lib.metrics import get_metrics
+
+
+class PhaseScheduler:
+    """Runs provisioning phases as a dependency graph.
+
+    A phase starts as soon as the phases it requires have succeeded; it is
+    skipped if one of them failed. Phases listed in `after` only have to
+    be finished, whatever their outcome. A phase fails if it raises an
+    exception or returns False.
+
+    Phases can belong to a group, e.g. the instance of a fleet run; at most
+    max_groups groups are in flight at a time, so one scheduler can run a
+    whole fleet while keeping the number of instances provisioned
+    concurrently bounded. A phase is only submitted when one of the
+    max_workers threads is free, so a running phase never waits in the
+    executor's queue.
+    """
+
+    def __init__(self, max_workers=32, max_groups=None):
+        self.max_workers = max_workers
+        self.max_groups = max_groups
+        # name -> phase dict, in the order the phases were added
+        self.phases = {}
+        self.start_time = None
+        self.end_time = None
+
+
+    def add(self, name, func, requires=(), after=(), group=None):
+        # func runs with the metrics context of the caller, e.g. the instance number
+        if name in self.phases:
+            raise ValueError(f"Phase {name} was already added")
+        self.phases[name] = {
+            "name": name,
+            "func": get_metrics().bind(func),
+            "requires": [dependency for dependency in requires if dependency],
+            "after": [dependency for dependency in after if dependency],
+            "group": group,
+            "status": "pending",
+            "start": None,
+            "end": None,
+            "error": None,
+        }
+        return name
+
+
+    def validate(self):
+        for phase in self.phases.values():
+            for dependency in phase["requires"] + phase["after"]:
+                if dependency not in self.phases:
+                    raise ValueError(f"Phase {phase['name']} depends on unknown phase {dependency}")
+        # Depth-first search for cycles
+        state = {}
+
+        def visit(name, path):
+            if state.get(name) == "done":
+                return
+            if state.get(name) == "visiting":
+                raise ValueError(f"Dependency cycle: {' -> '.join(path + [name])}")
+            state[name] = "visiting"
+            phase = self.phases[name]
+            for dependency in phase["requires"] + phase["after"]:
+                visit(dependency, path + [name])
+            state[name] = "done"
+
+        for name in self.phases:
+            visit(name, [])
+
+
+    def run(self):
+        # Runs all phases; returns True if every phase succeeded
+        self.validate()
+        self.start_time = time.time()
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while True:
+                self.submit_ready(executor, running)
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    running.pop(future)
+                    # Raises what execute does not catch, e.g. KeyboardInterrupt
+                    future.result()
+        self.end_time = time.time()
+        return not self.failed()
+
+
+    def submit_ready(self, executor, running):
+        changed = True
+        while changed:
+            changed = False
+            for phase in self.phases.values():
+                if len(running) >= self.max_workers:
+                    return
+                if phase["status"] != "pending":
+                    continue
+                dependencies = [self.phases[name] for name in phase["requires"] + phase["after"]]
+                if any(dependency["status"] in ("pending", "running") for dependency in dependencies):
+                    continue
+                blocked = [self.phases[name]["name"] for name in phase["requires"] if self.phases[name]["status"] != "ok"]
+                if blocked:
+                    phase["status"] = "skipped"
+                    phase["error"] = f"requires {', '.join(blocked)}"
+                    changed = True
+                    continue
+                if not self.group_admitted(phase["group"]):
+                    continue
+                phase["status"] = "running"
+                running[executor.submit(self.execute, phase)] = phase["name"]
+                changed = True
+
+
+    def group_admitted(self, group):
+        if group is None or self.max_groups is None:
+            return True
+        statuses = {}
+        for phase in self.phases.values():
+            if phase["group"] is not None:
+                statuses.setdefault(phase["group"], []).append(phase["status"])
+        # A group is in flight from its first phase until it has no pending or running phase left
+        active = {
+            name for name, group_statuses in statuses.items()
+            if any(status in ("running", "ok", "failed") for status in group_statuses)
+            and any(status in ("pending", "running") for status in group_statuses)
+        }
+        return group in active or len(active) < self.max_groups
+
+
+    def execute(self, phase):
+        phase["start"] = time.time()
+        try:
+            result = phase["func"]()
+            status = "failed" if result is False else "ok"
+        except Exception as e:
+            status = "failed"
+            phase["error"] = str(e) or type(e).__name__
+        phase["end"] = time.time()
+        phase["status"] = status
+        if status == "failed":
+            print(f"Phase {phase['name']} failed after {phase['end'] - phase['start']:.1f}s"
+                  + (f": {phase['error']}" if phase["error"] else ""))
+
+
+    def failed(self, group=None):
+        # Phases of the group (all phases if None) that failed or were skipped
+        return [
+            phase for phase in self.phases.values()
+            if phase["status"] in ("failed", "skipped") and (group is None or phase["group"] == group)
+        ]
+
+
+    def group_times(self, group):
+        # (first start, last end) of the group's phases that ran, or (None, None)
+        ran = [phase for phase in self.phases.values() if phase["group"] == group and phase["start"] is not None]
+        if not ran:
+            return None, None
+        return min(phase["start"] for phase in ran), max(phase["end"] or phase["start"] for phase in ran)
+
+
+    def critical_path(self, group=None):
+        # Walks back from the phase that finished last, always to the dependency that finished last
+        finished = [
+            phase for phase in self.phases.values()
+            if phase["end"] is not None and (group is None or phase["group"] == group)
+        ]
+        if not finished:
+            return []
+        phase = max(finished, key=lambda p: p["end"])
+        path = [phase]
+        while True:
+            dependencies = [self.phases[name] for name in phase["requires"] + phase["after"] if self.phases[name]["end"] is not None]
+            if not dependencies:
+                break
+            phase = max(dependencies, key=lambda p: p["end"])
+            path.append(phase)
+        return list(reversed(path))
+
+
+    def format_critical_path(self, group=None):
+        path = self.critical_path(group)
+        if not path:
+            return "Critical path: no phase ran"
+        total = path[-1]["end"] - self.start_time
+        lines = [f"Critical path ({total:.1f}s):"]
+        previous_end = self.start_time
+        for phase in path:
+            waited = phase["start"] - previous_end
+            line = f"  {phase['name']:<28} start {phase['start'] - self.start_time:7.1f}s  took {phase['end'] - phase['start']:7.1f}s"
+            if waited >= 0.05:
+                line += f"  (waited {waited:.1f}s)"
+            if phase["status"] != "ok":
+                line += f"  [{phase['status']}]"
+            lines.append(line)
+            previous_end = phase["end"]
+        return "\n".join(lines)
@@ -0,0 +1,104 @@
+import math
+import os
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+from automation_lib.ssh_manager import SSHManager
+from automation_lib.metrics import get_metrics
+
+
+class ReadinessProber:
+    """Waits until hosts accept SSH logins and cloud-init has finished.
+
+    Each host goes through three checks: the SSH banner is served, an
+    authenticated no-op command succeeds and `cloud-init status --wait`
+    returns. Retries start in the sub-second range and back off, bounded
+    by an overall deadline.
+    """
+
+    # cloud-init status exit codes: 0 done, 2 done with recoverable errors, 127 not installed
+    CLOUD_INIT_OK = (0, 2, 127)
+
+    def __init__(self, key_file, timeout=600, port=None, initial_interval=0.25, max_interval=5, backoff=1.5, wait_for_cloud_init=True):
+        self.key_file = key_file
+        self.timeout = timeout
+        self.port = port or int(os.getenv('SSH_PORT', '22'))
+        self.initial_interval = initial_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.wait_for_cloud_init = wait_for_cloud_init
+        # host -> seconds until the host was ready
+        self.ready_times = {}
+
+
+    def check_banner(self, host, timeout=3):
+        try:
+            with socket.create_connection((host, self.port), timeout=timeout) as sock:
+                sock.settimeout(timeout)
+                return sock.recv(256).startswith(b"SSH-")
+        except OSError:
+            return False
+
+
+    def probe(self, host, deadline=None):
+        # Returns the seconds until the host was ready, or None if the deadline passed
+        start_time = time.time()
+        deadline = deadline or start_time + self.timeout
+        interval = self.initial_interval
+        stage = "banner"
+        ssh_manager = SSHManager(host, self.key_file, collect_output=True, connect_timeout=10)
+        try:
+            while True:
+                if stage == "banner" and self.check_banner(host):
+                    print(f"[{host}] SSH banner received")
+                    stage = "login"
+                if stage == "login":
+                    # Connection attempts fail quietly while sshd or the authorized keys are not set up yet
+                    ssh_manager.clear_output()
+                    if ssh_manager.check_command("true") == 0:
+                        print(f"[{host}] SSH login succeeded")
+                        stage = "cloud-init" if self.wait_for_cloud_init else "ready"
+                    else:
+                        ssh_manager.close()
+                if stage == "cloud-init":
+                    remaining = max(1, math.ceil(deadline - time.time()))
+                    status = ssh_manager.check_command(f"timeout {remaining} cloud-init status --wait > /dev/null")
+                    if status in self.CLOUD_INIT_OK:
+                        print(f"[{host}] cloud-init finished")
+                        stage = "ready"
+                    elif status is None:
+                        # Connection dropped (e.g. reboot by cloud-init), start over with the login
+                        ssh_manager.disconnect()
+                        stage = "login"
+                    elif status != 124:
+                        print(f"[{host}] cloud-init failed with exit status {status}")
+                        ssh_manager.flush_output(prefix=f"[{host}] ")
+                        get_metrics().record("ssh_ready", time.time() - start_time, start=start_time, status="error", host=host)
+                        return None
+                if stage == "ready":
+                    elapsed = time.time() - start_time
+                    self.ready_times[host] = elapsed
+                    get_metrics().record("ssh_ready", elapsed, start=start_time, host=host)
+                    print(f"[{host}] Host is ready after {elapsed:.1f}s")
+                    return elapsed
+                if time.time() >= deadline:
+                    print(f"[{host}] Not ready before the deadline (stuck at {stage})")
+                    ssh_manager.flush_output(prefix=f"[{host}] ")
+                    get_metrics().record("ssh_ready", None, start=start_time, host=host, stage=stage)
+                    return None
+                time.sleep(min(interval, max(0, deadline - time.time())))
+                interval = min(self.max_interval, interval * self.backoff)
+        finally:
+            ssh_manager.close()
+
+
+    def probe_many(self, hosts, timeout=None):
+        # Probes all hosts concurrently against one shared deadline; returns dict host -> seconds or None
+        hosts = list(dict.fromkeys(hosts))
+        if not hosts:
+            return {}
+        deadline = time.time() + (timeout or self.timeout)
+        with ThreadPoolExecutor(max_workers=len(hosts)) as executor:
+            probe = get_metrics().bind(self.probe)
+            futures = {host: executor.submit(probe, host, deadline) for host in hosts}
+            return {host: future.result() for host, future in futures.items()}
@@ -0,0 +1,113 @@
+import hashlib
+import os
+import re
+import shlex
+import shutil
+import subprocess
+import time
+from automation_lib.shared import KeyedLocks, process_wide
+
+
+def parse_repo_spec(spec):
+    """Split a config repo spec like "--branch main https://..." into (url, branch)."""
+    args = shlex.split(spec)
+    url = None
+    branch = None
+    index = 0
+    while index < len(args):
+        if args[index] in ("--branch", "-b") and index + 1 < len(args):
+            branch = args[index + 1]
+            index += 2
+            continue
+        if args[index].startswith("--branch="):
+            branch = args[index].split("=", 1)[1]
+        else:
+            url = args[index]
+        index += 1
+    if url is None:
+        raise ValueError(f"No repository URL in {spec!r}")
+    return url, branch
+
+
+class RepoMirrorCache(KeyedLocks):
+    """Persistent bare mirrors of config repositories, keyed by URL.
+
+    The first clone of a URL creates a `git clone --mirror` in the cache
+    directory; later ones only `git fetch` it, once per process. Working
+    copies are shallow single-branch clones from the local mirror, so
+    instances of a fleet do not go to the remote at all.
+    """
+
+    def __init__(self, cache_dir=None):
+        if cache_dir is None:
+            cache_dir = os.getenv('CONFIG_REPO_CACHE_DIR', os.path.expanduser("~/.cache/jenkins_automation/repos"))
+        self.cache_dir = cache_dir
+        self.fetched = set()
+        super().__init__({"hits": 0, "misses": 0, "fallbacks": 0, "fetch_time": 0.0, "clone_time": 0.0})
+
+
+    def mirror_path(self, url):
+        name = re.sub(r"[^A-Za-z0-9_.-]", "_", url.rstrip('/').rsplit('/', 1)[-1])
+        return os.path.join(self.cache_dir, f"{hashlib.sha256(url.encode()).hexdigest()[:16]}-{name}")
+
+
+    def git(self, *args):
+        result = subprocess.run(["git", *args], capture_output=True, text=True)
+        if result.returncode != 0:
+            print(f"git {' '.join(args)} failed: {result.stderr.strip()}")
+            raise subprocess.CalledProcessError(result.returncode, ["git", *args], result.stdout, result.stderr)
+        return result
+
+
+    def update_mirror(self, url):
+        # Returns the mirror path; creates the mirror on a miss and fetches it on the first hit of the process
+        path = self.mirror_path(url)
+        with self.key_lock(path):
+            start_time = time.time()
+            if os.path.isdir(path):
+                self.record("hits")
+                if path not in self.fetched:
+                    self.git("-C", path, "fetch", "--prune", "--quiet", "origin")
+                    self.fetched.add(path)
+                print(f"Config repo mirror cache hit for {url}")
+            else:
+                self.record("misses")
+                os.makedirs(self.cache_dir, exist_ok=True)
+                partial_path = f"{path}.partial"
+                shutil.rmtree(partial_path, ignore_errors=True)
+                self.git("clone", "--mirror", "--quiet", url, partial_path)
+                os.rename(partial_path, path)
+                self.fetched.add(path)
+                print(f"Config repo mirror cache miss for {url}, mirror created")
+            self.record("fetch_time", time.time() - start_time)
+        return path
+
+
+    def clone(self, spec, destination):
+        # Clones the repo described by spec ("[--branch X] url") into destination
+        url, branch = parse_repo_spec(spec)
+        branch_args = ["--branch", branch] if branch else []
+        start_time = time.time()
+        try:
+            mirror = self.update_mirror(url)
+            self.git("clone", "--quiet", "--depth", "1", "--single-branch", *branch_args, f"file://{mirror}", destination)
+            self.git("-C", destination, "remote", "set-url", "origin", url)
+        except subprocess.CalledProcessError:
+            # A broken mirror must not break provisioning; clone straight from the remote
+            self.record("fallbacks")
+            print(f"Cloning {url} without the mirror cache")
+            shutil.rmtree(destination, ignore_errors=True)
+            self.git("clone", "--quiet", "--depth", "1", "--single-branch", *branch_args, url, destination)
+        elapsed = time.time() - start_time
+        self.record("clone_time", elapsed)
+        print(f"Config repo cloned to {destination} in {elapsed:.1f}s")
+        return elapsed
+
+
+    def format_stats(self):
+        return (f"Config repo cache: {self.stats['hits']} hit(s), {self.stats['misses']} miss(es), "
+                f"{self.stats['fallbacks']} fallback(s), {self.stats['fetch_time']:.1f}s fetching, "
+                f"{self.stats['clone_time']:.1f}s cloning in total")
+
+
+get_repo_cache = process_wide(RepoMirrorCache)
@@ -0,0 +1,149 @@
+import threading
+import time
+from automation_lib.metrics import get_metrics
+from automation_lib.shared import process_wide
+
+
+class ServerWaiter:
+    """Waits until Hetzner servers are running, with one poller for the whole process.
+
+    Callers register servers together with the VMManager that created them
+    and block until each one is running, gone or past its deadline. A
+    single thread polls all registered servers per interval through
+    VMManager.get_server_statuses, which needs one labelled list request per
+    run ID, so the phases of a fleet waiting for their controllers and
+    agents share one request per interval instead of polling on their own.
+    """
+
+    def __init__(self, initial_interval=1, max_interval=5, backoff=1.5):
+        self.initial_interval = initial_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.condition = threading.Condition()
+        # server_id -> {"server", "manager", "registered", "deadline", "seen", "record"} of the servers not settled yet
+        self.pending = {}
+        # server_id -> seconds from creation to running, None if it did not get there
+        self.results = {}
+        self.interval = initial_interval
+        self.next_poll = 0.0
+        self.thread = None
+
+
+    def wait(self, manager, vms, timeout=300):
+        # Returns a dict server_id -> seconds from creation to running (None if not running)
+        deadline = time.time() + timeout
+        server_ids = [vm["server"]["id"] for vm in vms]
+        with self.condition:
+            for vm in vms:
+                server_id = vm["server"]["id"]
+                if self.results.get(server_id) is not None:
+                    continue
+                # Servers that did not get to running last time are waited for again
+                self.results.pop(server_id, None)
+                entry = self.pending.get(server_id)
+                if entry is not None:
+                    entry["deadline"] = max(entry["deadline"], deadline)
+                    continue
+                self.pending[server_id] = {
+                    "server": vm["server"],
+                    "manager": manager,
+                    "registered": time.time(),
+                    "deadline": deadline,
+                    "seen": False,
+                    # The poller thread records with the caller's metrics context, e.g. its instance
+                    "record": get_metrics().bind(manager.record_running),
+                }
+                # New servers are polled soon even if the interval already backed off
+                self.interval = self.initial_interval
+                self.next_poll = min(self.next_poll, time.time() + self.initial_interval)
+            if self.pending and self.thread is None:
+                self.next_poll = time.time()
+                self.thread = threading.Thread(target=self.poll_loop, daemon=True)
+                self.thread.start()
+            self.condition.notify_all()
+            self.condition.wait_for(lambda: all(server_id in self.results for server_id in server_ids))
+            return {server_id: self.results[server_id] for server_id in server_ids}
+
+
+    def poll_loop(self):
+        while True:
+            with self.condition:
+                while self.pending and time.time() < self.next_poll:
+                    self.condition.wait(self.next_poll - time.time())
+                if not self.pending:
+                    self.thread = None
+                    return
+                pending = dict(self.pending)
+            try:
+                statuses = self.poll(pending)
+            except Exception as e:
+                # A failed poll only costs an interval
+                print(f"Failed to get server status: {e}")
+                statuses = {}
+            with self.condition:
+                self.update(statuses)
+                self.condition.notify_all()
+                if self.pending:
+                    print(f"Waiting for {len(self.pending)} server(s) to be running...")
+                self.interval = min(self.max_interval, self.interval * self.backoff)
+                self.next_poll = time.time() + self.interval
+
+
+    def poll(self, pending):
+        # Returns server_id -> status, None for servers that are gone and "unknown" where the poll failed
+        statuses = {}
+        by_token = {}
+        for server_id, entry in pending.items():
+            by_token.setdefault(entry["manager"].api_token, []).append(server_id)
+        for api_token, server_ids in by_token.items():
+            manager = pending[server_ids[0]]["manager"]
+            headers = {
+                "Authorization": f"Bearer {api_token}",
+            }
+            listed = manager.get_server_statuses([pending[server_id]["server"] for server_id in server_ids], headers)
+            for server_id in server_ids:
+                entry = pending[server_id]
+                if listed is None:
+                    statuses[server_id] = "unknown"
+                elif server_id in listed:
+                    entry["seen"] = True
+                    statuses[server_id] = listed[server_id]
+                elif entry["seen"]:
+                    print(f"Server with ID '{server_id}' not found. Possible deletion.")
+                    statuses[server_id] = None
+                else:
+                    # Not matched by the label selector (yet): look the server up by ID
+                    statuses[server_id] = manager.get_server_status(server_id, headers)
+                    if statuses[server_id] is None:
+                        print(f"Server with ID '{server_id}' not found.")
+        return statuses
+
+
+    def update(self, statuses):
+        now = time.time()
+        for server_id, status in statuses.items():
+            entry = self.pending.get(server_id)
+            if entry is None:
+                continue
+            if status is None:
+                self.settle(server_id, None)
+            elif status == 'running':
+                manager = entry["manager"]
+                elapsed = now - manager.created_at.get(server_id, entry["registered"])
+                manager.time_to_running[server_id] = elapsed
+                print(f"Server {entry['server']['name']} is running after {elapsed:.1f}s.")
+                entry["record"](entry["server"], elapsed)
+                self.settle(server_id, elapsed)
+        for server_id, entry in list(self.pending.items()):
+            if now >= entry["deadline"]:
+                print(f"Timeout waiting for server {entry['server']['name']} to be running.")
+                entry["record"](entry["server"], None)
+                self.settle(server_id, None)
+
+
+    def settle(self, server_id, elapsed):
+        del self.pending[server_id]
+        self.results[server_id] = elapsed
+
+
+get_server_waiter = process_wide(ServerWaiter)
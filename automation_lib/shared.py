@@ -0,0 +1,39 @@
+import threading
+
+
+class KeyedLocks:
+    """Per-key locks and counters of the objects shared by all instances of a run.
+
+    key_lock(key) serializes the work on one key, e.g. the build of one image
+    or the connect to one host, while other keys proceed. self.lock guards
+    the lock table and the counters; subclasses use it for their own state.
+    """
+
+    def __init__(self, stats):
+        self.locks = {}
+        self.lock = threading.Lock()
+        self.stats = dict(stats)
+
+
+    def key_lock(self, key):
+        with self.lock:
+            return self.locks.setdefault(key, threading.Lock())
+
+
+    def record(self, name, value=1):
+        with self.lock:
+            self.stats[name] += value
+
+
+def process_wide(factory):
+    """Return a getter that creates one object with factory on its first call and returns it from then on."""
+    lock = threading.Lock()
+    created = []
+
+    def get():
+        with lock:
+            if not created:
+                created.append(factory())
+            return created[0]
+
+    return get
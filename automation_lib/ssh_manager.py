@@ -1,82 +1,362 @@
+import re
+import select
+import shutil
+from collections import deque
 import paramiko
 import sys
 from scp import SCPClient
+from automation_lib.ssh_pool import get_ssh_pool
+
+
+STEP_MARKER = re.compile(r"__STEP_(START|END)__ (\d+) ([\d.]+)(?: (\d+))?")
+
+
+class CommandStream:
+    """Iterates over the (stream, line) pairs of a running command as they arrive.
+
+    stdout and stderr are read together, so neither can fill its window and
+    block the command. Only the last tail_lines lines are kept; exit_status
+    is set once iteration has finished.
+    """
+
+    def __init__(self, channel, tail_lines=200, chunk_size=32768, max_line_length=65536):
+        self.channel = channel
+        self.chunk_size = chunk_size
+        self.max_line_length = max_line_length
+        self.tail = deque(maxlen=tail_lines)
+        self.exit_status = None
+
+    def __iter__(self):
+        channel = self.channel
+        buffers = {"stdout": b"", "stderr": b""}
+        while True:
+            received = False
+            if channel.recv_ready():
+                buffers["stdout"] += channel.recv(self.chunk_size)
+                received = True
+            if channel.recv_stderr_ready():
+                buffers["stderr"] += channel.recv_stderr(self.chunk_size)
+                received = True
+            for name in buffers:
+                lines = buffers[name].split(b"\n")
+                buffers[name] = lines.pop()
+                if len(buffers[name]) > self.max_line_length:
+                    lines.append(buffers[name])
+                    buffers[name] = b""
+                for line in lines:
+                    yield self.add_line(name, line)
+            if not received:
+                if channel.exit_status_ready() and not channel.recv_ready() and not channel.recv_stderr_ready():
+                    break
+                select.select([channel], [], [], 0.5)
+        for name, rest in buffers.items():
+            if rest:
+                yield self.add_line(name, rest)
+        self.exit_status = channel.recv_exit_status()
+
+    def add_line(self, stream, line):
+        line = line.decode(errors="replace").rstrip("\r")
+        self.tail.append(f"{stream}: {line}" if stream == "stderr" else line)
+        return stream, line
+
+    def tail_text(self):
+        return "\n".join(self.tail)
+
+
+class ChannelWriter:
+    """File-like object that writes into a channel's stdin and counts the bytes."""
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.bytes_written = 0
+
+    def write(self, data):
+        self.channel.sendall(data)
+        self.bytes_written += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
 
 class SSHManager:
 
-    def __init__(self, ip_address, key_file):
+    def __init__(self, ip_address, key_file, collect_output=False, connect_timeout=30, prefix=None, output_limit=5000, user='root', pool=None):
         self.ip_address = ip_address
         self.key_file = key_file
+        self.user = user
+        # Connections come from a pool shared by all SSHManagers of the process
+        self.pool = pool or get_ssh_pool()
         self.ssh = None
+        self.connect_timeout = connect_timeout
+        # Optional prefix for streamed command output, e.g. "[10.0.0.2] "
+        self.prefix = prefix or ""
+        # When collecting, messages are buffered per host (bounded) instead of printed immediately
+        self.output_limit = output_limit
+        self.output = deque(maxlen=output_limit) if collect_output else None
+
+
+    def log(self, message):
+        if self.output is not None:
+            self.output.append(message)
+        else:
+            print(message)
+
+    def clear_output(self):
+        if self.output is not None:
+            self.output.clear()
+
+    def flush_output(self, prefix=""):
+        if self.output:
+            if len(self.output) == self.output_limit:
+                print(f"{prefix}... (earlier output dropped)")
+            for message in self.output:
+                for line in str(message).splitlines():
+                    print(f"{prefix}{line}")
+            self.output.clear()
 
 
     def connect(self):
-        if self.ssh is not None:
+        if self.ssh is not None and self.pool.is_healthy(self.ssh):
             return self.ssh
-        print(f"Connecting to {self.ip_address}")
         try:
-            key = paramiko.RSAKey.from_private_key_file(self.key_file)
-            self.ssh = paramiko.SSHClient()
-            self.ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            self.ssh.connect(self.ip_address, username='root', pkey=key)
-            print("Connected successfully")
+            self.ssh, reused = self.pool.get(self.ip_address, self.key_file, user=self.user, timeout=self.connect_timeout)
+            if not reused:
+                self.log(f"Connected successfully to {self.ip_address}")
             return self.ssh
         except Exception as e:
-            print(f"Failed to connect: {e}")
+            self.ssh = None
+            self.log(f"Failed to connect to {self.ip_address}: {e}")
             return None
 
+    def open_session(self):
+        ssh = self.connect()
+        if ssh is None:
+            raise ConnectionError(f"No SSH connection to {self.ip_address}")
+        try:
+            return ssh.get_transport().open_session()
+        except (paramiko.SSHException, EOFError, OSError):
+            # The connection dropped after the health check; reconnect once
+            self.disconnect()
+            ssh = self.connect()
+            if ssh is None:
+                raise ConnectionError(f"No SSH connection to {self.ip_address}")
+            return ssh.get_transport().open_session()
+
 
 
 
-    def execute_command(self, command):
+    def stream_command(self, command, stdin_data=None, tail_lines=200):
+        # Starts a command and returns a CommandStream; raises if there is no connection
+        channel = self.open_session()
+        channel.exec_command(command)
+        if stdin_data is not None:
+            channel.sendall(stdin_data.encode() if isinstance(stdin_data, str) else stdin_data)
+        channel.shutdown_write()
+        return CommandStream(channel, tail_lines=tail_lines)
+
+    def execute_command(self, command, echo=True):
+        # Streams the output line by line and returns True if the command exited with status 0
         try:
-            ssh = self.connect()
-            if ssh is None:
-                return False
-            stdin, stdout, stderr = ssh.exec_command(command)
-            stdout_str = stdout.read().decode()
-            stderr_str = stderr.read().decode()
-            if stdout_str:
-                print("Command executed successfully")
-                print("Output:", stdout_str)
-            if stderr_str:
-                if "error" in stderr_str.lower():
-                    print("Error:", stderr_str)
-                else:
-                    print("Standard error output (not necessarily an error):", stderr_str)
-            return True
+            stream = self.stream_command(command)
+            for name, line in stream:
+                if echo:
+                    self.log(f"{self.prefix}{line}")
+            if stream.exit_status != 0:
+                self.log(f"Command failed with exit status {stream.exit_status}: {command.splitlines()[0][:100]}")
+                if not echo:
+                    self.log(f"Output: {stream.tail_text()}")
+            return stream.exit_status == 0
         except Exception as e:
-            print(f"Failed to execute command: {e}")
+            self.log(f"Failed to execute command: {e}")
             return False
 
+    def check_command(self, command, timeout=None):
+        # Runs a command and returns its exit status, or None if it could not be run
+        try:
+            channel = self.open_session()
+            if timeout is not None:
+                channel.settimeout(timeout)
+            channel.exec_command(command)
+            channel.shutdown_write()
+            return channel.recv_exit_status()
+        except Exception as e:
+            self.log(f"Failed to execute command: {e}")
+            return None
+
+    def write_to_command(self, command, producer):
+        # Calls producer with a ChannelWriter for the command's stdin; returns the number of bytes
+        # sent, or None on failure. Nothing is staged in a local file.
+        try:
+            channel = self.open_session()
+            channel.exec_command(command)
+            writer = ChannelWriter(channel)
+            producer(writer)
+            channel.shutdown_write()
+            stream = CommandStream(channel, tail_lines=50)
+            for _, line in stream:
+                self.log(f"{self.prefix}{line}")
+            if stream.exit_status != 0:
+                self.log(f"Command failed with exit status {stream.exit_status}: {command.splitlines()[0][:100]}")
+                return None
+            return writer.bytes_written
+        except Exception as e:
+            self.log(f"Failed to stream data into '{command.splitlines()[0][:100]}': {e}")
+            return None
+
+    def pipe_to_command(self, command, fileobj, chunk_size=1048576):
+        # Streams fileobj into the command's stdin; returns the number of bytes sent, or None on failure
+        return self.write_to_command(command, lambda writer: shutil.copyfileobj(fileobj, writer, chunk_size))
+
+    def pipe_from_command(self, command, fileobj, chunk_size=1048576):
+        # Streams the command's stdout into fileobj; returns the number of bytes received, or None on failure
+        try:
+            channel = self.open_session()
+            channel.exec_command(command)
+            channel.shutdown_write()
+            received = 0
+            errors = deque(maxlen=50)
+            while True:
+                busy = False
+                if channel.recv_ready():
+                    chunk = channel.recv(chunk_size)
+                    fileobj.write(chunk)
+                    received += len(chunk)
+                    busy = True
+                if channel.recv_stderr_ready():
+                    # Keep reading stderr so it cannot fill its window and stall the command
+                    errors.extend(channel.recv_stderr(chunk_size).decode(errors="replace").splitlines())
+                    busy = True
+                if not busy:
+                    if channel.exit_status_ready() and not channel.recv_ready() and not channel.recv_stderr_ready():
+                        break
+                    select.select([channel], [], [], 0.5)
+            exit_status = channel.recv_exit_status()
+            if exit_status != 0:
+                self.log(f"Command failed with exit status {exit_status}: {command[:100]}")
+                for line in errors:
+                    self.log(f"{self.prefix}{line}")
+                return None
+            return received
+        except Exception as e:
+            self.log(f"Failed to stream data from '{command[:100]}': {e}")
+            return None
+
+    def build_script(self, steps):
+        # Each step runs in a subshell between timing markers; the script stops at the first failure
+        lines = [
+            "exec 2>&1",
+            "set -o pipefail",
+            "export DEBIAN_FRONTEND=noninteractive",
+        ]
+        for index, step in enumerate(steps):
+            lines += [
+                f"echo \"__STEP_START__ {index} $(date +%s.%N)\"",
+                "(",
+                step,
+                # stdin is the script itself, keep the steps from reading it
+                ") < /dev/null",
+                "__rc=$?",
+                f"printf '\\n__STEP_END__ {index} %s %s\\n' \"$(date +%s.%N)\" \"$__rc\"",
+                "if [ $__rc -ne 0 ]; then exit $__rc; fi",
+            ]
+        return "\n".join(lines) + "\n"
+
+    def execute_script(self, steps, name="script", echo=True):
+        # Sends all steps as one bash script over a single channel. Returns a dict with
+        # success, exit_status, failed_step, per-step durations and the tail of the (marker-free) output.
+        result = {"success": False, "exit_status": None, "failed_step": None, "steps": [], "output": ""}
+        starts = {}
+        output = deque(maxlen=200)
+        blank_pending = False
+        try:
+            stream = self.stream_command("bash -s", stdin_data=self.build_script(steps))
+            for _, line in stream:
+                match = STEP_MARKER.search(line)
+                if match:
+                    # The END marker starts with its own newline; a blank line right before it is ours
+                    blank_pending = False
+                    line = line[:match.start()]
+                    kind, index, timestamp, exit_status = match.groups()
+                    index = int(index)
+                    if kind == "START":
+                        starts[index] = float(timestamp)
+                    else:
+                        result["steps"].append({
+                            "command": steps[index],
+                            "duration": float(timestamp) - starts.get(index, float(timestamp)),
+                            "exit_status": int(exit_status),
+                        })
+                    if not line:
+                        continue
+                if line == "":
+                    blank_pending = True
+                    continue
+                if blank_pending:
+                    output.append("")
+                    if echo:
+                        self.log(self.prefix)
+                    blank_pending = False
+                output.append(line)
+                if echo:
+                    self.log(f"{self.prefix}{line}")
+            result["exit_status"] = stream.exit_status
+        except Exception as e:
+            self.log(f"Failed to execute {name}: {e}")
+            return result
+
+        result["output"] = "\n".join(output)
+        result["success"] = result["exit_status"] == 0 and len(result["steps"]) == len(steps)
+        if not result["success"]:
+            finished = [step for step in result["steps"] if step["exit_status"] == 0]
+            result["failed_step"] = len(finished)
+
+        self.log_script_result(name, steps, result, echo)
+        return result
+
+    def log_script_result(self, name, steps, result, echo=True):
+        total = sum(step["duration"] for step in result["steps"])
+        self.log(f"{name}: {len(result['steps'])}/{len(steps)} steps in {total:.1f}s, exit status {result['exit_status']}")
+        for index, step in enumerate(result["steps"]):
+            self.log(f"  [{index}] {step['duration']:6.1f}s rc={step['exit_status']} {step['command'].splitlines()[0][:100]}")
+        if not result["success"]:
+            failed_step = result["failed_step"]
+            if failed_step is not None and failed_step < len(steps):
+                self.log(f"{name} failed at step {failed_step}: {steps[failed_step].splitlines()[0][:100]}")
+            if not echo:
+                self.log(f"Output: {result['output']}")
+
     def close(self):
-        if self.ssh:
-            self.ssh.close()
-            print("SSH connection closed")
-            self.ssh = None
+        # Releases this manager's use of the pooled connection; the pool keeps it open for reuse
+        self.ssh = None
+
+    def disconnect(self):
+        # Closes the pooled connection to this host for every user of the pool
+        self.ssh = None
+        self.pool.discard(self.ip_address, user=self.user)
+        self.log(f"SSH connection to {self.ip_address} closed")
 
     def copy_file_to_vm(self, local_path, remote_path):
         try:
-            if self.ssh is None:
-                self.connect()
-            with SCPClient(self.ssh.get_transport()) as scp:
+            ssh = self.connect()
+            if ssh is None:
+                return False
+            with SCPClient(ssh.get_transport()) as scp:
                 scp.put(local_path, remote_path)
-            print(f"Copied {local_path} to {remote_path} on the VM")
+            self.log(f"Copied {local_path} to {remote_path} on the VM")
             return True
         except Exception as e:
-            print(f"Failed to copy file: {e}")
+            self.log(f"Failed to copy file: {e}")
             return False
         
     def upload_file(self, local_path, remote_path):
         try:
-            transport = paramiko.Transport((self.ip_address, 22))
-            pkey = paramiko.RSAKey.from_private_key_file(self.key_file)
-            transport.connect(username='root', pkey=pkey)
-            sftp = paramiko.SFTPClient.from_transport(transport)
-            sftp.put(local_path, remote_path)
-            sftp.close()
-            transport.close()
-            print(f"File {local_path} has been uploaded to {remote_path}.")
+            ssh = self.connect()
+            if ssh is None:
+                raise ConnectionError(f"No SSH connection to {self.ip_address}")
+            with ssh.open_sftp() as sftp:
+                sftp.put(local_path, remote_path)
+            self.log(f"File {local_path} has been uploaded to {remote_path}.")
         except Exception as e:
-            print(f"Failed to upload file {local_path} to {remote_path}: {e}")
+            self.log(f"Failed to upload file {local_path} to {remote_path}: {e}")
             sys.exit(1)
@@ -0,0 +1,95 @@
+import os
+import paramiko
+from automation_lib.shared import KeyedLocks, process_wide
+
+
+class SSHConnectionPool(KeyedLocks):
+    """Keeps one authenticated SSH connection per (host, user).
+
+    Exec channels, SFTP and SCP of all SSHManagers for a host share the same
+    transport, so the key exchange happens once per host. Private keys are
+    parsed once per key file.
+    """
+
+    KEY_CLASSES = (paramiko.Ed25519Key, paramiko.ECDSAKey, paramiko.RSAKey)
+
+    def __init__(self, port=None, keepalive=30):
+        # SSH_PORT is for test servers; provisioned VMs listen on 22
+        self.port = port or int(os.getenv('SSH_PORT', '22'))
+        self.keepalive = keepalive
+        self.clients = {}
+        self.keys = {}
+        super().__init__({"connects": 0, "reuses": 0, "reconnects": 0})
+
+
+    def load_key(self, key_file):
+        with self.lock:
+            if key_file in self.keys:
+                return self.keys[key_file]
+        errors = []
+        for key_class in self.KEY_CLASSES:
+            try:
+                key = key_class.from_private_key_file(key_file)
+                break
+            except paramiko.SSHException as e:
+                errors.append(f"{key_class.__name__}: {e}")
+        else:
+            raise paramiko.SSHException(f"Unsupported private key {key_file}: {'; '.join(errors)}")
+        with self.lock:
+            self.keys[key_file] = key
+        return key
+
+
+    def is_healthy(self, client):
+        transport = client.get_transport()
+        if transport is None or not transport.is_active() or not transport.is_authenticated():
+            return False
+        try:
+            transport.send_ignore()
+            return True
+        except Exception:
+            return False
+
+
+    def get(self, host, key_file, user='root', timeout=30):
+        # Returns (client, reused); reconnects when the pooled connection has dropped
+        pool_key = (host, user)
+        with self.key_lock(pool_key):
+            client = self.clients.get(pool_key)
+            if client is not None:
+                if self.is_healthy(client):
+                    self.record("reuses")
+                    return client, True
+                client.close()
+                del self.clients[pool_key]
+                self.record("reconnects")
+            client = paramiko.SSHClient()
+            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+            client.connect(host, port=self.port, username=user, pkey=self.load_key(key_file),
+                           timeout=timeout, banner_timeout=timeout, auth_timeout=timeout,
+                           allow_agent=False, look_for_keys=False)
+            client.get_transport().set_keepalive(self.keepalive)
+            self.clients[pool_key] = client
+            self.record("connects")
+            return client, False
+
+
+    def discard(self, host, user='root'):
+        pool_key = (host, user)
+        with self.key_lock(pool_key):
+            client = self.clients.pop(pool_key, None)
+            if client is not None:
+                client.close()
+
+
+    def shutdown(self):
+        with self.lock:
+            clients = list(self.clients.values())
+            self.clients = {}
+        for client in clients:
+            client.close()
+        if clients:
+            print(f"Closed {len(clients)} pooled SSH connection(s)")
+
+
+get_ssh_pool = process_wide(SSHConnectionPool)
@@ -1,25 +1,50 @@
-import requests
 import time
 import os
 import json
+import uuid
+from automation_lib.http_client import get_http_client
+from automation_lib.bootstrap import render_user_data, recipe_hash
+from automation_lib.metrics import get_metrics
+from automation_lib.server_waiter import get_server_waiter
+
+
+# HCLOUD_API_URL points the managers at another endpoint, e.g. the offline benchmark stand-in
+API_URL = os.getenv('HCLOUD_API_URL', "https://api.hetzner.cloud/v1")
+RUN_ID = uuid.uuid4().hex[:12]
 
 class VMManager:
 
-    def __init__(self, api_token):
+    def __init__(self, api_token, state_dir=None, http_client=None, run_id=None, use_golden_images=None):
         self.controller_vm = None
         self.agent_vms = []
         self.api_token = api_token
+        self.http = http_client or get_http_client()
+        # Servers are labelled with the run ID so they can be polled together; all managers
+        # of a process share it, so a fleet is polled with one request
+        self.run_id = run_id or RUN_ID
+        self.created_at = {}
+        self.time_to_running = {}
+        # Bootstrapped VMs start from the newest golden snapshot of their role if one matches the recipe
+        if use_golden_images is None:
+            use_golden_images = os.getenv('USE_GOLDEN_IMAGES', '1') != '0'
+        self.use_golden_images = use_golden_images
+        self.golden_images = {}
+        # Each fleet instance keeps its VM info in its own directory
+        self.state_dir = state_dir or '.'
+        os.makedirs(self.state_dir, exist_ok=True)
+        self.controller_info_file = os.path.join(self.state_dir, 'controller_vm_info.json')
+        self.agent_info_file = os.path.join(self.state_dir, 'agent_vms_info.json')
 
-        if os.path.exists('controller_vm_info.json'):
-            with open('controller_vm_info.json', 'r') as f:
+        if os.path.exists(self.controller_info_file):
+            with open(self.controller_info_file, 'r') as f:
                 self.controller_vm = json.load(f)
                 
-        if os.path.exists('agent_vms_info.json'):
-            with open('agent_vms_info.json', 'r') as f:
+        if os.path.exists(self.agent_info_file):
+            with open(self.agent_info_file, 'r') as f:
                 self.agent_vms = json.load(f)
 
-    def create_vm(self, vm_type, os_type, server_type, ssh_key, vm_name=None):
-        url = "https://api.hetzner.cloud/v1/servers"
+    def create_vm(self, vm_type, os_type, server_type, ssh_key, vm_name=None, user_data=None, bootstrap=False):
+        url = f"{API_URL}/servers"
         timestamp = int(time.time())
         if vm_name is None:
             vm_name = f"jenkins-{vm_type}-server-{timestamp}"
@@ -34,22 +59,42 @@ class VMManager:
             "image": os_type,
             "location": "fsn1",
             "start_after_create": True,
-            "ssh_keys": [ssh_key]
+            "ssh_keys": [ssh_key],
+            "labels": {
+                "managed-by": "jenkins-automation",
+                "run-id": self.run_id,
+                "role": vm_type
+            }
         }
+        # bootstrap=True installs the role's packages via cloud-init while the VM boots,
+        # unless a golden snapshot with the current recipe already contains them
+        if bootstrap and user_data is None:
+            image_id = self.get_golden_image(vm_type, os_type) if self.use_golden_images else None
+            if image_id:
+                data["image"] = image_id
+            else:
+                user_data = render_user_data(vm_type)
+        if user_data:
+            data["user_data"] = user_data
 
-        response = requests.post(url, headers=headers, json=data)
+        start_time = time.time()
+        response = self.http.post(url, headers=headers, json=data)
+        get_metrics().record("vm_create", time.time() - start_time, start=start_time,
+                             status="ok" if response.status_code == 201 else "error",
+                             role=vm_type, server_type=server_type, golden_image=data["image"] != os_type)
 
         if response.status_code == 201:
             vm_info = response.json()
+            self.created_at[vm_info["server"]["id"]] = time.time()
             if vm_type == "controller":
                 self.controller_vm = vm_info
                 print("Controller VM created successfully")
-                with open('controller_vm_info.json', 'w') as f:
+                with open(self.controller_info_file, 'w') as f:
                     json.dump(self.controller_vm, f)
             elif vm_type == "agent":
                 self.agent_vms.append(vm_info)
                 print(f"Agent VM {vm_name} created successfully")
-                with open('agent_vms_info.json', 'w') as f:
+                with open(self.agent_info_file, 'w') as f:
                     json.dump(self.agent_vms, f)
             return vm_info  # Erfolg, VM-Info zurückgeben
         else:
@@ -61,6 +106,142 @@ class VMManager:
             
             
 
+    def get_golden_image(self, role, os_type):
+        key = (role, os_type)
+        if key not in self.golden_images:
+            self.golden_images[key] = self.find_snapshot(role, recipe_hash(role, os_type))
+            if self.golden_images[key]:
+                print(f"Using golden image {self.golden_images[key]} for {role} VMs")
+        return self.golden_images[key]
+
+
+    def find_snapshot(self, role, recipe):
+        # Newest snapshot built for the role from exactly this recipe
+        headers = {
+            "Authorization": f"Bearer {self.api_token}",
+        }
+        page = 1
+        while page:
+            params = {
+                "type": "snapshot",
+                "label_selector": f"golden-role={role},recipe-hash={recipe}",
+                "sort": "created:desc",
+                "per_page": 50,
+                "page": page,
+            }
+            response = self.http.get(f"{API_URL}/images", headers=headers, params=params)
+            if response.status_code != 200:
+                print("Failed to look up golden images", response.status_code)
+                return None
+            body = response.json()
+            images = [image for image in body.get("images", []) if image.get("status") == "available"]
+            if images:
+                return images[0]["id"]
+            # Snapshots still being created sort first; keep looking on the next page
+            page = ((body.get("meta") or {}).get("pagination") or {}).get("next_page")
+        return None
+
+
+    def list_snapshots(self, role):
+        headers = {
+            "Authorization": f"Bearer {self.api_token}",
+        }
+        # Walk all pages, pruning must see every snapshot of the role
+        images = []
+        page = 1
+        while page:
+            params = {"type": "snapshot", "label_selector": f"golden-role={role}", "per_page": 50, "page": page}
+            response = self.http.get(f"{API_URL}/images", headers=headers, params=params)
+            if response.status_code != 200:
+                print("Failed to list golden images", response.status_code)
+                return []
+            body = response.json()
+            images.extend(body.get("images", []))
+            page = ((body.get("meta") or {}).get("pagination") or {}).get("next_page")
+        return images
+
+
+    def shutdown_vm(self, server_id, timeout=300):
+        headers = {
+            "Authorization": f"Bearer {self.api_token}",
+        }
+        response = self.http.post(f"{API_URL}/servers/{server_id}/actions/shutdown", headers=headers)
+        if response.status_code != 201:
+            print("Failed to shut down server", response.status_code)
+            return False
+        if not self.wait_for_action(response.json()["action"]["id"], timeout=timeout):
+            return False
+        # The shutdown action finishes when the ACPI signal was sent, not when the server is off
+        start_time = time.time()
+        while time.time() - start_time < timeout:
+            response = self.http.get(f"{API_URL}/servers/{server_id}", headers=headers)
+            if response.status_code == 200 and response.json()["server"]["status"] == "off":
+                return True
+            time.sleep(2)
+        print("Timeout waiting for server to power off")
+        return False
+
+
+    def create_snapshot(self, server_id, description, labels, timeout=1800):
+        headers = {
+            "Authorization": f"Bearer {self.api_token}",
+            "Content-Type": "application/json"
+        }
+        data = {
+            "type": "snapshot",
+            "description": description,
+            "labels": labels
+        }
+        response = self.http.post(f"{API_URL}/servers/{server_id}/actions/create_image", headers=headers, json=data)
+        if response.status_code != 201:
+            print("Failed to create snapshot", response.status_code)
+            print(response.json())
+            return None
+        body = response.json()
+        if not self.wait_for_action(body["action"]["id"], timeout=timeout):
+            return None
+        return body["image"]["id"]
+
+
+    def delete_image(self, image_id):
+        headers = {
+            "Authorization": f"Bearer {self.api_token}",
+        }
+        response = self.http.delete(f"{API_URL}/images/{image_id}", headers=headers)
+        if response.status_code in [200, 204]:
+            print(f"Image {image_id} deleted")
+            return True
+        print(f"Failed to delete image {image_id}", response.status_code)
+        return False
+
+
+    def wait_for_action(self, action_id, timeout=600, initial_interval=1, max_interval=10):
+        headers = {
+            "Authorization": f"Bearer {self.api_token}",
+        }
+        start_time = time.time()
+        interval = initial_interval
+        while time.time() - start_time < timeout:
+            response = self.http.get(f"{API_URL}/actions/{action_id}", headers=headers)
+            if response.status_code == 200:
+                action = response.json()["action"]
+                if action["status"] == "success":
+                    return True
+                if action["status"] == "error":
+                    print(f"Action {action['command']} failed: {action.get('error')}")
+                    return False
+            time.sleep(interval)
+            interval = min(max_interval, interval * 1.5)
+        print(f"Timeout waiting for action {action_id}")
+        return False
+
+
+
+    def reset_agent_vms(self):
+        if os.path.exists(self.agent_info_file):
+            os.remove(self.agent_info_file)
+        self.agent_vms = []
+
     def get_vm_ip(self, vm_type, index=None):
         if vm_type == "controller":
             return self.controller_vm["server"]["public_net"]["ipv4"]["ip"]
@@ -76,16 +257,16 @@ class VMManager:
         # Delete Controller VM
         if self.controller_vm:
             server_id = self.controller_vm["server"]["id"]
-            url = f"https://api.hetzner.cloud/v1/servers/{server_id}"
+            url = f"{API_URL}/servers/{server_id}"
             headers = {
                 "Authorization": f"Bearer {self.api_token}",
             }
-            response = requests.delete(url, headers=headers)
+            response = self.http.delete(url, headers=headers)
             if response.status_code in [200, 202, 204]:
                 print("Controller VM deleted successfully")
                 self.controller_vm = None
-                if os.path.exists('controller_vm_info.json'):
-                    os.remove('controller_vm_info.json')
+                if os.path.exists(self.controller_info_file):
+                    os.remove(self.controller_info_file)
             else:
                 print("Failed to delete Controller VM", response.status_code)
                 print(response.json())
@@ -96,11 +277,11 @@ class VMManager:
             for vm_info in self.agent_vms:
                 server_id = vm_info["server"]["id"]
                 vm_name = vm_info["server"]["name"]
-                url = f"https://api.hetzner.cloud/v1/servers/{server_id}"
+                url = f"{API_URL}/servers/{server_id}"
                 headers = {
                     "Authorization": f"Bearer {self.api_token}",
                 }
-                response = requests.delete(url, headers=headers)
+                response = self.http.delete(url, headers=headers)
                 if response.status_code in [200, 202, 204]:
                     print(f"Agent VM '{vm_name}' deleted successfully")
                 else:
@@ -108,14 +289,14 @@ class VMManager:
                     print(response.json())
             # Reset agent_vms list after deletion
             self.agent_vms = []
-            if os.path.exists('agent_vms_info.json'):
-                os.remove('agent_vms_info.json')
+            if os.path.exists(self.agent_info_file):
+                os.remove(self.agent_info_file)
         else:
             print("No Agent VMs to delete")
 
                 
 
-    def wait_for_vm_running(self, vm_type, index=None, timeout=300, interval=10):
+    def wait_for_vm_running(self, vm_type, index=None, timeout=300):
         if vm_type == "controller":
             vm = self.controller_vm
         elif vm_type == "agent":
@@ -132,30 +313,69 @@ class VMManager:
             print(f"{vm_type.capitalize()} VM not available.")
             return False
 
-        server_id = vm["server"]["id"]
-        url = f"https://api.hetzner.cloud/v1/servers/{server_id}"
-        headers = {
-            "Authorization": f"Bearer {self.api_token}",
-        }
-        elapsed = 0
-        while elapsed < timeout:
-            response = requests.get(url, headers=headers)
-            if response.status_code == 200:
-                server_status = response.json()['server']['status']
-                print(f"Server status: {server_status}.")
-                if server_status == 'running':
-                    print(f"{vm_type} Server is running.")
-                    return True
-                else:
-                    print(f"Server status: {server_status}. Waiting...")
-            elif response.status_code == 404:
-                print(f"Server with ID '{server_id}' not found. Possible deletion.")
-                return False
-            else:
-                print(f"Failed to get server status: {response.text}")
-                return False
-            time.sleep(interval)
-            elapsed += interval
-        print("Timeout waiting for server to be ready.")
-        return False
+        if self.wait_for_vms_running([vm], timeout=timeout).get(vm["server"]["id"]) is None:
+            return False
+        print(f"{vm_type} Server is running.")
+        return True
 
+
+
+    def wait_for_vms_running(self, vms=None, timeout=300):
+        # Waits for the given servers (default: controller and agents) through the process-wide
+        # waiter, which polls the servers of all waiting callers with one labelled list request
+        # per interval. Returns a dict server_id -> seconds from creation to running (None if not running).
+        if vms is None:
+            vms = ([self.controller_vm] if self.controller_vm else []) + list(self.agent_vms)
+        return get_server_waiter().wait(self, vms, timeout=timeout)
+
+
+    def record_running(self, server, elapsed):
+        get_metrics().record(
+            "vm_running", elapsed,
+            role=(server.get("labels") or {}).get("role"),
+            server_type=(server.get("server_type") or {}).get("name"),
+            host=((server.get("public_net") or {}).get("ipv4") or {}).get("ip")
+        )
+
+
+    def get_server_status(self, server_id, headers):
+        # Status of one server; None if it does not exist, "unknown" if the request failed
+        response = self.http.get(f"{API_URL}/servers/{server_id}", headers=headers)
+        if response.status_code == 200:
+            return response.json()["server"]["status"]
+        if response.status_code == 404:
+            return None
+        print(f"Failed to get server status: {response.text}")
+        return "unknown"
+
+
+    def get_server_statuses(self, servers, headers):
+        # One GET per run-id label selector; servers without labels fall back to a GET by ID
+        statuses = {}
+        run_ids = set()
+        for server in servers:
+            run_id = (server.get("labels") or {}).get("run-id")
+            if run_id:
+                run_ids.add(run_id)
+            else:
+                status = self.get_server_status(server["id"], headers)
+                if status == "unknown":
+                    return None
+                if status is not None:
+                    statuses[server["id"]] = status
+        for run_id in run_ids:
+            page = 1
+            while page:
+                response = self.http.get(
+                    f"{API_URL}/servers",
+                    headers=headers,
+                    params={"label_selector": f"run-id={run_id}", "per_page": 50, "page": page}
+                )
+                if response.status_code != 200:
+                    print(f"Failed to get server status: {response.text}")
+                    return None
+                body = response.json()
+                for server in body.get("servers", []):
+                    statuses[server["id"]] = server["status"]
+                page = ((body.get("meta") or {}).get("pagination") or {}).get("next_page")
+        return statuses
@@ -0,0 +1,73 @@
+import socket
+import threading
+
+import dns.flags
+import dns.message
+import dns.rcode
+import dns.rdatatype
+import dns.rrset
+
+
+class FakeNameserver:
+    """Authoritative UDP nameserver answering A queries from a FakeHetznerAPI's records.
+
+    Stands in for the zone's nameservers in DNSPropagationChecker, so records
+    show up after the API's propagation_delay.
+    """
+
+    def __init__(self, api):
+        self.api = api
+        self.queries = 0
+        self.lock = threading.Lock()
+        self.sock = None
+
+
+    @property
+    def port(self):
+        return self.sock.getsockname()[1]
+
+
+    def start(self, port=0):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", port))
+        threading.Thread(target=self.serve, daemon=True).start()
+        return self
+
+
+    def stop(self):
+        if self.sock is not None:
+            self.sock.close()
+
+
+    def stats(self):
+        with self.lock:
+            return {"dns queries": self.queries}
+
+
+    def serve(self):
+        while True:
+            try:
+                data, address = self.sock.recvfrom(4096)
+            except OSError:
+                return
+            try:
+                self.sock.sendto(self.answer(data).to_wire(), address)
+            except Exception:
+                continue
+
+
+    def answer(self, data):
+        query = dns.message.from_wire(data)
+        with self.lock:
+            self.queries += 1
+        response = dns.message.make_response(query)
+        response.flags |= dns.flags.AA
+        question = query.question[0]
+        addresses = self.api.resolve(question.name.to_text())
+        if addresses is None:
+            response.set_rcode(dns.rcode.REFUSED)
+        elif not addresses:
+            response.set_rcode(dns.rcode.NXDOMAIN)
+        elif question.rdtype == dns.rdatatype.A:
+            response.answer.append(dns.rrset.from_text_list(question.name, 300, "IN", "A", addresses))
+        return response
@@ -0,0 +1,343 @@
+import itertools
+import json
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+class TokenBucket:
+    """Request budget like the Cloud API's: capacity requests, refilled at refill_rate per second."""
+
+    def __init__(self, capacity, refill_rate):
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.tokens = float(capacity)
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+
+    def take(self):
+        # Returns (allowed, remaining, reset) where reset is the time the bucket is full again
+        with self.lock:
+            now = time.time()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill_rate)
+            self.updated = now
+            allowed = self.tokens >= 1
+            if allowed:
+                self.tokens -= 1
+            reset = now + (self.capacity - self.tokens) / self.refill_rate
+            return allowed, int(self.tokens), int(reset) + 1
+
+
+class FakeHetznerAPI:
+    """Local stand-in for the Hetzner Cloud API (/cloud/v1) and DNS API (/dns/v1).
+
+    Serves the endpoints VMManager and DNSManager call. Servers are running
+    boot_latency seconds after they were created; on_running and on_delete
+    let the SSH and Jenkins stand-ins follow the server lifecycle. DNS
+    records become visible to resolve() propagation_delay seconds after
+    they were written. The Cloud API is rate limited with a token bucket
+    and answers with the RateLimit-* headers and 429 like the real one.
+    """
+
+    def __init__(self, zone_name, boot_latency=3.0, propagation_delay=2.0, api_latency=0.02,
+                 rate_limit=3600, refill_rate=1.0, golden_images=False, on_running=None, on_delete=None):
+        self.zone_name = zone_name
+        self.boot_latency = boot_latency
+        self.propagation_delay = propagation_delay
+        self.api_latency = api_latency
+        self.bucket = TokenBucket(rate_limit, refill_rate)
+        self.golden_images = golden_images
+        self.on_running = on_running
+        self.on_delete = on_delete
+        self.zone = {"id": "zone-1", "name": zone_name, "ttl": 86400}
+        self.servers = {}
+        self.records = {}
+        self.ids = itertools.count(1000)
+        self.addresses = itertools.count(0)
+        self.timers = []
+        self.lock = threading.Lock()
+        # "cloud GET /servers" -> requests; 429 answers are counted as "cloud 429"
+        self.calls = Counter()
+        self.routes = [
+            ("cloud", "POST", r"/servers", self.create_server),
+            ("cloud", "GET", r"/servers", self.list_servers),
+            ("cloud", "GET", r"/servers/(\d+)", self.get_server),
+            ("cloud", "DELETE", r"/servers/(\d+)", self.delete_server),
+            ("cloud", "GET", r"/images", self.list_images),
+            ("cloud", "GET", r"/actions/(\d+)", self.get_action),
+            ("dns", "GET", r"/zones", self.list_zones),
+            ("dns", "GET", r"/records", self.list_records),
+            ("dns", "POST", r"/records", self.create_record),
+            ("dns", "POST", r"/records/bulk", self.bulk_create_records),
+            ("dns", "PUT", r"/records/bulk", self.bulk_update_records),
+            ("dns", "PUT", r"/records/([\w-]+)", self.update_record),
+            ("dns", "DELETE", r"/records/([\w-]+)", self.delete_record),
+        ]
+        self.httpd = None
+
+
+    @property
+    def cloud_url(self):
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}/cloud/v1"
+
+
+    @property
+    def dns_url(self):
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}/dns/v1"
+
+
+    def start(self, port=0):
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), make_handler(self))
+        self.httpd.daemon_threads = True
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+
+    def stop(self):
+        for timer in self.timers:
+            timer.cancel()
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+
+
+    def stats(self):
+        with self.lock:
+            return dict(self.calls)
+
+
+    def count(self, name):
+        with self.lock:
+            self.calls[name] += 1
+
+
+    def dispatch(self, method, url, body):
+        # Returns (status, payload, headers)
+        parsed = urlparse(url)
+        query = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+        for api, route_method, pattern, handler in self.routes:
+            match = re.fullmatch(f"/{api}/v1{pattern}", parsed.path)
+            if match and route_method == method:
+                break
+        else:
+            self.count(f"unknown {method} {parsed.path}")
+            return 404, {"error": {"code": "not_found", "message": f"{method} {parsed.path}"}}, {}
+        headers = {}
+        if api == "cloud":
+            allowed, remaining, reset = self.bucket.take()
+            headers = {"RateLimit-Limit": str(self.bucket.capacity), "RateLimit-Remaining": str(remaining), "RateLimit-Reset": str(reset)}
+            if not allowed:
+                self.count("cloud 429")
+                return 429, {"error": {"code": "rate_limit_exceeded", "message": "limit of requests per hour reached"}}, headers
+        self.count(f"{api} {method} {re.sub(r'[(][^)]*[)]', '{id}', pattern)}")
+        if self.api_latency:
+            time.sleep(self.api_latency)
+        with self.lock:
+            status, payload = handler(query, body, *match.groups())
+        return status, payload, headers
+
+
+    def address(self):
+        # 127.0.0.0/8 is loopback on Linux, so every server gets an address the stand-ins can listen on
+        index = next(self.addresses)
+        return f"127.0.{1 + index // 250}.{1 + index % 250}"
+
+
+    def server_status(self, server):
+        return "running" if time.time() >= server["_running_at"] else "initializing"
+
+
+    def public(self, server):
+        server = {key: value for key, value in server.items() if not key.startswith("_")}
+        server["status"] = self.server_status(self.servers[server["id"]])
+        return server
+
+
+    def action(self, command, resource_id):
+        return {"id": next(self.ids), "command": command, "status": "success", "progress": 100,
+                "resources": [{"id": resource_id, "type": "server"}], "error": None}
+
+
+    def create_server(self, query, body):
+        server_id = next(self.ids)
+        now = time.time()
+        server = {
+            "id": server_id,
+            "name": body["name"],
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S+00:00", time.gmtime(now)),
+            "server_type": {"name": body.get("server_type")},
+            "image": {"id": body.get("image")} if isinstance(body.get("image"), int) else {"name": body.get("image")},
+            "labels": body.get("labels") or {},
+            "public_net": {"ipv4": {"ip": self.address()}},
+            "_running_at": now + self.boot_latency,
+            "_user_data": bool(body.get("user_data")),
+        }
+        self.servers[server_id] = server
+        if self.on_running is not None:
+            timer = threading.Timer(self.boot_latency, self.on_running, (server["public_net"]["ipv4"]["ip"], server["_user_data"]))
+            timer.daemon = True
+            timer.start()
+            self.timers.append(timer)
+        return 201, {"server": self.public(server), "action": self.action("create_server", server_id), "root_password": None}
+
+
+    def list_servers(self, query, body):
+        selector = dict(part.split("=", 1) for part in query.get("label_selector", "").split(",") if "=" in part)
+        servers = [
+            self.public(server) for server in self.servers.values()
+            if all(server["labels"].get(key) == value for key, value in selector.items())
+        ]
+        per_page = int(query.get("per_page", 25))
+        page = int(query.get("page", 1))
+        last_page = max(1, (len(servers) + per_page - 1) // per_page)
+        return 200, {
+            "servers": servers[(page - 1) * per_page:page * per_page],
+            "meta": {"pagination": {"page": page, "per_page": per_page, "last_page": last_page,
+                                    "next_page": page + 1 if page < last_page else None, "total_entries": len(servers)}},
+        }
+
+
+    def get_server(self, query, body, server_id):
+        server = self.servers.get(int(server_id))
+        if server is None:
+            return 404, {"error": {"code": "not_found", "message": f"server {server_id} not found"}}
+        return 200, {"server": self.public(server)}
+
+
+    def delete_server(self, query, body, server_id):
+        server = self.servers.pop(int(server_id), None)
+        if server is None:
+            return 404, {"error": {"code": "not_found", "message": f"server {server_id} not found"}}
+        if self.on_delete is not None:
+            threading.Thread(target=self.on_delete, args=(server["public_net"]["ipv4"]["ip"],), daemon=True).start()
+        return 200, {"action": self.action("delete_server", int(server_id))}
+
+
+    def list_images(self, query, body):
+        # With golden_images every role has an up-to-date snapshot
+        images = []
+        selector = query.get("label_selector", "")
+        if self.golden_images and "golden-role=" in selector:
+            role = selector.split("golden-role=", 1)[1].split(",", 1)[0]
+            images.append({"id": 500 + len(role), "type": "snapshot", "status": "available", "labels": {"golden-role": role}})
+        return 200, {"images": images}
+
+
+    def get_action(self, query, body, action_id):
+        return 200, {"action": {"id": int(action_id), "command": "unknown", "status": "success", "progress": 100, "error": None}}
+
+
+    def list_zones(self, query, body):
+        zones = [self.zone] if query.get("name") in (None, self.zone_name) else []
+        return 200, {"zones": zones, "meta": {"pagination": {"page": 1, "per_page": 100, "last_page": 1, "total_entries": len(zones)}}}
+
+
+    def list_records(self, query, body):
+        records = [self.public_record(record) for record in self.records.values() if record["zone_id"] == query.get("zone_id")]
+        per_page = int(query.get("per_page", 100))
+        page = int(query.get("page", 1))
+        last_page = max(1, (len(records) + per_page - 1) // per_page)
+        return 200, {
+            "records": records[(page - 1) * per_page:page * per_page],
+            "meta": {"pagination": {"page": page, "per_page": per_page, "last_page": last_page, "total_entries": len(records)}},
+        }
+
+
+    def public_record(self, record):
+        return {key: value for key, value in record.items() if not key.startswith("_")}
+
+
+    def write_record(self, data, record_id=None):
+        record_id = record_id or f"rec-{next(self.ids)}"
+        record = {
+            "id": record_id,
+            "type": data["type"],
+            "name": data["name"],
+            "value": data["value"],
+            "ttl": data.get("ttl"),
+            "zone_id": data["zone_id"],
+            "_visible_at": time.time() + self.propagation_delay,
+        }
+        self.records[record_id] = record
+        return self.public_record(record)
+
+
+    def create_record(self, query, body):
+        return 200, {"record": self.write_record(body)}
+
+
+    def update_record(self, query, body, record_id):
+        if record_id not in self.records:
+            return 404, {"error": {"code": "not_found", "message": f"record {record_id} not found"}}
+        return 200, {"record": self.write_record(body, record_id)}
+
+
+    def delete_record(self, query, body, record_id):
+        if self.records.pop(record_id, None) is None:
+            return 404, {"error": {"code": "not_found", "message": f"record {record_id} not found"}}
+        return 200, {}
+
+
+    def bulk_create_records(self, query, body):
+        return 200, {"records": [self.write_record(data) for data in body.get("records", [])], "invalid_records": []}
+
+
+    def bulk_update_records(self, query, body):
+        records = [self.write_record(data, data["id"]) for data in body.get("records", []) if data.get("id") in self.records]
+        failed = [data for data in body.get("records", []) if data.get("id") not in self.records]
+        return 200, {"records": records, "failed_records": failed}
+
+
+    def resolve(self, fqdn):
+        # A records of fqdn that have propagated; None if the zone does not contain the name
+        name = fqdn.rstrip(".")
+        suffix = f".{self.zone_name}"
+        if not name.endswith(suffix):
+            return None
+        name = name[:-len(suffix)]
+        now = time.time()
+        with self.lock:
+            return [
+                record["value"] for record in self.records.values()
+                if record["name"] == name and record["type"] == "A" and record["_visible_at"] <= now
+            ]
+
+
+def make_handler(api):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def handle_request(self, method):
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length) or b"{}") if length else {}
+            status, payload, headers = api.dispatch(method, self.path, body)
+            content = json.dumps(payload).encode()
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def do_GET(self):
+            self.handle_request("GET")
+
+        def do_POST(self):
+            self.handle_request("POST")
+
+        def do_PUT(self):
+            self.handle_request("PUT")
+
+        def do_DELETE(self):
+            self.handle_request("DELETE")
+
+    return Handler
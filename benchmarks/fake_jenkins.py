@@ -0,0 +1,231 @@
+import itertools
+import json
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+class FakeJenkinsHost:
+
+    def __init__(self, ip, ready_at):
+        self.ip = ip
+        self.ready_at = ready_at
+        self.queue = {}
+        self.builds = {}
+        self.queue_ids = itertools.count(1)
+        self.build_numbers = itertools.count(1)
+        self.httpd = None
+        self.stopped = False
+
+
+class FakeJenkins:
+    """Jenkins REST stand-in, started on the controller's address by `docker run`.
+
+    The HTTP port opens port_delay seconds after the container start and
+    answers 503 until startup_seconds have passed. Implements the endpoints
+    JenkinsReadinessWaiter, python-jenkins and JenkinsJobManager use:
+    whoAmI, queue items, tree-filtered job and build status and
+    progressiveText. Each job in jobs runs for its number of seconds and
+    succeeds; job names ending in "-fail" fail.
+    """
+
+    def __init__(self, jobs, port=8080, port_delay=1.0, startup_seconds=4.0, queue_seconds=0.5, log_lines_per_second=20):
+        self.jobs = jobs
+        self.port = port
+        self.port_delay = port_delay
+        self.startup_seconds = startup_seconds
+        self.queue_seconds = queue_seconds
+        self.log_lines_per_second = log_lines_per_second
+        self.hosts = {}
+        self.lock = threading.Lock()
+        self.calls = Counter()
+
+
+    def stats(self):
+        with self.lock:
+            return dict(self.calls)
+
+
+    def count(self, name):
+        with self.lock:
+            self.calls[name] += 1
+
+
+    def start_host(self, ip):
+        host = FakeJenkinsHost(ip, time.time() + self.startup_seconds)
+        with self.lock:
+            previous = self.hosts.pop(ip, None)
+            self.hosts[ip] = host
+        if previous is not None:
+            self.stop_jenkins(previous)
+        timer = threading.Timer(self.port_delay, self.listen, (host,))
+        timer.daemon = True
+        timer.start()
+
+
+    def stop_host(self, ip):
+        with self.lock:
+            host = self.hosts.pop(ip, None)
+        if host is not None:
+            self.stop_jenkins(host)
+
+
+    def stop(self):
+        for ip in list(self.hosts):
+            self.stop_host(ip)
+
+
+    def stop_jenkins(self, host):
+        host.stopped = True
+        if host.httpd is not None:
+            threading.Thread(target=host.httpd.shutdown, daemon=True).start()
+            host.httpd.server_close()
+
+
+    def listen(self, host):
+        if host.stopped:
+            return
+        host.httpd = ThreadingHTTPServer((host.ip, self.port), make_handler(self, host))
+        host.httpd.daemon_threads = True
+        threading.Thread(target=host.httpd.serve_forever, daemon=True).start()
+
+
+    def start_build(self, host, item):
+        # Queue items are picked up by an executor queue_seconds after they were triggered
+        if "build" not in item and time.time() - item["queued_at"] >= self.queue_seconds:
+            number = next(host.build_numbers)
+            item["build"] = number
+            host.builds[(item["job"], number)] = {"started_at": time.time(), "queue_id": item["id"]}
+        return item.get("build")
+
+
+    def build_state(self, job, build):
+        duration = self.jobs[job]
+        elapsed = time.time() - build["started_at"]
+        done = elapsed >= duration
+        result = ("FAILURE" if job.endswith("-fail") else "SUCCESS") if done else None
+        return {
+            "building": not done,
+            "result": result,
+            "duration": int(duration * 1000) if done else 0,
+            "estimatedDuration": int(duration * 1000),
+            "timestamp": int(build["started_at"] * 1000),
+        }
+
+
+    def console_text(self, job, build):
+        state = self.build_state(job, build)
+        elapsed = min(time.time() - build["started_at"], self.jobs[job])
+        lines = [f"[{job}] step {index}" for index in range(int(elapsed * self.log_lines_per_second))]
+        if not state["building"]:
+            lines.append(f"Finished: {state['result']}")
+        return ("\n".join(lines) + "\n" if lines else "").encode(), state["building"]
+
+
+    def handle(self, host, method, url):
+        # Returns (status, body, headers, content type)
+        parsed = urlparse(url)
+        path = parsed.path
+        query = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+        if time.time() < host.ready_at:
+            self.count("jenkins 503")
+            return 503, b"<html>Please wait while Jenkins is getting ready</html>", {}, "text/html"
+        with self.lock:
+            return self.route(host, method, path, query)
+
+
+    def route(self, host, method, path, query):
+        if path.startswith("/crumbIssuer"):
+            self.calls["jenkins GET /crumbIssuer"] += 1
+            return 404, b"", {}, "text/plain"
+        if path in ("/whoAmI/api/json", "/me/api/json"):
+            self.calls[f"jenkins GET {path}"] += 1
+            return 200, json.dumps({"name": "admin", "fullName": "admin", "authenticated": True}).encode(), {}, "application/json"
+        match = re.fullmatch(r"/job/([^/]+)/build(WithParameters)?", path)
+        if match and method == "POST":
+            self.calls["jenkins POST /job/{name}/build"] += 1
+            job = match.group(1)
+            if job not in self.jobs:
+                return 404, b"", {}, "text/plain"
+            queue_id = next(host.queue_ids)
+            host.queue[queue_id] = {"id": queue_id, "job": job, "queued_at": time.time()}
+            return 201, b"", {"Location": f"http://{host.ip}:{self.port}/queue/item/{queue_id}/"}, "text/plain"
+        match = re.fullmatch(r"/queue/item/(\d+)/api/json", path)
+        if match:
+            self.calls["jenkins GET /queue/item/{id}"] += 1
+            item = host.queue.get(int(match.group(1)))
+            if item is None:
+                return 404, b"", {}, "text/plain"
+            number = self.start_build(host, item)
+            body = {"executable": {"number": number}} if number else {"why": "Waiting for next available executor"}
+            return 200, json.dumps(body).encode(), {}, "application/json"
+        if path == "/api/json":
+            self.calls["jenkins GET /api/json"] += 1
+            return 200, json.dumps({"jobs": self.job_list(host)}).encode(), {}, "application/json"
+        match = re.fullmatch(r"/job/([^/]+)/(\d+)/api/json", path)
+        if match:
+            self.calls["jenkins GET /job/{name}/{number}"] += 1
+            build = host.builds.get((match.group(1), int(match.group(2))))
+            if build is None:
+                return 404, b"", {}, "text/plain"
+            return 200, json.dumps(self.build_state(match.group(1), build)).encode(), {}, "application/json"
+        match = re.fullmatch(r"/job/([^/]+)/(\d+)/logText/progressiveText", path)
+        if match:
+            self.calls["jenkins GET /job/{name}/{number}/logText"] += 1
+            build = host.builds.get((match.group(1), int(match.group(2))))
+            if build is None:
+                return 404, b"", {}, "text/plain"
+            text, more_data = self.console_text(match.group(1), build)
+            headers = {"X-Text-Size": str(len(text))}
+            if more_data:
+                headers["X-More-Data"] = "true"
+            return 200, text[int(query.get("start", 0)):], headers, "text/plain;charset=UTF-8"
+        self.calls[f"jenkins unknown {method} {path}"] += 1
+        return 404, b"", {}, "text/plain"
+
+
+    def job_list(self, host):
+        jobs = []
+        for job in self.jobs:
+            for item in host.queue.values():
+                if item["job"] == job:
+                    self.start_build(host, item)
+            builds = [
+                {"number": number, "queueId": build["queue_id"], **self.build_state(job, build)}
+                for (name, number), build in sorted(host.builds.items(), reverse=True) if name == job
+            ]
+            jobs.append({"name": job, "builds": builds})
+        return jobs
+
+
+def make_handler(jenkins, host):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def handle_request(self, method):
+            length = int(self.headers.get("Content-Length") or 0)
+            if length:
+                self.rfile.read(length)
+            status, body, headers, content_type = jenkins.handle(host, method, self.path)
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            self.handle_request("GET")
+
+        def do_POST(self):
+            self.handle_request("POST")
+
+    return Handler
@@ -0,0 +1,251 @@
+import logging
+import re
+import socket
+import threading
+import time
+from collections import Counter
+
+import paramiko
+
+
+# Handshakes cut short by the banner probes would be logged as errors
+logging.getLogger("paramiko").setLevel(logging.CRITICAL)
+
+STEP = re.compile(r'echo "__STEP_START__ (\d+) [^\n]*\n\(\n(.*?)\n\) < /dev/null', re.DOTALL)
+TIMEOUT = re.compile(r"timeout (\d+) ")
+
+# (pattern, seconds, label); the first match decides how long a command takes
+COMMAND_TIMES = [
+    (r"docker build .*--cache-from", 1.0, "docker build (cached)"),
+    (r"docker build", 4.0, "docker build"),
+    (r"docker save", 0.5, "docker save"),
+    (r"docker load", 0.5, "docker load"),
+    (r"docker run", 0.5, "docker run"),
+    (r"docker inspect", 0.05, "docker inspect"),
+    (r"docker logs", 0.05, "docker logs"),
+    (r"apt-get|apt install", 2.0, "apt-get"),
+    (r"certbot", 1.5, "certbot"),
+    (r"curl ", 0.3, "download"),
+    (r"tar -xzf", 0.1, "config sync"),
+    (r"cloud-init status", 0.0, "cloud-init"),
+]
+DEFAULT_COMMAND_TIME = 0.05
+
+
+class FakeHost:
+
+    def __init__(self, ip, cloud_init_done_at):
+        self.ip = ip
+        self.cloud_init_done_at = cloud_init_done_at
+        self.containers = set()
+        self.sock = None
+        self.transports = set()
+        self.stopped = False
+
+
+class FakeSSHInterface(paramiko.ServerInterface):
+
+    def __init__(self, server, host):
+        self.server = server
+        self.host = host
+
+    def check_auth_publickey(self, username, key):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def get_allowed_auths(self, username):
+        return "publickey"
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_exec_request(self, channel, command):
+        threading.Thread(target=self.server.run_command, args=(self.host, channel, command.decode()), daemon=True).start()
+        return True
+
+
+class FakeSSHServer:
+    """paramiko server standing in for the provisioned VMs.
+
+    Every server the FakeHetznerAPI boots gets a listener on its loopback
+    address once sshd would be up. Commands are not executed: each one
+    takes the time of the first matching COMMAND_TIMES entry (scaled by
+    time_scale) and succeeds. `bash -s` scripts from execute_script are
+    split into their steps and answered with the step markers, cloud-init
+    finishes cloud_init_seconds after boot when the server got user data,
+    and `docker run` starts Jenkins through on_container_start.
+    """
+
+    def __init__(self, port, time_scale=1.0, sshd_delay=0.5, cloud_init_seconds=5.0, image_bytes=8 * 1048576,
+                 command_times=None, on_container_start=None):
+        self.port = port
+        self.time_scale = time_scale
+        self.sshd_delay = sshd_delay
+        self.cloud_init_seconds = cloud_init_seconds
+        self.image_bytes = image_bytes
+        self.command_times = [(re.compile(pattern), seconds, label) for pattern, seconds, label in (command_times or COMMAND_TIMES)]
+        self.on_container_start = on_container_start
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self.hosts = {}
+        self.lock = threading.Lock()
+        self.counters = Counter()
+
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters)
+
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+
+    def start_host(self, ip, user_data=False):
+        # Called when the server is running; sshd answers sshd_delay seconds later
+        now = time.time()
+        host = FakeHost(ip, now + self.sshd_delay + (self.cloud_init_seconds if user_data else 0.0))
+        with self.lock:
+            self.hosts[ip] = host
+        timer = threading.Timer(self.sshd_delay, self.listen, (host,))
+        timer.daemon = True
+        timer.start()
+
+
+    def stop_host(self, ip):
+        with self.lock:
+            host = self.hosts.pop(ip, None)
+        if host is None:
+            return
+        host.stopped = True
+        if host.sock is not None:
+            host.sock.close()
+        for transport in list(host.transports):
+            transport.close()
+
+
+    def stop(self):
+        for ip in list(self.hosts):
+            self.stop_host(ip)
+
+
+    def listen(self, host):
+        if host.stopped:
+            return
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((host.ip, self.port))
+        sock.listen(64)
+        host.sock = sock
+        threading.Thread(target=self.accept, args=(host,), daemon=True).start()
+
+
+    def accept(self, host):
+        while not host.stopped:
+            try:
+                connection, _ = host.sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self.serve_connection, args=(host, connection), daemon=True).start()
+
+
+    def serve_connection(self, host, connection):
+        transport = paramiko.Transport(connection)
+        transport.add_server_key(self.host_key)
+        host.transports.add(transport)
+        try:
+            transport.start_server(server=FakeSSHInterface(self, host))
+        except (paramiko.SSHException, EOFError, OSError):
+            # Banner probes close the connection right after the server's banner
+            host.transports.discard(transport)
+            return
+        self.count("ssh connections")
+        while transport.is_active():
+            transport.join(1)
+        host.transports.discard(transport)
+
+
+    def command_time(self, command):
+        for pattern, seconds, label in self.command_times:
+            if pattern.search(command):
+                return seconds * self.time_scale, label
+        return DEFAULT_COMMAND_TIME * self.time_scale, "other"
+
+
+    def read_stdin(self, channel):
+        data = []
+        while True:
+            chunk = channel.recv(1048576)
+            if not chunk:
+                break
+            data.append(chunk)
+        data = b"".join(data)
+        self.count("ssh bytes in", len(data))
+        return data
+
+
+    def send(self, channel, data):
+        data = data.encode() if isinstance(data, str) else data
+        channel.sendall(data)
+        self.count("ssh bytes out", len(data))
+
+
+    def run_command(self, host, channel, command):
+        self.count("ssh round trips")
+        try:
+            stdin = self.read_stdin(channel)
+            if command == "bash -s":
+                exit_status = self.run_script(host, channel, stdin.decode(errors="replace"))
+            else:
+                exit_status = self.simulate(host, channel, command)
+            channel.send_exit_status(exit_status)
+        except (OSError, EOFError, paramiko.SSHException):
+            pass
+        finally:
+            channel.close()
+
+
+    def run_script(self, host, channel, script):
+        self.count("command script")
+        for index, step in STEP.findall(script):
+            self.send(channel, f"__STEP_START__ {index} {time.time():.6f}\n")
+            exit_status = self.simulate(host, channel, step)
+            self.send(channel, f"\n__STEP_END__ {index} {time.time():.6f} {exit_status}\n")
+            if exit_status != 0:
+                return exit_status
+        return 0
+
+
+    def simulate(self, host, channel, command):
+        # Returns the exit status of the command
+        seconds, label = self.command_time(command)
+        self.count(f"command {label}")
+        if label == "cloud-init":
+            remaining = host.cloud_init_done_at - time.time()
+            timeout = TIMEOUT.search(command)
+            if timeout and remaining > int(timeout.group(1)):
+                time.sleep(int(timeout.group(1)))
+                return 124
+            time.sleep(max(0.0, remaining))
+            return 0
+        if label == "docker inspect":
+            return 0 if "jenkins" in host.containers else 1
+        time.sleep(seconds)
+        if label == "docker save":
+            chunk = b"\0" * 1048576
+            for offset in range(0, self.image_bytes, len(chunk)):
+                self.send(channel, chunk[:self.image_bytes - offset])
+            return 0
+        if label == "docker run":
+            host.containers.add("jenkins")
+            if self.on_container_start is not None:
+                self.on_container_start(host.ip)
+            self.send(channel, "f00dfeedcafe\n")
+            return 0
+        if label == "docker logs":
+            self.send(channel, "Jenkins is starting\n")
+            return 0
+        if label not in ("other", "config sync", "docker load"):
+            self.send(channel, f"{label}: done\n")
+        return 0
@@ -0,0 +1,385 @@
+"""Offline end-to-end benchmark of the provisioning scripts.
+
+Runs scripts/create_environment.py and scripts/main.py against local
+stand-ins for everything they talk to:
+
+  - the Hetzner Cloud and DNS APIs (fake_hetzner.py), with boot latency and
+    a rate limit,
+  - the VMs' SSH servers (fake_ssh.py), which simulate command durations,
+  - Jenkins (fake_jenkins.py), started by `docker run` on the controller,
+  - the zone's nameserver (fake_dns.py) for the propagation checks.
+
+The scripts reach them through HCLOUD_API_URL, HETZNER_DNS_API_URL,
+SSH_PORT, DNS_CHECK_NAMESERVERS and DNS_CHECK_PORT. Every server gets its
+own 127.0.x.y address, so this needs Linux, where all of 127.0.0.0/8 is
+loopback, and a free port 8080 on those addresses.
+
+For N instances with M agents each, the flows create_environment,
+test_pipeline and cleanup are run in order. Wall-clock time, API calls by
+endpoint, SSH connections and round trips and Jenkins requests are
+reported per flow and compared with the stored baseline:
+
+    python benchmarks/run_benchmark.py --instances 2 --agents 3
+    python benchmarks/run_benchmark.py --update-baseline
+    python benchmarks/run_benchmark.py --check --tolerance 0.2 --min-wall-delta 1
+
+--time-scale scales every simulated duration; the baseline is kept per
+scenario (instances, agents, bootstrap mode, golden images, time scale).
+"""
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import paramiko
+
+from fake_dns import FakeNameserver
+from fake_hetzner import FakeHetznerAPI
+from fake_jenkins import FakeJenkins
+from fake_ssh import FakeSSHServer
+
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCHMARK_DIR)
+DEFAULT_BASELINE = os.path.join(BENCHMARK_DIR, "baseline.json")
+ZONE_NAME = "bench.test"
+SUBDOMAIN = "jenkins"
+FLOWS = ("create_environment", "test_pipeline", "cleanup")
+# Report columns: metric -> header. Status polls make the counts vary a little between runs,
+# so every metric is compared with the baseline within the tolerance.
+METRICS = {
+    "wall_seconds": "wall s",
+    "cloud_api_calls": "cloud API",
+    "dns_api_calls": "DNS API",
+    "rate_limited": "429s",
+    "ssh_connections": "SSH conns",
+    "ssh_round_trips": "SSH round trips",
+    "jenkins_requests": "Jenkins reqs",
+    "dns_queries": "DNS queries",
+}
+
+
+class StandIns:
+    """Starts the fakes and wires the server lifecycle between them."""
+
+    def __init__(self, args):
+        scale = args.time_scale
+        self.jenkins = FakeJenkins(
+            {"smoke-test": 3.0 * scale, "smoke-lint": 1.5 * scale},
+            port_delay=1.0 * scale, startup_seconds=4.0 * scale, queue_seconds=0.5 * scale
+        )
+        self.ssh = FakeSSHServer(
+            args.ssh_port or free_port(), time_scale=scale, sshd_delay=0.5 * scale,
+            cloud_init_seconds=5.0 * scale, image_bytes=args.image_mib * 1048576,
+            on_container_start=self.jenkins.start_host
+        )
+        self.api = FakeHetznerAPI(
+            ZONE_NAME, boot_latency=3.0 * scale, propagation_delay=2.0 * scale, api_latency=args.api_latency,
+            rate_limit=args.rate_limit, refill_rate=args.refill_rate, golden_images=args.golden_images,
+            on_running=self.ssh.start_host, on_delete=self.stop_host
+        )
+        self.nameserver = FakeNameserver(self.api)
+
+
+    def start(self):
+        self.api.start()
+        self.nameserver.start()
+        return self
+
+
+    def stop(self):
+        self.ssh.stop()
+        self.jenkins.stop()
+        self.nameserver.stop()
+        self.api.stop()
+
+
+    def stop_host(self, ip):
+        self.ssh.stop_host(ip)
+        self.jenkins.stop_host(ip)
+
+
+    def snapshot(self):
+        counters = {}
+        for fake in (self.api, self.ssh, self.jenkins, self.nameserver):
+            counters.update(fake.stats())
+        return counters
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def create_config_repo(path, num_agents):
+    # A config repo like the real ones: Dockerfile, plugins and a JCasC file with num_agents SSH agents
+    os.makedirs(path)
+    nodes = [
+        {"permanent": {
+            "name": f"agent-{index + 1}",
+            "remoteFS": "/home/jenkins",
+            "labelString": "docker",
+            "launcher": {"ssh": {"host": "0.0.0.0", "port": 22, "credentialsId": "ssh-private-key"}},
+        }}
+        for index in range(num_agents)
+    ]
+    files = {
+        "Dockerfile": "FROM jenkins/jenkins:lts\nCOPY plugins.txt /usr/share/jenkins/ref/plugins.txt\n"
+                      "COPY jenkins.yaml /var/jenkins_home/casc_configs/jenkins.yaml\n",
+        "plugins.txt": "configuration-as-code\nssh-slaves\nworkflow-aggregator\n",
+        "jenkins.yaml": json.dumps({"jenkins": {"systemMessage": "benchmark", "nodes": nodes}}, indent=2),
+    }
+    for name, content in files.items():
+        with open(os.path.join(path, name), 'w') as f:
+            f.write(content)
+    git = ["git", "-C", path, "-c", "user.name=benchmark", "-c", "user.email=benchmark@localhost"]
+    subprocess.run(git + ["init", "--quiet"], check=True)
+    subprocess.run(git + ["add", "."], check=True)
+    subprocess.run(git + ["commit", "--quiet", "-m", "Benchmark config"], check=True)
+
+
+def base_environment(args, stand_ins, workdir, key_file):
+    env = dict(os.environ)
+    env.update({
+        "PYTHONPATH": os.pathsep.join(filter(None, [REPO_ROOT, os.environ.get("PYTHONPATH")])),
+        "PYTHONUNBUFFERED": "1",
+        "HCLOUD_API_URL": stand_ins.api.cloud_url,
+        "HETZNER_DNS_API_URL": stand_ins.api.dns_url,
+        "SSH_PORT": str(stand_ins.ssh.port),
+        "DNS_CHECK_NAMESERVERS": "127.0.0.1",
+        "DNS_CHECK_PORT": str(stand_ins.nameserver.port),
+        "DNS_CHECK_RESOLVERS": "",
+        "H_API_TOKEN": "benchmark",
+        "H_DNS_API_TOKEN": "benchmark",
+        "H_SSH_PRIVATE_KEY": key_file,
+        "SSH_KEY_NAME": "benchmark",
+        "JENKINS_USER": "admin",
+        "JENKINS_PASS": "admin",
+        "SUBDOMAIN": SUBDOMAIN,
+        "ZONE_NAME": ZONE_NAME,
+        "SERVER_TYPE": "cx22",
+        "JOB_NAME": "smoke-test",
+        "SMOKE_TEST_JOBS": "smoke-*",
+        "SSL_EMAIL": "benchmark@localhost",
+        "NUM_INSTANCES": str(args.instances),
+        "BOOTSTRAP_MODE": args.bootstrap,
+        "USE_GOLDEN_IMAGES": "1" if args.golden_images else "0",
+        # Cold caches unless --cache-dir points at the caches of an earlier run
+        "CONFIG_REPO_CACHE_DIR": os.path.join(args.cache_dir or workdir, "cache", "repos"),
+        "JENKINS_IMAGE_CACHE_DIR": os.path.join(args.cache_dir or workdir, "cache", "images"),
+        "JCASC_INDEX_CACHE": os.path.join(args.cache_dir or workdir, "cache", "jcasc_agents.json"),
+        "METRICS_PROM_FILE": "",
+    })
+    return env
+
+
+def flow_commands(flow, args, workdir, config_repo):
+    # Returns [(argv, cwd, extra environment)] run one after the other
+    create_environment = os.path.join(REPO_ROOT, "scripts", "create_environment.py")
+    cleanup_environment = os.path.join(REPO_ROOT, "scripts", "cleanup_environment.py")
+    main = os.path.join(REPO_ROOT, "scripts", "main.py")
+    if flow == "create_environment":
+        return [([sys.executable, create_environment, "--config-repo", config_repo], workdir, {})]
+    if flow == "test_pipeline":
+        return [([sys.executable, main, "test_pipeline"], os.path.join(workdir, "instance_0"), {})]
+    return [([sys.executable, cleanup_environment], workdir, {})]
+
+
+def summarize_counters(before, after):
+    delta = {name: after.get(name, 0) - before.get(name, 0) for name in after}
+    delta = {name: value for name, value in delta.items() if value}
+    return {
+        "cloud_api_calls": sum(value for name, value in delta.items() if name.startswith("cloud ") and name != "cloud 429"),
+        "dns_api_calls": sum(value for name, value in delta.items() if name.startswith("dns ") and name != "dns queries"),
+        "rate_limited": delta.get("cloud 429", 0),
+        "ssh_connections": delta.get("ssh connections", 0),
+        "ssh_round_trips": delta.get("ssh round trips", 0),
+        "jenkins_requests": sum(value for name, value in delta.items() if name.startswith("jenkins ")),
+        "dns_queries": delta.get("dns queries", 0),
+        "calls": dict(sorted(delta.items())),
+    }
+
+
+def run_flow(flow, args, stand_ins, env, workdir, config_repo):
+    log_path = os.path.join(workdir, f"{flow}.log")
+    metrics_dir = os.path.join(workdir, "metrics")
+    before = stand_ins.snapshot()
+    exit_codes = []
+    start_time = time.time()
+    with open(log_path, 'w') as log:
+        for index, (argv, cwd, extra_env) in enumerate(flow_commands(flow, args, workdir, config_repo)):
+            process_env = dict(env, **extra_env, METRICS_JSON_FILE=os.path.join(metrics_dir, f"{flow}_{index}.json"))
+            process = subprocess.Popen(argv, cwd=cwd, env=process_env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+            for line in process.stdout:
+                log.write(line)
+                if args.verbose:
+                    print(f"[{flow}] {line}", end="")
+            exit_codes.append(process.wait(timeout=args.timeout))
+    result = {"wall_seconds": round(time.time() - start_time, 2), "exit_codes": exit_codes, "log": log_path}
+    result.update(summarize_counters(before, stand_ins.snapshot()))
+    result["phases"] = read_phases(metrics_dir, flow)
+    return result
+
+
+def read_phases(metrics_dir, flow):
+    # Phase summary of the scripts' own metrics report, merged over the flow's processes
+    phases = {}
+    if not os.path.isdir(metrics_dir):
+        return phases
+    for name in sorted(os.listdir(metrics_dir)):
+        if not name.startswith(f"{flow}_"):
+            continue
+        try:
+            with open(os.path.join(metrics_dir, name)) as f:
+                summary = json.load(f).get("summary", {})
+        except (OSError, ValueError):
+            continue
+        for phase, values in summary.items():
+            merged = phases.setdefault(phase, {"count": 0, "errors": 0, "total": 0.0, "max": 0.0})
+            merged["count"] += values["count"]
+            merged["errors"] += values["errors"]
+            merged["total"] = round(merged["total"] + values["total"], 3)
+            merged["max"] = round(max(merged["max"], values["max"]), 3)
+    return phases
+
+
+def scenario_name(args):
+    name = f"{args.instances}x{args.agents}-{args.bootstrap}"
+    if args.golden_images:
+        name += "-golden"
+    if args.time_scale != 1.0:
+        name += f"-scale{args.time_scale:g}"
+    return name
+
+
+def compare(results, baseline, tolerance, min_wall_delta=0.0):
+    # Prints current against baseline; returns the list of regressions. Wall times only regress
+    # by more than min_wall_delta seconds, process startup alone varies that much on short flows
+    regressions = []
+    width = max(len(header) for header in METRICS.values())
+    for flow, result in results.items():
+        print(f"\n{flow} (exit codes {result['exit_codes']}):")
+        expected = (baseline or {}).get(flow, {})
+        for metric, header in METRICS.items():
+            value = result[metric]
+            line = f"  {header:<{width}} {value:>10}"
+            if metric in expected:
+                reference = expected[metric]
+                change = (value - reference) / reference * 100 if reference else 0.0
+                line += f"  baseline {reference:>10}  {change:+6.1f}%"
+                slack = min_wall_delta if metric == "wall_seconds" else 0.0
+                if value > reference * (1 + tolerance) and value - reference > slack:
+                    line += "  REGRESSION"
+                    regressions.append(f"{flow} {metric}: {value} > {reference}")
+            print(line)
+        for phase, values in result["phases"].items():
+            average = values["total"] / values["count"] if values["count"] else 0
+            print(f"    phase {phase:<18} {values['count']:>3}x avg {average:6.2f}s max {values['max']:6.2f}s")
+    return regressions
+
+
+def load_baseline(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"scenarios": {}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end provisioning benchmark")
+    parser.add_argument("--instances", type=int, default=2, help="Jenkins instances (NUM_INSTANCES)")
+    parser.add_argument("--agents", type=int, default=2, help="SSH agents per instance in the generated JCasC file")
+    parser.add_argument("--flows", default=",".join(FLOWS), help=f"Comma separated flows out of {', '.join(FLOWS)}")
+    parser.add_argument("--bootstrap", choices=["cloud-init", "ssh"], default="cloud-init", help="BOOTSTRAP_MODE of the scripts")
+    parser.add_argument("--golden-images", action="store_true", help="The API offers a golden snapshot for every role")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="Factor for all simulated durations")
+    parser.add_argument("--api-latency", type=float, default=0.02, help="Seconds the fake API takes per request")
+    parser.add_argument("--rate-limit", type=int, default=3600, help="Cloud API request budget")
+    parser.add_argument("--refill-rate", type=float, default=1.0, help="Cloud API requests refilled per second")
+    parser.add_argument("--image-mib", type=int, default=8, help="Size of the simulated `docker save` output")
+    parser.add_argument("--ssh-port", type=int, default=0, help="Port of the fake SSH servers (default: a free port)")
+    parser.add_argument("--cache-dir", help="Reuse the repo, image and JCasC caches in this directory (warm runs)")
+    parser.add_argument("--timeout", type=int, default=900, help="Seconds a script may run")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline file")
+    parser.add_argument("--update-baseline", action="store_true", help="Store this run as the scenario's baseline")
+    parser.add_argument("--check", action="store_true", help="Exit with 1 on regressions against the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative increase over the baseline")
+    parser.add_argument("--min-wall-delta", type=float, default=1.0,
+                        help="Wall-time increases up to this many seconds are never regressions")
+    parser.add_argument("--output", help="Write the full report as JSON")
+    parser.add_argument("--keep", action="store_true", help="Keep the working directory with logs and state files")
+    parser.add_argument("--verbose", action="store_true", help="Print the scripts' output")
+    args = parser.parse_args()
+
+    flows = [flow.strip() for flow in args.flows.split(",") if flow.strip()]
+    unknown = [flow for flow in flows if flow not in FLOWS]
+    if unknown:
+        parser.error(f"Unknown flows {unknown}")
+
+    workdir = tempfile.mkdtemp(prefix="jenkins-benchmark-")
+    key_file = os.path.join(workdir, "id_rsa")
+    paramiko.RSAKey.generate(2048).write_private_key_file(key_file)
+    config_repo = os.path.join(workdir, "config-repo")
+    create_config_repo(config_repo, args.agents)
+
+    stand_ins = StandIns(args).start()
+    env = base_environment(args, stand_ins, workdir, key_file)
+    scenario = scenario_name(args)
+    print(f"Benchmark {scenario}: {args.instances} instance(s) x {args.agents} agent(s), working directory {workdir}")
+
+    results = {}
+    try:
+        for flow in flows:
+            print(f"Running {flow}...")
+            results[flow] = run_flow(flow, args, stand_ins, env, workdir, config_repo)
+            print(f"  {flow} finished in {results[flow]['wall_seconds']:.1f}s, exit codes {results[flow]['exit_codes']}")
+    finally:
+        stand_ins.stop()
+
+    baseline = load_baseline(args.baseline)
+    regressions = compare(results, baseline["scenarios"].get(scenario, {}).get("flows"), args.tolerance, args.min_wall_delta)
+    failed = [flow for flow, result in results.items() if any(results[flow]["exit_codes"])]
+    for flow in failed:
+        print(f"\n{flow} failed, see {results[flow]['log']}")
+
+    report = {
+        "scenario": scenario,
+        "settings": {key: value for key, value in vars(args).items() if key not in ("baseline", "output", "verbose", "keep", "check", "update_baseline", "tolerance", "min_wall_delta")},
+        "flows": results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}")
+
+    if args.update_baseline:
+        if failed:
+            print("Not updating the baseline from a failed run")
+        else:
+            baseline["scenarios"][scenario] = {
+                "settings": report["settings"],
+                "flows": {flow: {metric: result[metric] for metric in METRICS} for flow, result in results.items()},
+            }
+            with open(args.baseline, 'w') as f:
+                json.dump(baseline, f, indent=2, sort_keys=True)
+                f.write("\n")
+            print(f"Baseline for {scenario} written to {args.baseline}")
+
+    if args.keep or failed:
+        print(f"Working directory kept: {workdir}")
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if failed or (args.check and regressions):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
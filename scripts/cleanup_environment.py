@@ -0,0 +1,55 @@
+import os
+import sys
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from automation_lib import VMManager, DNSManager, get_http_client, get_metrics, prefix_instance_output
+
+
+def delete_instance_vms(instance_number, settings):
+    """Delete the controller and agent VMs of one instance created by create_environment.py."""
+    with get_metrics().context(server_type=settings['server_type'], instance=instance_number):
+        vm_manager = VMManager(settings['api_token'], state_dir=f"instance_{instance_number}")
+        vm_manager.delete_vms()
+
+
+def main():
+    """Tear down the instances set up by create_environment.py."""
+
+    parser = argparse.ArgumentParser(description='Clean up Jenkins environments')
+    parser.add_argument('--max-parallel', type=int, default=int(os.getenv('MAX_PARALLEL', '5')),
+                        help='Maximum number of instances torn down concurrently')
+    args = parser.parse_args()
+
+    settings = {
+        'api_token': os.getenv('H_API_TOKEN'),
+        'dns_api_token': os.getenv('H_DNS_API_TOKEN'),
+        'subdomain': os.getenv('SUBDOMAIN'),
+        'zone_name': os.getenv('ZONE_NAME'),
+        'server_type': os.getenv('SERVER_TYPE'),
+    }
+    num_instances = int(os.getenv('NUM_INSTANCES', '1'))
+    max_parallel = max(1, min(args.max_parallel, num_instances))
+    print(f"Cleaning up {num_instances} instance(s) with up to {max_parallel} in parallel")
+
+    prefix_instance_output()
+    with ThreadPoolExecutor(max_workers=max_parallel) as executor:
+        list(executor.map(lambda instance_number: delete_instance_vms(instance_number, settings), range(num_instances)))
+
+    # The records of all instances are resolved from one listing of the zone
+    success = True
+    if settings['dns_api_token']:
+        domains = [f"{settings['subdomain']}-{instance_number}.{settings['zone_name']}" for instance_number in range(num_instances)]
+        dns_manager = DNSManager(settings['dns_api_token'], settings['zone_name'])
+        success = dns_manager.delete_dns_records(domains)
+    else:
+        print("DNS configuration missing")
+
+    print(get_http_client().format_stats())
+    get_metrics().export(labels={"command": "cleanup_environment"})
+    if not success:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,9 +3,102 @@ import sys
 import time
 import argparse
 
-from automation_lib import VMManager, DNSManager
+from automation_lib import VMManager, DNSManager, get_http_client, get_ssh_pool, get_image_cache, get_repo_cache, get_metrics, PhaseScheduler, prefix_instance_output
 from automation_lib.environment_manager import EnvironmentManager
 
+
+def add_instance_phases(scheduler, instance, num_instances, settings, config_repo_url, dns_manager):
+    """Add the phases setting up one instance to scheduler, grouped by the instance number."""
+
+    instance_number = instance['instance']
+    domain = instance['domain']
+    prefix = f"{instance_number}:"
+
+    # Every instance gets its own VMManager and state directory so parallel runs don't share VM info
+    vm_manager = VMManager(settings['api_token'], state_dir=f"instance_{instance_number}")
+
+    # Initialize EnvironmentManager
+    env_manager = EnvironmentManager(
+        vm_manager=vm_manager,
+        key_file=settings['ssh_private_key'],
+        jenkins_user=settings['jenkins_user'],
+        jenkins_pass=settings['jenkins_pass'],
+        job_name=settings['job_name'],
+        os_type=settings['os_type'],
+        server_type=settings['server_type'],
+        ssh_key=settings['ssh_key']
+    )
+    instance['env_manager'] = env_manager
+
+    def create_controller():
+        print(f"Creating instance {instance_number}/{num_instances} for domain {domain}")
+        # Create Controller-VM with unique name
+        controller_name = f"jenkins-controller-{instance_number}-{int(time.time())}"
+        if vm_manager.create_vm(
+            vm_type="controller",
+            os_type=settings['os_type'],
+            server_type=settings['server_type'],
+            ssh_key=settings['ssh_key'],
+            vm_name=controller_name,
+            bootstrap=env_manager.cloud_init_bootstrap
+        ) is None:
+            raise RuntimeError(f"Controller VM {controller_name} could not be created")
+        # Remove old agent info
+        vm_manager.reset_agent_vms()
+
+    def create_dns_record():
+        # The controller's IP is known as soon as the server is created, so the record
+        # propagates while Jenkins is installed. Records of instances created together
+        # are sent in one bulk upsert
+        if dns_manager is None:
+            print("DNS configuration missing")
+            return False
+        return dns_manager.create_dns_record_batched(domain, vm_manager.get_vm_ip("controller"))
+
+    def test_jenkins():
+        if not env_manager.test_jenkins():
+            raise RuntimeError("Jenkins is not running")
+        print(f"Jenkins is up and running for {domain}")
+
+    def report():
+        print(f"Environment successfully set up for {domain}")
+
+    controller = scheduler.add(f"{prefix}create_controller", create_controller, group=instance_number)
+    jenkins_ready = env_manager.add_jenkins_phases(scheduler, config_repo_url, controller_phase=controller,
+                                                   prefix=prefix, group=instance_number)
+    tested = scheduler.add(f"{prefix}test_jenkins", test_jenkins, requires=[jenkins_ready], group=instance_number)
+    dns_record = scheduler.add(f"{prefix}dns_record", create_dns_record, requires=[controller], group=instance_number)
+    nginx = env_manager.add_nginx_phases(scheduler, domain, dns_phase=dns_record, prefix=prefix, group=instance_number)
+    scheduler.add(f"{prefix}done", report, requires=[tested, nginx], group=instance_number)
+
+
+def record_results(scheduler, instances):
+    """Fill in success, error and duration of every instance from its phases."""
+    for instance in instances:
+        failed = scheduler.failed(instance['instance'])
+        instance['success'] = not failed
+        # Skipped phases only follow from the failed ones
+        errors = [f"{phase['name']}: {phase['error'] or 'failed'}" for phase in failed if phase['status'] == "failed"]
+        instance['error'] = "; ".join(errors) or None
+        start, end = scheduler.group_times(instance['instance'])
+        instance['duration'] = end - start if start is not None else 0.0
+
+
+def print_summary(results):
+    print("\nProvisioning summary:")
+    for result in sorted(results, key=lambda r: r['instance']):
+        status = "OK" if result['success'] else "FAILED"
+        line = f"  [{status}] instance {result['instance']} ({result['domain']}) in {result['duration']:.0f}s"
+        env_manager = result['env_manager']
+        if env_manager is not None and env_manager.jenkins_ready_time is not None:
+            line += f", Jenkins ready {env_manager.jenkins_ready_time:.0f}s after start"
+        if result['error']:
+            line += f": {result['error']}"
+        print(line)
+    succeeded = sum(1 for r in results if r['success'])
+    print(f"{succeeded}/{len(results)} instances set up successfully")
+
+
 def main():
     """Set up Jenkins environments by creating VMs and configuring Jenkins instances."""
 
@@ -13,102 +106,69 @@ def main():
     parser = argparse.ArgumentParser(description='Setup Jenkins environment')
     parser.add_argument('--config-repo', help='The URL of the Jenkins configuration repository', required=True)
     parser.add_argument('--branch', help='The branch of the configuration repository to use', default=None)
+    parser.add_argument('--max-parallel', type=int, default=int(os.getenv('MAX_PARALLEL', '5')),
+                        help='Maximum number of instances provisioned concurrently')
     args = parser.parse_args()
-    
+
     # Prepare configuration repository URL
     config_repo = args.config_repo
     branch = args.branch
     config_repo_url = f"--branch {branch} {config_repo}" if branch else config_repo
-    
+
     # Load environment variables
-    api_token = os.getenv('H_API_TOKEN')
-    dns_api_token = os.getenv('H_DNS_API_TOKEN')
-    jenkins_user = os.getenv('JENKINS_USER')
-    jenkins_pass = os.getenv('JENKINS_PASS')
-    subdomain = os.getenv('SUBDOMAIN')
-    zone_name = os.getenv('ZONE_NAME')
-    ssh_private_key = os.getenv('H_SSH_PRIVATE_KEY')
-    ssh_key = os.getenv('SSH_KEY_NAME')
-    job_name = os.getenv('JOB_NAME')
+    settings = {
+        'api_token': os.getenv('H_API_TOKEN'),
+        'dns_api_token': os.getenv('H_DNS_API_TOKEN'),
+        'jenkins_user': os.getenv('JENKINS_USER'),
+        'jenkins_pass': os.getenv('JENKINS_PASS'),
+        'subdomain': os.getenv('SUBDOMAIN'),
+        'zone_name': os.getenv('ZONE_NAME'),
+        'ssh_private_key': os.getenv('H_SSH_PRIVATE_KEY'),
+        'ssh_key': os.getenv('SSH_KEY_NAME'),
+        'job_name': os.getenv('JOB_NAME'),
+        'server_type': os.getenv('SERVER_TYPE'),
+        'os_type': "ubuntu-22.04",
+    }
     num_instances = int(os.getenv('NUM_INSTANCES', '1'))
-    server_type = os.getenv('SERVER_TYPE')
-    os_type = "ubuntu-22.04"
-    
-    # Initialize VMManager
-    vm_manager = VMManager(api_token)
-    
-    # Loop to create Jenkins instances
-    for instance_number in range(0, num_instances):
-        domain = f"{subdomain}-{instance_number}.{zone_name}"
-        print(f"Creating instance {instance_number}/{num_instances} for domain {domain}")
-    
-        # Initialize EnvironmentManager
-        env_manager = EnvironmentManager(
-            vm_manager=vm_manager,
-            key_file=ssh_private_key,
-            jenkins_user=jenkins_user,
-            jenkins_pass=jenkins_pass,
-            job_name=job_name,
-            os_type=os_type,
-            server_type=server_type,
-            ssh_key=ssh_key
-        )
-
-        # Create Controller-VM with unique name 
-        controller_name = f"jenkins-controller-{instance_number}-{int(time.time())}"
-        vm_manager.create_vm(
-            vm_type="controller",
-            os_type=os_type,
-            server_type=server_type,
-            ssh_key=ssh_key,
-            vm_name=controller_name
-        )
-        
-        # Remove old agent info
-        agent_info_file = 'agent_vms_info.json'
-        if os.path.exists(agent_info_file):
-            os.remove(agent_info_file)
-        vm_manager.agent_vms = []
-        
-
-        # Wait for controller VM to be ready and configure Jenkins
-        try:
-                if not env_manager.wait_until_ready("controller"):
-                    print(f"Controller-VM ist nicht bereit.")
-                    sys.exit(1)
-
-                # Setup Jenkins            
-                print("Setting up Jenkins...")
-                env_manager.setup_jenkins(config_repo_url)
-                if env_manager.test_jenkins():
-                        print("Jenkins is up and running")
-                else:
-                    print("Jenkins is not running")
-                    sys.exit(1)
-                    
-
-                # Create Jenkins Job
-                # env_manager.trigger_and_monitor_job()
-
-                # Create DNS record
-                if dns_api_token:
-                    dns_manager = DNSManager(dns_api_token, zone_name)
-                    ip_address = vm_manager.get_vm_ip("controller")
-                    dns_manager.create_dns_record(domain, ip_address)
-                else:
-                    print("DNS configuration missing")
-                    
-                # Setup Nginx
-                env_manager.setup_nginx(domain)
-                print("Nginx setup completed")
-                
-                print(f"Environment successfully set up for {domain}")
-                
-        except Exception as e:
-            print(f"Error setting up the environment for {domain}: {e}")
-            sys.exit(1)
-            
-            
-if __name__ == "__main__":        
+    max_parallel = max(1, min(args.max_parallel, num_instances))
+    print(f"Provisioning {num_instances} instance(s) with up to {max_parallel} in parallel")
+
+    instances = [
+        {
+            'instance': instance_number,
+            'domain': f"{settings['subdomain']}-{instance_number}.{settings['zone_name']}",
+            'success': True,
+            'error': None,
+            'duration': 0.0,
+            'env_manager': None,
+        }
+        for instance_number in range(0, num_instances)
+    ]
+
+    # All instances share one phase graph; at most max_parallel instances are in flight,
+    # within an instance every phase starts as soon as its inputs are there
+    scheduler = PhaseScheduler(max_groups=max_parallel)
+    # Lines printed by the phases of an instance are labelled with its number
+    prefix_instance_output()
+    dns_manager = DNSManager(settings['dns_api_token'], settings['zone_name']) if settings['dns_api_token'] else None
+    for instance in instances:
+        # Spans recorded by the phases carry the server type and their instance number
+        with get_metrics().context(server_type=settings['server_type'], instance=instance['instance']):
+            add_instance_phases(scheduler, instance, num_instances, settings, config_repo_url, dns_manager)
+    scheduler.run()
+    record_results(scheduler, instances)
+
+    print_summary(instances)
+    print(scheduler.format_critical_path())
+    print(get_http_client().format_stats())
+    print(get_image_cache().format_stats())
+    print(get_repo_cache().format_stats())
+    get_metrics().export(labels={"command": "create_environment"})
+    get_ssh_pool().shutdown()
+    if not all(instance['success'] for instance in instances):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
     main()
-    
\ No newline at end of file
+
@@ -1,9 +1,10 @@
 import argparse
+import atexit
 import sys
 import os
 import json
 
-from automation_lib import VMManager, DNSManager
+from automation_lib import VMManager, DNSManager, ImageBuilder, get_ssh_pool, get_metrics
 from automation_lib.environment_manager import EnvironmentManager
 
 def main():
@@ -11,10 +12,18 @@ def main():
     
     # Parse command-line arguments
     parser = argparse.ArgumentParser(description='CI Pipeline: Validates the environment setup')
-    parser.add_argument('command', choices=['create_jenkins', 'test_pipeline', 'create_dns', 'setup_nginx', 'cleanup'])
+    parser.add_argument('command', choices=['create_jenkins', 'test_pipeline', 'create_dns', 'setup_nginx', 'cleanup', 'build_image'])
     parser.add_argument('--config-repo', help='URL of the configuration repository')
     parser.add_argument('--branch', help='The branch of the configuration repository to use', default=None)
+    parser.add_argument('--role', choices=['controller', 'agent', 'all'], default='all', help='Golden image to build (build_image)')
+    parser.add_argument('--force', action='store_true', help='Rebuild the golden image even if the recipe is unchanged (build_image)')
+    parser.add_argument('--jobs', type=lambda value: [job.strip() for job in value.split(',') if job.strip()],
+                        default=os.getenv('SMOKE_TEST_JOBS'),
+                        help='Comma separated jobs or glob patterns to run in parallel (test_pipeline, default: JOB_NAME)')
     args = parser.parse_args()
+
+    # Phase timings are written on every exit, including the sys.exit calls of failed steps
+    atexit.register(get_metrics().export, name=f"provisioning_metrics_{args.command}", labels={"command": args.command})
     
     if args.command == 'create_jenkins' and not args.config_repo:
         print("Error: --config-repo is required for create_jenkins")
@@ -39,6 +48,7 @@ def main():
     server_type = os.getenv('SERVER_TYPE')
     os_type = "ubuntu-22.04"
     domain = f"{subdomain}.{zone_name}"
+    get_metrics().set_context(server_type=server_type)
     
     # Initialize managers
     vm_manager = VMManager(api_token)
@@ -59,21 +69,15 @@ def main():
             vm_type="controller", 
             os_type=os_type, 
             server_type=server_type, 
-            ssh_key=ssh_key
+            ssh_key=ssh_key,
+            bootstrap=env_manager.cloud_init_bootstrap
         )
         
         # Remove old agent info
-        agent_info_file = 'agent_vms_info.json'
-        if os.path.exists(agent_info_file):
-            os.remove(agent_info_file)
-        vm_manager.agent_vms = []
+        vm_manager.reset_agent_vms()
         
         try:
-            if not env_manager.wait_until_ready("controller"):
-                print("Controller VM is not ready.")
-                sys.exit(1)
-
-            # Setup Jenkins
+            # Setup Jenkins; the phases overlap with the boot of the controller
             print("Setting up Jenkins...")
             env_manager.setup_jenkins(config_repo_url)
             if env_manager.test_jenkins():
@@ -99,16 +103,16 @@ def main():
         if not env_manager.vm_ip:
             print("Controller VM IP not found.")
             sys.exit(1)
-            
-            if env_manager.initialize_jenkins_job_manager():
-                if env_manager.trigger_and_monitor_job():
-                    print("Pipeline test successful")
-                else:
-                    print("Pipeline test failed")
-                    sys.exit(1)
+
+        if env_manager.initialize_jenkins_job_manager():
+            if env_manager.trigger_and_monitor_job(jobs=args.jobs):
+                print("Pipeline test successful")
             else:
-                print("Failed to initialize Jenkins job manager")
+                print("Pipeline test failed")
                 sys.exit(1)
+        else:
+            print("Failed to initialize Jenkins job manager")
+            sys.exit(1)
                     
     elif args.command == 'create_dns':
             dns_manager = DNSManager(dns_api_token, zone_name)
@@ -128,14 +132,25 @@ def main():
             print("Controller VM is not ready.")
             sys.exit(1)
             
-        env_manager.setup_nginx(domain)
+        if not env_manager.setup_nginx(domain):
+            print("Nginx setup failed")
+            sys.exit(1)
         print("Nginx setup completed")
 
+    elif args.command == 'build_image':
+        builder = ImageBuilder(api_token, ssh_private_key, server_type, ssh_key, os_type=os_type)
+        roles = ['controller', 'agent'] if args.role == 'all' else [args.role]
+        for role in roles:
+            if builder.build(role, force=args.force) is None:
+                print(f"Failed to build golden {role} image")
+                sys.exit(1)
+
     elif args.command == 'cleanup':
         env_manager.cleanup(delete_vm=True)
         dns_manager = DNSManager(dns_api_token, zone_name=zone_name)
-        dns_manager.delete_dns_record(domain)
+        dns_manager.delete_dns_records([domain])
 
+    get_ssh_pool().shutdown()
 
 
 if __name__ == '__main__':
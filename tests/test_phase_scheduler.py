@@ -0,0 +1,139 @@
+import threading
+import time
+
+import pytest
+
+from automation_lib.phase_scheduler import PhaseScheduler
+
+
+def recorder(log, name, result=None, duration=0.0):
+    def phase():
+        log.append(("start", name))
+        time.sleep(duration)
+        log.append(("end", name))
+        return result
+    return phase
+
+
+def test_phases_run_after_their_requirements():
+    log = []
+    scheduler = PhaseScheduler()
+    scheduler.add("c", recorder(log, "c"), requires=["a", "b"])
+    scheduler.add("a", recorder(log, "a"))
+    scheduler.add("b", recorder(log, "b"), requires=["a"])
+    assert scheduler.run()
+    assert log.index(("end", "a")) < log.index(("start", "b"))
+    assert log.index(("end", "b")) < log.index(("start", "c"))
+
+
+def test_independent_phases_overlap():
+    # Both phases only pass the barrier if they run at the same time
+    barrier = threading.Barrier(2, timeout=5)
+    scheduler = PhaseScheduler()
+    scheduler.add("a", barrier.wait)
+    scheduler.add("b", barrier.wait)
+    assert scheduler.run()
+
+
+def test_failure_skips_dependents_but_not_after_phases():
+    log = []
+    scheduler = PhaseScheduler()
+    scheduler.add("fails", recorder(log, "fails", result=False))
+    scheduler.add("dependent", recorder(log, "dependent"), requires=["fails"])
+    scheduler.add("transitive", recorder(log, "transitive"), requires=["dependent"])
+    scheduler.add("cleanup", recorder(log, "cleanup"), after=["fails", "dependent"])
+    assert not scheduler.run()
+    assert scheduler.phases["fails"]["status"] == "failed"
+    assert scheduler.phases["dependent"]["status"] == "skipped"
+    assert scheduler.phases["transitive"]["status"] == "skipped"
+    assert scheduler.phases["cleanup"]["status"] == "ok"
+    assert ("start", "dependent") not in log
+    assert [phase["name"] for phase in scheduler.failed()] == ["fails", "dependent", "transitive"]
+
+
+def test_exceptions_fail_only_their_phase():
+    def raises():
+        raise RuntimeError("boom")
+
+    scheduler = PhaseScheduler()
+    scheduler.add("raises", raises, group=0)
+    scheduler.add("ok", lambda: None, group=1)
+    assert not scheduler.run()
+    assert scheduler.phases["raises"]["status"] == "failed"
+    assert scheduler.phases["raises"]["error"] == "boom"
+    assert scheduler.failed(group=1) == []
+
+
+def test_sys_exit_is_not_swallowed():
+    def exits():
+        raise SystemExit(1)
+
+    scheduler = PhaseScheduler()
+    scheduler.add("exits", exits)
+    with pytest.raises(SystemExit):
+        scheduler.run()
+
+
+def test_invalid_graphs_are_rejected():
+    scheduler = PhaseScheduler()
+    scheduler.add("a", lambda: None)
+    with pytest.raises(ValueError):
+        scheduler.add("a", lambda: None)
+
+    scheduler = PhaseScheduler()
+    scheduler.add("a", lambda: None, requires=["missing"])
+    with pytest.raises(ValueError, match="unknown phase missing"):
+        scheduler.run()
+
+    scheduler = PhaseScheduler()
+    scheduler.add("a", lambda: None, requires=["c"])
+    scheduler.add("b", lambda: None, requires=["a"])
+    scheduler.add("c", lambda: None, after=["b"])
+    with pytest.raises(ValueError, match="cycle"):
+        scheduler.run()
+
+
+def test_max_groups_limits_groups_in_flight():
+    log = []
+    scheduler = PhaseScheduler(max_groups=1)
+    for group in range(3):
+        scheduler.add(f"{group}:first", recorder(log, group, duration=0.02), group=group)
+        scheduler.add(f"{group}:second", recorder(log, group, duration=0.02), requires=[f"{group}:first"], group=group)
+    assert scheduler.run()
+    # With one group in flight, each group's phases run without another group in between
+    groups = [name for event, name in log]
+    assert groups == sorted(groups)
+    times = [scheduler.group_times(group) for group in range(3)]
+    for (_, end), (next_start, _) in zip(times, times[1:]):
+        assert end <= next_start
+
+
+def test_max_workers_limits_running_phases():
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def phase():
+        with lock:
+            running.append(1)
+            peak.append(len(running))
+        time.sleep(0.02)
+        with lock:
+            running.pop()
+
+    scheduler = PhaseScheduler(max_workers=2)
+    for index in range(6):
+        scheduler.add(f"p{index}", phase)
+    assert scheduler.run()
+    assert max(peak) == 2
+
+
+def test_critical_path_follows_the_latest_dependency():
+    scheduler = PhaseScheduler()
+    scheduler.add("short", lambda: time.sleep(0.01))
+    scheduler.add("long", lambda: time.sleep(0.1))
+    scheduler.add("join", lambda: None, requires=["short", "long"])
+    scheduler.add("side", lambda: None, requires=["short"])
+    assert scheduler.run()
+    assert [phase["name"] for phase in scheduler.critical_path()] == ["long", "join"]
+    assert scheduler.format_critical_path().startswith("Critical path (")